@@ -1,14 +1,27 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 import logging
 import requests
-import re
-from prompts import get_prompt
-from pymongo import MongoClient
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from prompts import get_prompt, get_template, TYPE_KEYS, SOLVE_MAX_TOKENS, EXPLAIN_MAX_TOKENS, YOUTUBE_CHAT_PROMPT, YOUTUBE_CHAT_MAX_TOKENS
+from budget import PromptTooLarge, count_tokens, fit_prompt, plan_max_tokens, prompt_tokens
+from cache import ResponseCache, make_cache_key
+from transcripts import TranscriptStore, extract_video_id
+from retrieval import select_context
+from summarize import SUMMARY_MAP_WORKERS, summarize_transcript
+from openai_client import OpenAIClient, CircuitOpenError, build_session
+from streaming import SectionStreamParser, sse_event
+from singleflight import SingleFlight, MongoLease, SINGLEFLIGHT_MONGO, bypass_lease, flight_key
+from routing import ROUTING_FALLBACK_WORKERS, ROUTING_HEDGE_WORKERS, ModelRouter, served_model, clear_served_model
+from metrics import begin_request, finish_request, set_style, stage, timed, bind_context, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from parsers import parse_explain_response, parse_solve_response, parse_summary_response
+from db import client, db, users
+from history import update_stats, history_writer, fetch_history, ensure_indexes as ensure_history_indexes
+from similar import SIMILAR_MATCHING, similar_index
+from jobs import SummaryJobs
+from quota import reserve, refund
 from dotenv import load_dotenv
-from youtube_transcript_api import YouTubeTranscriptApi
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -20,54 +33,106 @@ CORS(app, resources={
         "origins": ["https://vikal-new-production.up.railway.app", "http://localhost:3000"],
         "methods": ["GET", "POST", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization"],
-        "expose_headers": ["Content-Type"],
+        "expose_headers": ["Content-Type", "Server-Timing", "X-Served-Model", "Location"],
         "support_credentials": False
     }
 })
 
-mongo_uri = os.getenv("MONGO_URL")
-if not mongo_uri:
-    logger.error("MONGO_URL not set")
-    raise ValueError("MONGO_URL environment variable is missing")
-client = MongoClient(mongo_uri)
-db = client["vikal"]
-chat_history = db["chat_history"]
-exam_dates = db["exam_dates"]
-users = db["users"]
+response_cache = ResponseCache(db["response_cache"])
+response_cache.ensure_indexes()
+ensure_history_indexes()
+transcript_store = TranscriptStore(db["transcripts"])
+summary_jobs = SummaryJobs(db["summary_jobs"])
+summary_jobs.ensure_indexes()
 logger.info("MongoDB connected successfully")
 
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     logger.error("OPENAI_API_KEY not set")
     raise ValueError("OPENAI_API_KEY environment variable is required")
+SOLVE_BATCH_MAX = int(os.getenv("SOLVE_BATCH_MAX", 50))
+SOLVE_BATCH_CONCURRENCY = int(os.getenv("SOLVE_BATCH_CONCURRENCY", 8))
+WEB_THREADS = int(os.getenv("WEB_THREADS", 1))
+# Every thread that can be in an upstream call at once: request threads (each fanning out to batch items or
+# summary map calls) plus the router's primary and fallback pools. A smaller pool discards and reopens
+# connections under load.
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", 0)) or WEB_THREADS * max(SOLVE_BATCH_CONCURRENCY, SUMMARY_MAP_WORKERS) + ROUTING_HEDGE_WORKERS + ROUTING_FALLBACK_WORKERS
+openai_client = OpenAIClient(OPENAI_API_KEY, session=build_session(OPENAI_POOL_SIZE))
+upstream_lease = MongoLease(db["upstream_leases"]) if SINGLEFLIGHT_MONGO else None
+if upstream_lease is not None:
+    upstream_lease.ensure_indexes()
+upstream_flight = SingleFlight(upstream_lease)
+model_router = ModelRouter()
+similar_index.start_rebuild()
 logger.info("OpenAI API configured successfully")
 
-def call_openai(prompt, max_tokens=700, model="gpt-4"):
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-    payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "max_tokens": max_tokens}
+def complete(prompt, max_tokens, model):
+    logger.info(f"Sending request to OpenAI with model {model}")
+    return upstream_flight.do(flight_key(model, prompt, max_tokens),
+                              lambda: openai_client.chat_completion(prompt, max_tokens, model))
+
+@timed("upstream")
+def call_openai(prompt, max_tokens=700, model=None):
+    """Upstream completion on the model chosen by model_router (or the given model)."""
     try:
-        logger.info(f"Sending request to OpenAI with model {model}")
-        response = requests.post(OPENAI_API_URL, json=payload, headers=headers)
-        logger.info(f"OpenAI response status: {response.status_code}")
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        return model_router.call(prompt, max_tokens, complete, model)
+    except CircuitOpenError as e:
+        logger.error(f"OpenAI API error: {e}")
+        raise Exception(f"OpenAI API error: {e}")
     except requests.RequestException as e:
-        error_msg = f"OpenAI API error: {e} - Response: {e.response.text if e.response else 'No response'}"
+        error_msg = f"OpenAI API error: {e} - Response: {e.response.text if e.response is not None else 'No response'}"
         logger.error(error_msg)
         raise Exception(error_msg)
 
-def update_stats(user_id, endpoint_type, question=None, response=None, category=None, style=None):
-    logger.info(f"Inserting into chat_history for user {user_id}: {endpoint_type}")
-    chat_history.insert_one({
-        "user_id": user_id,
-        "endpoint": endpoint_type,
-        "question": question,
-        "response": response,
-        "category": category,
-        "style": style,
-        "timestamp": datetime.utcnow()
-    })
+def stream_openai(prompt, max_tokens=700, model=None):
+    try:
+        model = model_router.select(prompt, model)
+        logger.info(f"Streaming request to OpenAI with model {model}")
+        with stage("upstream"):
+            yield from openai_client.stream_chat_completion(prompt, max_tokens, model)
+    except CircuitOpenError as e:
+        logger.error(f"OpenAI API error: {e}")
+        raise Exception(f"OpenAI API error: {e}")
+    except requests.RequestException as e:
+        error_msg = f"OpenAI API error: {e} - Response: {e.response.text if e.response is not None else 'No response'}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+def cached_answer(endpoint_type, cache_key, question, category, style):
+    """Exact response-cache hit, else the stored answer to a near-duplicate question (copied into the cache), else None."""
+    parsed_response = response_cache.get(cache_key)
+    if parsed_response is None and SIMILAR_MATCHING:
+        parsed_response = similar_index.lookup(endpoint_type, question, category, style)
+        if parsed_response is not None:
+            response_cache.set(cache_key, parsed_response)
+    return parsed_response
+
+def wants_cache_bypass(data):
+    """A request skips the response cache with {"no_cache": true} or a Cache-Control: no-cache header."""
+    if data.get("no_cache"):
+        return True
+    return "no-cache" in request.headers.get("Cache-Control", "").lower()
+
+def wants_stream():
+    """The /explain/stream and /solve/stream routes relay the completion as Server-Sent Events."""
+    return request.path.endswith("/stream")
+
+@app.before_request
+def start_timer():
+    clear_served_model()
+    bypass_lease(False)
+    if request.path != "/metrics":
+        begin_request(request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.after_request
+def add_timing_headers(response):
+    if request.path != "/metrics":
+        server_timing = finish_request(response.status_code)
+        if server_timing:
+            response.headers["Server-Timing"] = server_timing
+    if served_model():
+        response.headers["X-Served-Model"] = served_model()
+    return response
 
 @app.route('/')
 def home():
@@ -83,9 +148,10 @@ def test_mongo():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/explain', methods=['POST', 'OPTIONS'])
+@app.route('/explain/stream', methods=['POST', 'OPTIONS'])
 def explain():
     if request.method == "OPTIONS":
-        logger.info("Handling OPTIONS preflight for /explain")
+        logger.info(f"Handling OPTIONS preflight for {request.path}")
         return jsonify({"status": "ok"}), 200
     data = request.get_json()
     if not data or 'topic' not in data:
@@ -97,12 +163,18 @@ def explain():
     style = data.get('explanation_style', 'teacher')
     category = data.get('category', 'generic')
     logger.info(f"Processing: user_id={user_id}, topic={topic}, style={style}, category={category}")
-    return process_request(user_id, "explain", get_prompt(category, "explanation", style, topic), 700, topic, category, style, parse_explain_response)
+    try:
+        max_tokens = plan_max_tokens(prompt_tokens(category, "explanation", style, topic), EXPLAIN_MAX_TOKENS)
+    except PromptTooLarge as e:
+        logger.error(f"Rejecting oversized topic: {e}")
+        return jsonify({'error': str(e)}), 413
+    return process_request(user_id, "explain", get_prompt(category, "explanation", style, topic), max_tokens, topic, category, style, parse_explain_response, wants_cache_bypass(data), wants_stream())
 
 @app.route('/solve', methods=['POST', 'OPTIONS'])
+@app.route('/solve/stream', methods=['POST', 'OPTIONS'])
 def solve():
     if request.method == "OPTIONS":
-        logger.info("Handling OPTIONS preflight for /solve")
+        logger.info(f"Handling OPTIONS preflight for {request.path}")
         return jsonify({"status": "ok"}), 200
     data = request.get_json()
     if not data or 'problem' not in data:
@@ -119,8 +191,82 @@ def solve():
         return jsonify({'error': 'Subject or exam required'}), 400
 
     logger.info(f"Processing: user_id={user_id}, problem={data['problem']}, style={style}, category={category}")
-    max_tokens = {"smart": 75, "step": 150, "teacher": 150, "research": 225}.get(style.lower(), 150)
-    return process_request(user_id, "solve", get_prompt(category, "solution", style, data['problem']), max_tokens, data['problem'], category, style, parse_solve_response)
+    try:
+        max_tokens = plan_max_tokens(prompt_tokens(category, "solution", style, data['problem']), SOLVE_MAX_TOKENS.get(style.lower(), 150))
+    except PromptTooLarge as e:
+        logger.error(f"Rejecting oversized problem: {e}")
+        return jsonify({'error': str(e)}), 413
+    return process_request(user_id, "solve", get_prompt(category, "solution", style, data['problem']), max_tokens, data['problem'], category, style, parse_solve_response, wants_cache_bypass(data), wants_stream())
+
+@app.route('/solve-batch', methods=['POST', 'OPTIONS'])
+def solve_batch():
+    if request.method == "OPTIONS":
+        logger.info("Handling OPTIONS preflight for /solve-batch")
+        return jsonify({"status": "ok"}), 200
+    data = request.get_json()
+    problems = data.get('problems') if data else None
+    if not problems or not isinstance(problems, list):
+        logger.error("No problems provided in request")
+        return jsonify({'error': 'No problems provided'}), 400
+    if len(problems) > SOLVE_BATCH_MAX:
+        logger.error(f"Batch of {len(problems)} problems exceeds {SOLVE_BATCH_MAX}")
+        return jsonify({'error': f'At most {SOLVE_BATCH_MAX} problems per batch'}), 400
+
+    user_id = data.get('user_id', 'anonymous')
+    style = data.get('explanation_style', 'teacher')
+    category = data.get('exam') or data.get('subject')
+    if not category:
+        logger.error("Subject or exam required")
+        return jsonify({'error': 'Subject or exam required'}), 400
+
+    logger.info(f"Processing batch: user_id={user_id}, problems={len(problems)}, style={style}, category={category}")
+    set_style(style)
+    reservation = None
+    try:
+        reservation = reserve(user_id, data.get("email", "unknown"))
+        if reservation is None:
+            return jsonify({"error": "Chat limit reached. Upgrade to Pro!"}), 403
+
+        max_tokens = SOLVE_MAX_TOKENS.get(style.lower(), 150)
+        bypass_cache = wants_cache_bypass(data)
+        bypass_lease(bypass_cache)
+
+        def solve_item(item):
+            index, problem = item
+            if not isinstance(problem, str) or not problem.strip():
+                # Objects, numbers and blanks are rejected per item rather than rendered into a prompt
+                return {"index": index, "problem": problem, "error": "Problem must be a non-empty string"}
+            try:
+                parsed_response = solve_one(user_id, problem, category, style, max_tokens, bypass_cache)
+                return dict(parsed_response, index=index, problem=problem, model=served_model())
+            except Exception as e:
+                logger.error(f"Error in solve-batch item {index}: {e}")
+                return {"index": index, "problem": problem, "error": str(e)}
+
+        with ThreadPoolExecutor(max_workers=min(SOLVE_BATCH_CONCURRENCY, len(problems))) as pool:
+            results = list(pool.map(bind_context(solve_item), enumerate(problems)))
+
+        if all("error" in result for result in results):
+            refund(reservation)
+        logger.info(f"Returning {len(results)} batch results")
+        return jsonify({"results": results})
+    except Exception as e:
+        logger.error(f"Error in solve-batch endpoint: {e}")
+        refund(reservation)
+        return jsonify({'error': str(e)}), 500
+
+def solve_one(user_id, problem, category, style, max_tokens, bypass_cache=False):
+    """Solve a single batch item: response cache, then the upstream call, then parse_solve_response."""
+    max_tokens = plan_max_tokens(prompt_tokens(category, "solution", style, problem), max_tokens)
+    prompt = get_prompt(category, "solution", style, problem)
+    cache_key = make_cache_key(problem, category, style, get_template("solution", style))
+    parsed_response = None if bypass_cache else cached_answer("solve-batch", cache_key, problem, category, style)
+    fresh = parsed_response is None
+    if fresh:
+        parsed_response = parse_solve_response(call_openai(prompt, max_tokens))
+        response_cache.set(cache_key, parsed_response)
+    update_stats(user_id, "solve-batch", problem, parsed_response.get("notes"), category, style, parsed_response if fresh else None)
+    return parsed_response
 
 @app.route('/summarize-youtube', methods=['POST', 'OPTIONS'])
 def summarize_youtube():
@@ -135,82 +281,81 @@ def summarize_youtube():
         logger.error("No video URL provided")
         return jsonify({'error': 'No video URL provided'}), 400
 
-    video_id_match = re.search(r'(?:v=|\/)([0-9A-Za-z_-]{11})', video_url)
-    if not video_id_match:
+    video_id = extract_video_id(video_url)
+    if not video_id:
         logger.error("Invalid YouTube video URL")
         return jsonify({'error': 'Invalid YouTube video URL'}), 400
 
-    video_id = video_id_match.group(1)
-
+    reservation = None
     try:
-        user = users.find_one({"_id": user_id})
-        if not user:
-            logger.info(f"Creating new user: {user_id}")
-            users.insert_one({
-                "_id": user_id,
-                "email": data.get("email", "unknown"),
-                "chatCount": 0,
-                "isPro": False,
-                "createdAt": datetime.utcnow()
-            })
-            user = users.find_one({"_id": user_id})
-
-        if not user["isPro"] and user["chatCount"] >= 3:
-            logger.warning(f"User {user_id} hit chat limit")
+        reservation = reserve(user_id, data.get("email", "unknown"))
+        if reservation is None:
             return jsonify({"error": "Chat limit reached. Upgrade to Pro for unlimited chats!"}), 403
 
-        transcript = YouTubeTranscriptApi.get_transcript(video_id)
+        transcript = transcript_store.get(video_id)
         if not transcript:
             logger.error(f"No transcript available for video ID: {video_id}")
+            refund(reservation)
             return jsonify({'error': 'No transcript available for this video'}), 400
 
-        transcript_text = "\n".join([f"[{item['start']:.1f}s] {item['text']}" for item in transcript])
-        prompt = f"""
-Your output should use the following template:
-### Summary
-### Analogy
-### Notes
-- [Emoji] Bulletpoint
-### Keywords
-- Explanation
-You have been tasked with creating a concise summary of a YouTube video using its transcription.
-Make a summary of the transcript.
-Additionally make a short complex analogy to give context and/or analogy from day-to-day life from the transcript.
-Create 10 bullet points (each with an appropriate emoji) that summarize the key points or important moments from the video's transcription.
-In addition to the bullet points, extract the most important keywords and any complex words not known to the average reader as well as any acronyms mentioned. For each keyword and complex word, provide an explanation and definition based on its occurrence in the transcription.
-Please ensure that the summary, bullet points, and explanations fit within the 330-word limit, while still offering a comprehensive and clear understanding of the video's content. Use the text above: Video Title {video_id} {transcript_text}.
-"""
-        response = call_openai(prompt, max_tokens=700)
-        parts = re.split(r'###\s', response)
-        summary_part = next((part for part in parts if part.startswith("Summary")), "")
-        analogy_part = next((part for part in parts if part.startswith("Analogy")), "")
-        notes_part = next((part for part in parts if part.startswith("Notes")), "")
-        keywords_part = next((part for part in parts if part.startswith("Keywords")), "")
-
-        summary = summary_part.replace("Summary", "").strip() if summary_part else ""
-        analogy = analogy_part.replace("Analogy", "").strip() if analogy_part else ""
-        notes = notes_part.replace("Notes", "").strip().split("\n")[:10] if notes_part else []
-        keywords = keywords_part.replace("Keywords", "").strip().split("\n") if keywords_part else []
-
-        combined_notes = f"{summary}\n\n**Analogy:** {analogy}\n\n**Key Points:**\n" + "\n".join(notes)
-        flashcards = [f"{kw.split(' - ')[0]} - {kw.split(' - ')[1]}" for kw in keywords[:5] if " - " in kw]
-        resources = [
-            {"title": "YouTube Video", "url": video_url},
-            {"title": "Wikipedia", "url": "https://en.wikipedia.org/wiki/YouTube"},
-            {"title": "Khan Academy", "url": "https://www.khanacademy.org"}
-        ]
-
-        update_stats(user_id, "summarize-youtube", video_url, combined_notes)
-        if not user["isPro"]:
-            logger.info(f"Updating chat count for user {user_id}")
-            users.update_one({"_id": user_id}, {"$inc": {"chatCount": 1}})
+        response = summarize_transcript(video_id, transcript["text"], call_openai)
+        summary = parse_summary_response(response, video_url)
+
+        update_stats(user_id, "summarize-youtube", video_url, summary["notes"])
 
         logger.info("Returning YouTube summary response")
-        return jsonify({"notes": combined_notes, "flashcards": flashcards, "resources": resources})
+        return jsonify(summary)
     except Exception as e:
         logger.error(f"Error summarizing YouTube video: {e}")
+        refund(reservation)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/summarize-youtube/jobs', methods=['POST', 'OPTIONS'])
+def submit_summary_job():
+    """Queue a /summarize-youtube request for worker.py; 202 with a job id to poll."""
+    if request.method == "OPTIONS":
+        logger.info("Handling OPTIONS preflight for /summarize-youtube/jobs")
+        return jsonify({"status": "ok"}), 200
+    data = request.get_json() or {}
+    video_url = data.get('videoUrl')
+    user_id = data.get('user_id', 'anonymous')
+
+    if not video_url:
+        logger.error("No video URL provided")
+        return jsonify({'error': 'No video URL provided'}), 400
+
+    video_id = extract_video_id(video_url)
+    if not video_id:
+        logger.error("Invalid YouTube video URL")
+        return jsonify({'error': 'Invalid YouTube video URL'}), 400
+
+    reservation = None
+    try:
+        reservation = reserve(user_id, data.get("email", "unknown"))
+        if reservation is None:
+            return jsonify({"error": "Chat limit reached. Upgrade to Pro for unlimited chats!"}), 403
+
+        job_id, job = summary_jobs.submit(video_id, video_url, user_id, reservation)
+        status_url = f"/summarize-youtube/jobs/{job_id}"
+        return jsonify({"job_id": job_id, "status": job["status"], "status_url": status_url}), 202, {"Location": status_url}
+    except Exception as e:
+        logger.error(f"Error queueing YouTube summary: {e}")
+        refund(reservation)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/summarize-youtube/jobs/<job_id>', methods=['GET'])
+def get_summary_job(job_id):
+    """202 while queued or running; the /summarize-youtube payload once done; the job's error if it failed."""
+    try:
+        found = summary_jobs.result(job_id)
+    except Exception as e:
+        logger.error(f"Error fetching summary job {job_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+    if found is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    payload, status = found
+    return jsonify(payload), status
+
 @app.route('/chat-youtube', methods=['POST', 'OPTIONS'])
 def chat_youtube():
     if request.method == "OPTIONS":
@@ -224,49 +369,71 @@ def chat_youtube():
     if not video_id or not user_query:
         logger.error("Missing video_id or query")
         return jsonify({'error': 'Missing video_id or query'}), 400
-
     try:
-        user = users.find_one({"_id": user_id})
-        if not user:
-            logger.info(f"Creating new user: {user_id}")
-            users.insert_one({
-                "_id": user_id,
-                "email": data.get("email", "unknown"),
-                "chatCount": 0,
-                "isPro": False,
-                "createdAt": datetime.utcnow()
-            })
-            user = users.find_one({"_id": user_id})
+        plan_max_tokens(count_tokens(YOUTUBE_CHAT_PROMPT.format(transcript_text="", query=user_query)), YOUTUBE_CHAT_MAX_TOKENS)
+    except PromptTooLarge as e:
+        logger.error(f"Rejecting oversized query: {e}")
+        return jsonify({'error': str(e)}), 413
 
-        if not user["isPro"] and user["chatCount"] >= 3:
-            logger.warning(f"User {user_id} hit chat limit")
+    reservation = None
+    try:
+        reservation = reserve(user_id, data.get("email", "unknown"))
+        if reservation is None:
             return jsonify({"error": "Chat limit reached. Upgrade to Pro for unlimited chats!"}), 403
 
-        transcript = YouTubeTranscriptApi.get_transcript(video_id)
+        transcript = transcript_store.get(video_id)
         if not transcript:
             logger.error(f"No transcript available for video ID: {video_id}")
+            refund(reservation)
             return jsonify({'error': 'No transcript available for this video'}), 400
 
-        transcript_text = "\n".join([f"[{item['start']:.1f}s] {item['text']}" for item in transcript])
-        prompt = f"Based on this YouTube video transcript: {transcript_text}, answer the following question: {user_query}"
-        response = call_openai(prompt, max_tokens=500)
+        transcript_text = select_context(video_id, transcript["segments"], user_query)
+        prompt = fit_prompt(YOUTUBE_CHAT_PROMPT, "transcript_text", transcript_text, YOUTUBE_CHAT_MAX_TOKENS, query=user_query)
+        response = call_openai(prompt, max_tokens=YOUTUBE_CHAT_MAX_TOKENS)
 
         update_stats(user_id, "chat-youtube", user_query, response)
-        if not user["isPro"]:
-            logger.info(f"Updating chat count for user {user_id}")
-            users.update_one({"_id": user_id}, {"$inc": {"chatCount": 1}})
 
         logger.info("Returning YouTube chat response")
         return jsonify({'response': response})
     except Exception as e:
         logger.error(f"Error chatting with YouTube video: {e}")
+        refund(reservation)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    return jsonify({"response_cache": response_cache.stats(), "transcripts": transcript_store.stats(), "openai_circuit": openai_client.breaker.state, "history_writer": history_writer.stats(), "singleflight": upstream_flight.stats(), "models": model_router.stats.stats(), "similar": similar_index.stats(), "summary_jobs": summary_jobs.stats()}), 200
+
+@app.route('/history', methods=['GET'])
+def get_history():
+    user_id = request.args.get('user_id')
+    if not user_id or user_id == 'anonymous':
+        return jsonify({'error': 'user_id required'}), 400
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    include_response = request.args.get('include_response', '').lower() in ('1', 'true')
+    try:
+        with stage("history_read"):
+            items, next_cursor = fetch_history(user_id, request.args.get('cursor'), limit, request.args.get('endpoint'), include_response)
+        return jsonify({"items": items, "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error fetching history: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/user-status', methods=['GET'])
 def get_user_status():
     user_id = request.args.get('user_id', 'anonymous')
     try:
-        user = users.find_one({"_id": user_id})
+        with stage("user_lookup"):
+            user = users.find_one({"_id": user_id})
         if not user:
             return jsonify({"chatCount": 0, "isPro": False}), 200
         return jsonify({"chatCount": user.get("chatCount", 0), "isPro": user.get("isPro", False)}), 200
@@ -274,83 +441,68 @@ def get_user_status():
         logger.error(f"Error fetching user status: {e}")
         return jsonify({"error": str(e)}), 500
 
-def process_request(user_id, endpoint_type, prompt, max_tokens, question, category, style, parse_func):
+def process_request(user_id, endpoint_type, prompt, max_tokens, question, category, style, parse_func, bypass_cache=False, stream=False):
+    reservation = None
+    set_style(style)
+    bypass_lease(bypass_cache)
     try:
-        logger.info(f"Fetching user: {user_id}")
-        user = users.find_one({"_id": user_id})
-        if not user:
-            logger.info(f"Creating new user: {user_id}")
-            users.insert_one({
-                "_id": user_id,
-                "email": "unknown",
-                "chatCount": 0,
-                "isPro": False,
-                "createdAt": datetime.utcnow()
-            })
-            user = users.find_one({"_id": user_id})
-        if not user["isPro"] and user["chatCount"] >= 3:
-            logger.warning(f"User {user_id} hit chat limit")
+        logger.info(f"Reserving chat for user: {user_id}")
+        reservation = reserve(user_id)
+        if reservation is None:
             return jsonify({"error": "Chat limit reached. Upgrade to Pro!"}), 403
 
-        logger.info(f"Prompt: {prompt[:100]}...")
-        response = call_openai(prompt, max_tokens)
-        logger.info(f"OpenAI response: {response[:100]}...")
-        parsed_response = parse_func(response)
-
-        if not user["isPro"]:
-            logger.info(f"Updating chat count for user {user_id}")
-            users.update_one({"_id": user_id}, {"$inc": {"chatCount": 1}})
-        update_stats(user_id, endpoint_type, question, parsed_response.get("notes"), category, style)
-
+        cache_key = make_cache_key(question, category, style, get_template(TYPE_KEYS[endpoint_type], style))
+        parsed_response = None if bypass_cache else cached_answer(endpoint_type, cache_key, question, category, style)
+        fresh = parsed_response is None
+        if not fresh:
+            logger.info(f"Response cache hit for {endpoint_type}: {cache_key[:12]}")
+        elif stream:
+            model = model_router.select(prompt)
+            events = stream_parsed_response(reservation, user_id, endpoint_type, prompt, max_tokens, question, category, style, parse_func, cache_key, model)
+            return Response(stream_with_context(events), mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        else:
+            logger.info(f"Prompt: {prompt[:100]}...")
+            response = call_openai(prompt, max_tokens)
+            logger.info(f"OpenAI response: {response[:100]}...")
+            parsed_response = parse_func(response)
+            response_cache.set(cache_key, parsed_response)
+
+        update_stats(user_id, endpoint_type, question, parsed_response.get("notes"), category, style, parsed_response if fresh else None)
         logger.info("Returning response")
+        if stream:
+            return Response(sse_event("done", parsed_response), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
         return jsonify(parsed_response)
     except Exception as e:
         logger.error(f"Error in {endpoint_type} endpoint: {e}")
+        refund(reservation)
         return jsonify({'error': str(e)}), 500
 
-def parse_explain_response(response):
-    parts = re.split(r'###\s', response)
-    parts = [part.strip() for part in parts if part.strip()]
-    notes, points_to_remember, flashcards, resources = "", [], [], []
-    for part in parts:
-        if part.startswith("Quick Dive"):
-            notes += part.replace("Quick Dive", "").strip() + "\n\n"
-        elif part.startswith("Deep Dive"):
-            notes += "**Deep Dive**\n" + part.replace("Deep Dive", "").strip() + "\n\n"
-        elif part.startswith("Must-Knows"):
-            notes += "**Must-Knows**\n" + part.replace("Must-Knows", "").strip() + "\n\n"
-        elif part.startswith("VIKAL Brain Booster"):
-            notes += "**VIKAL Brain Booster**\n" + part.replace("VIKAL Brain Booster", "").strip() + "\n\n"
-        elif part.startswith("Real-World Wins"):
-            notes += "**Real-World Wins**\n" + part.replace("Real-World Wins", "").strip() + "\n\n"
-        elif part.startswith("VIKAL’s Exam Cheat Codes"):
-            points_to_remember = part.replace("VIKAL’s Exam Cheat Codes", "").strip().split("\n")
-            points_to_remember = [p.strip() for p in points_to_remember if p.strip()]
-        elif part.startswith("Flashcards"):
-            flashcards_raw = part.replace("Flashcards", "").strip().split("\n")
-            for f in flashcards_raw:
-                if "Q:" in f and "A:" in f:
-                    q, a = f.split("A:", 1)
-                    flashcards.append({"question": q.replace("Q:", "").strip(), "answer": a.strip()})
-        elif part.startswith("Power-Ups"):
-            resources = part.replace("Power-Ups", "").strip().split("\n")[:3]
-            resources = [{"title": r.split(": ")[0].strip(), "url": r.split(": ")[1].strip() if ": " in r else r.strip()} for r in resources if r.strip()]
-    return {"notes": notes, "points_to_remember": points_to_remember, "flashcards": flashcards, "resources": resources}
-
-def parse_solve_response(response):
-    parts = re.split(r'###\s', response)
-    parts = [part.strip() for part in parts if part.strip()]
-    notes, points_to_remember, resources = "", [], []
-    for part in parts:
-        if part.startswith("Solution"):
-            notes = part.replace("Solution", "").strip()
-        elif part.startswith("VIKAL’s Solve Smarter Hacks"):
-            points_to_remember = part.replace("VIKAL’s Solve Smarter Hacks", "").strip().split("\n")
-            points_to_remember = [p.strip() for p in points_to_remember if p.strip()]
-        elif part.startswith("Power-Ups"):
-            resources = part.replace("Power-Ups", "").strip().split("\n")[:5]
-            resources = [{"title": r.split(": ")[0].strip(), "url": r.split(": ")[1].strip() if ": " in r else r.strip()} for r in resources if r.strip()]
-    return {"notes": notes, "points_to_remember": points_to_remember, "flashcards": [], "resources": resources}
+def stream_parsed_response(reservation, user_id, endpoint_type, prompt, max_tokens, question, category, style, parse_func, cache_key, model=None):
+    """
+    Relay an upstream completion as SSE events:
+    - token: each content delta as it arrives.
+    - section: a completed ### section, parsed with parse_func.
+    - done: the full parsed response (identical to the non-streaming endpoint), or error on failure.
+    """
+    parser = SectionStreamParser(parse_func)
+    try:
+        logger.info(f"Prompt: {prompt[:100]}...")
+        for delta in stream_openai(prompt, max_tokens, model):
+            yield sse_event("token", {"text": delta})
+            for section in parser.feed(delta):
+                yield sse_event("section", section)
+        sections, parsed_response = parser.close()
+        for section in sections:
+            yield sse_event("section", section)
+        response_cache.set(cache_key, parsed_response)
+        update_stats(user_id, endpoint_type, question, parsed_response.get("notes"), category, style, parsed_response)
+        logger.info("Finished streaming response")
+        yield sse_event("done", parsed_response)
+    except Exception as e:
+        logger.error(f"Error in {endpoint_type} stream: {e}")
+        refund(reservation)
+        yield sse_event("error", {"error": str(e)})
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5001))
@@ -0,0 +1,652 @@
+# async_app.py
+"""
+Asyncio serving mode for VIKAL's API, built on aiohttp.
+- Same routes and JSON contracts as app.py, but one worker process holds many in-flight requests.
+- Upstream calls go through AsyncOpenAIClient (pooled aiohttp session, timeouts, backoff, circuit breaker).
+- pymongo and YouTubeTranscriptApi calls are offloaded to a bounded thread pool with run_in_executor.
+Run with: gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker
+"""
+
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import aiohttp
+from aiohttp import web
+
+from budget import PromptTooLarge, count_tokens, fit_prompt, plan_max_tokens, prompt_tokens
+from cache import ResponseCache, make_cache_key
+from db import client, db, users
+from history import update_stats, history_writer, fetch_history, ensure_indexes as ensure_history_indexes
+from openai_client import (
+    OPENAI_API_URL, OPENAI_POOL_SIZE, OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT, OPENAI_MAX_RETRIES,
+    OPENAI_BACKOFF_MAX, RETRY_STATUSES, CircuitBreaker, CircuitOpenError, backoff_delay, parse_retry_after
+)
+from routing import ModelRouter, served_model, clear_served_model
+from metrics import begin_request, finish_request, set_style, stage, timed, bind_context, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from parsers import parse_explain_response, parse_solve_response, parse_summary_response
+from prompts import get_prompt, get_template, TYPE_KEYS, SOLVE_MAX_TOKENS, EXPLAIN_MAX_TOKENS, YOUTUBE_CHAT_PROMPT, YOUTUBE_CHAT_MAX_TOKENS
+from quota import reserve, refund
+from retrieval import select_context
+from similar import SIMILAR_MATCHING, similar_index
+from jobs import SummaryJobs
+from singleflight import AsyncSingleFlight, MongoLease, SINGLEFLIGHT_MONGO, bypass_lease, flight_key
+from streaming import SectionStreamParser, sse_event
+from summarize import asummarize_transcript
+from transcripts import TranscriptStore, extract_video_id
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ALLOWED_ORIGINS = {"https://vikal-new-production.up.railway.app", "http://localhost:3000"}
+ASYNC_OFFLOAD_WORKERS = int(os.getenv("ASYNC_OFFLOAD_WORKERS", 32))
+SOLVE_BATCH_MAX = int(os.getenv("SOLVE_BATCH_MAX", 50))
+SOLVE_BATCH_CONCURRENCY = int(os.getenv("SOLVE_BATCH_CONCURRENCY", 8))
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+if not OPENAI_API_KEY:
+    logger.error("OPENAI_API_KEY not set")
+    raise ValueError("OPENAI_API_KEY environment variable is required")
+
+response_cache = ResponseCache(db["response_cache"])
+transcript_store = TranscriptStore(db["transcripts"])
+summary_jobs = SummaryJobs(db["summary_jobs"])
+offload_executor = ThreadPoolExecutor(max_workers=ASYNC_OFFLOAD_WORKERS, thread_name_prefix="offload")
+
+
+class AsyncOpenAIClient:
+    """
+    aiohttp counterpart of openai_client.OpenAIClient with the same retry and circuit-breaker policy.
+    - The session is created on app startup, inside the running event loop.
+    """
+
+    def __init__(self, api_key, api_url=OPENAI_API_URL, breaker=None, max_retries=OPENAI_MAX_RETRIES):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.session = None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=OPENAI_POOL_SIZE * 4, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(sock_connect=OPENAI_CONNECT_TIMEOUT, sock_read=OPENAI_READ_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                             headers={"Authorization": f"Bearer {self.api_key}"})
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def post(self, payload):
+        """Return a successful aiohttp response (the caller must release it) or raise."""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("OpenAI circuit breaker is open; failing fast")
+            retry_after = None
+            try:
+                response = await self.session.post(self.api_url, json=payload)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"OpenAI request failed ({e!r}); retrying")
+            except asyncio.CancelledError:
+                # The caller went away: no verdict on upstream health, but a half-open trial must not stay in flight
+                self.breaker.release_trial()
+                raise
+            except Exception:
+                # Anything else (TooManyRedirects, ...) still counts against the breaker, which also ends a
+                # half-open trial instead of leaving it in flight forever
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    if response.status >= 400:
+                        body = await response.text()
+                        response.release()
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, message=body)
+                    return response
+                self.breaker.record_failure()
+                body = await response.text()
+                response.release()
+                if attempt >= self.max_retries:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                      status=response.status, message=body)
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                logger.warning(f"OpenAI returned {response.status}; retrying")
+            delay = backoff_delay(attempt)
+            if retry_after is not None:
+                delay = min(max(delay, retry_after), OPENAI_BACKOFF_MAX)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def chat_completion(self, prompt, max_tokens=700, model="gpt-4"):
+        payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "max_tokens": max_tokens}
+        response = await self.post(payload)
+        async with response:
+            data = await response.json(content_type=None)
+        return data["choices"][0]["message"]["content"]
+
+    async def stream_chat_completion(self, prompt, max_tokens=700, model="gpt-4"):
+        payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "max_tokens": max_tokens, "stream": True}
+        response = await self.post(payload)
+        async with response:
+            async for raw in response.content:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+
+openai_client = AsyncOpenAIClient(OPENAI_API_KEY)
+upstream_lease = MongoLease(db["upstream_leases"]) if SINGLEFLIGHT_MONGO else None
+
+
+async def offload(func, *args, **kwargs):
+    """Run a blocking call (pymongo, YouTubeTranscriptApi, CPU-heavy indexing) on the offload pool."""
+    return await asyncio.get_running_loop().run_in_executor(offload_executor, bind_context(partial(func, *args, **kwargs)))
+
+
+upstream_flight = AsyncSingleFlight(upstream_lease, offload)
+model_router = ModelRouter()
+
+
+async def complete(prompt, max_tokens, model):
+    logger.info(f"Sending request to OpenAI with model {model}")
+    return await upstream_flight.do(flight_key(model, prompt, max_tokens),
+                                    lambda: openai_client.chat_completion(prompt, max_tokens, model))
+
+
+@timed("upstream")
+async def call_openai(prompt, max_tokens=700, model=None):
+    try:
+        return await model_router.acall(prompt, max_tokens, complete, model)
+    except CircuitOpenError as e:
+        logger.error(f"OpenAI API error: {e}")
+        raise Exception(f"OpenAI API error: {e}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        error_msg = f"OpenAI API error: {e!r}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+
+def json_error(message, status):
+    return web.json_response({"error": message}, status=status)
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+
+
+async def home(request):
+    return web.json_response({"message": "API is running", "status": "ok"})
+
+
+async def test_mongo(request):
+    try:
+        await offload(client.server_info)
+        return web.json_response({"message": "MongoDB connected successfully"})
+    except Exception as e:
+        logger.error(f"MongoDB connection failed: {e}")
+        return json_error(str(e), 500)
+
+
+async def preflight(request):
+    logger.info(f"Handling OPTIONS preflight for {request.path}")
+    return web.json_response({"status": "ok"})
+
+
+def cached_answer(endpoint_type, cache_key, question, category, style):
+    """Blocking: exact response-cache hit, else a near-duplicate's stored answer (copied into the cache), else None."""
+    parsed_response = response_cache.get(cache_key)
+    if parsed_response is None and SIMILAR_MATCHING:
+        parsed_response = similar_index.lookup(endpoint_type, question, category, style)
+        if parsed_response is not None:
+            response_cache.set(cache_key, parsed_response)
+    return parsed_response
+
+
+def wants_cache_bypass(request, data):
+    if data.get("no_cache"):
+        return True
+    return "no-cache" in request.headers.get("Cache-Control", "").lower()
+
+
+async def explain(request):
+    data = await read_json(request)
+    if not data or 'topic' not in data:
+        logger.error("No topic provided in request")
+        return json_error('No topic provided', 400)
+
+    user_id = data.get('user_id', 'anonymous')
+    topic = data['topic']
+    style = data.get('explanation_style', 'teacher')
+    category = data.get('category', 'generic')
+    logger.info(f"Processing: user_id={user_id}, topic={topic}, style={style}, category={category}")
+    try:
+        max_tokens = plan_max_tokens(prompt_tokens(category, "explanation", style, topic), EXPLAIN_MAX_TOKENS)
+    except PromptTooLarge as e:
+        logger.error(f"Rejecting oversized topic: {e}")
+        return json_error(str(e), 413)
+    return await process_request(request, user_id, "explain", get_prompt(category, "explanation", style, topic), max_tokens,
+                                 topic, category, style, parse_explain_response, wants_cache_bypass(request, data))
+
+
+async def solve(request):
+    data = await read_json(request)
+    if not data or 'problem' not in data:
+        logger.error("No problem provided in request")
+        return json_error('No problem provided', 400)
+
+    user_id = data.get('user_id', 'anonymous')
+    style = data.get('explanation_style', 'teacher')
+    category = data.get('exam') or data.get('subject')
+    if not category:
+        logger.error("Subject or exam required")
+        return json_error('Subject or exam required', 400)
+
+    logger.info(f"Processing: user_id={user_id}, problem={data['problem']}, style={style}, category={category}")
+    try:
+        max_tokens = plan_max_tokens(prompt_tokens(category, "solution", style, data['problem']), SOLVE_MAX_TOKENS.get(style.lower(), 150))
+    except PromptTooLarge as e:
+        logger.error(f"Rejecting oversized problem: {e}")
+        return json_error(str(e), 413)
+    return await process_request(request, user_id, "solve", get_prompt(category, "solution", style, data['problem']), max_tokens,
+                                 data['problem'], category, style, parse_solve_response, wants_cache_bypass(request, data))
+
+
+async def solve_batch(request):
+    data = await read_json(request)
+    problems = data.get('problems') if data else None
+    if not problems or not isinstance(problems, list):
+        logger.error("No problems provided in request")
+        return json_error('No problems provided', 400)
+    if len(problems) > SOLVE_BATCH_MAX:
+        logger.error(f"Batch of {len(problems)} problems exceeds {SOLVE_BATCH_MAX}")
+        return json_error(f'At most {SOLVE_BATCH_MAX} problems per batch', 400)
+
+    user_id = data.get('user_id', 'anonymous')
+    style = data.get('explanation_style', 'teacher')
+    category = data.get('exam') or data.get('subject')
+    if not category:
+        logger.error("Subject or exam required")
+        return json_error('Subject or exam required', 400)
+
+    logger.info(f"Processing batch: user_id={user_id}, problems={len(problems)}, style={style}, category={category}")
+    set_style(style)
+    reservation = None
+    try:
+        reservation = await offload(reserve, user_id, data.get("email", "unknown"))
+        if reservation is None:
+            return json_error("Chat limit reached. Upgrade to Pro!", 403)
+
+        max_tokens = SOLVE_MAX_TOKENS.get(style.lower(), 150)
+        bypass_cache = wants_cache_bypass(request, data)
+        bypass_lease(bypass_cache)
+        semaphore = asyncio.Semaphore(SOLVE_BATCH_CONCURRENCY)
+
+        async def solve_item(index, problem):
+            async with semaphore:
+                if not isinstance(problem, str) or not problem.strip():
+                    # Objects, numbers and blanks are rejected per item rather than rendered into a prompt
+                    return {"index": index, "problem": problem, "error": "Problem must be a non-empty string"}
+                try:
+                    parsed_response = await solve_one(user_id, problem, category, style, max_tokens, bypass_cache)
+                    return dict(parsed_response, index=index, problem=problem, model=served_model())
+                except Exception as e:
+                    logger.error(f"Error in solve-batch item {index}: {e}")
+                    return {"index": index, "problem": problem, "error": str(e)}
+
+        results = await asyncio.gather(*(solve_item(i, problem) for i, problem in enumerate(problems)))
+        if all("error" in result for result in results):
+            await offload(refund, reservation)
+        return web.json_response({"results": results})
+    except Exception as e:
+        logger.error(f"Error in solve-batch endpoint: {e}")
+        await offload(refund, reservation)
+        return json_error(str(e), 500)
+
+
+async def solve_one(user_id, problem, category, style, max_tokens, bypass_cache=False):
+    max_tokens = plan_max_tokens(prompt_tokens(category, "solution", style, problem), max_tokens)
+    prompt = get_prompt(category, "solution", style, problem)
+    cache_key = make_cache_key(problem, category, style, get_template("solution", style))
+    parsed_response = None if bypass_cache else await offload(cached_answer, "solve-batch", cache_key, problem, category, style)
+    fresh = parsed_response is None
+    if fresh:
+        parsed_response = parse_solve_response(await call_openai(prompt, max_tokens))
+        await offload(response_cache.set, cache_key, parsed_response)
+    await offload(update_stats, user_id, "solve-batch", problem, parsed_response.get("notes"), category, style,
+                  parsed_response if fresh else None)
+    return parsed_response
+
+
+async def process_request(request, user_id, endpoint_type, prompt, max_tokens, question, category, style, parse_func, bypass_cache=False):
+    stream = request.path.endswith("/stream")
+    reservation = None
+    set_style(style)
+    bypass_lease(bypass_cache)
+    try:
+        logger.info(f"Reserving chat for user: {user_id}")
+        reservation = await offload(reserve, user_id)
+        if reservation is None:
+            return json_error("Chat limit reached. Upgrade to Pro!", 403)
+
+        cache_key = make_cache_key(question, category, style, get_template(TYPE_KEYS[endpoint_type], style))
+        parsed_response = None if bypass_cache else await offload(cached_answer, endpoint_type, cache_key, question, category, style)
+        fresh = parsed_response is None
+        if not fresh:
+            logger.info(f"Response cache hit for {endpoint_type}: {cache_key[:12]}")
+        elif stream:
+            return await stream_parsed_response(request, reservation, user_id, endpoint_type, prompt, max_tokens,
+                                                question, category, style, parse_func, cache_key)
+        else:
+            response = await call_openai(prompt, max_tokens)
+            parsed_response = parse_func(response)
+            await offload(response_cache.set, cache_key, parsed_response)
+
+        await offload(update_stats, user_id, endpoint_type, question, parsed_response.get("notes"), category, style,
+                      parsed_response if fresh else None)
+        if stream:
+            return web.Response(text=sse_event("done", parsed_response), content_type="text/event-stream",
+                                headers={"Cache-Control": "no-cache"})
+        return web.json_response(parsed_response)
+    except Exception as e:
+        logger.error(f"Error in {endpoint_type} endpoint: {e}")
+        await offload(refund, reservation)
+        return json_error(str(e), 500)
+
+
+async def stream_parsed_response(request, reservation, user_id, endpoint_type, prompt, max_tokens, question, category, style, parse_func, cache_key):
+    model = model_router.select(prompt)
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                           "X-Accel-Buffering": "no", "X-Served-Model": model})
+    await response.prepare(request)
+    parser = SectionStreamParser(parse_func)
+    try:
+        with stage("upstream"):
+            async for delta in openai_client.stream_chat_completion(prompt, max_tokens, model):
+                await response.write(sse_event("token", {"text": delta}).encode("utf-8"))
+                for section in parser.feed(delta):
+                    await response.write(sse_event("section", section).encode("utf-8"))
+        sections, parsed_response = parser.close()
+        for section in sections:
+            await response.write(sse_event("section", section).encode("utf-8"))
+        await offload(response_cache.set, cache_key, parsed_response)
+        await offload(update_stats, user_id, endpoint_type, question, parsed_response.get("notes"), category, style, parsed_response)
+        await response.write(sse_event("done", parsed_response).encode("utf-8"))
+    except Exception as e:
+        logger.error(f"Error in {endpoint_type} stream: {e!r}")
+        await offload(refund, reservation)
+        await response.write(sse_event("error", {"error": str(e)}).encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def summarize_youtube(request):
+    data = await read_json(request) or {}
+    video_url = data.get('videoUrl')
+    user_id = data.get('user_id', 'anonymous')
+
+    if not video_url:
+        logger.error("No video URL provided")
+        return json_error('No video URL provided', 400)
+
+    video_id = extract_video_id(video_url)
+    if not video_id:
+        logger.error("Invalid YouTube video URL")
+        return json_error('Invalid YouTube video URL', 400)
+
+    reservation = None
+    try:
+        reservation = await offload(reserve, user_id, data.get("email", "unknown"))
+        if reservation is None:
+            return json_error("Chat limit reached. Upgrade to Pro for unlimited chats!", 403)
+
+        transcript = await offload(transcript_store.get, video_id)
+        if not transcript:
+            logger.error(f"No transcript available for video ID: {video_id}")
+            await offload(refund, reservation)
+            return json_error('No transcript available for this video', 400)
+
+        response = await asummarize_transcript(video_id, transcript["text"], call_openai)
+        summary = parse_summary_response(response, video_url)
+
+        await offload(update_stats, user_id, "summarize-youtube", video_url, summary["notes"])
+
+        logger.info("Returning YouTube summary response")
+        return web.json_response(summary)
+    except Exception as e:
+        logger.error(f"Error summarizing YouTube video: {e}")
+        await offload(refund, reservation)
+        return json_error(str(e), 500)
+
+
+async def submit_summary_job(request):
+    """Queue a /summarize-youtube request for worker.py; 202 with a job id to poll."""
+    data = await read_json(request) or {}
+    video_url = data.get('videoUrl')
+    user_id = data.get('user_id', 'anonymous')
+
+    if not video_url:
+        logger.error("No video URL provided")
+        return json_error('No video URL provided', 400)
+
+    video_id = extract_video_id(video_url)
+    if not video_id:
+        logger.error("Invalid YouTube video URL")
+        return json_error('Invalid YouTube video URL', 400)
+
+    reservation = None
+    try:
+        reservation = await offload(reserve, user_id, data.get("email", "unknown"))
+        if reservation is None:
+            return json_error("Chat limit reached. Upgrade to Pro for unlimited chats!", 403)
+
+        job_id, job = await offload(summary_jobs.submit, video_id, video_url, user_id, reservation)
+        status_url = f"/summarize-youtube/jobs/{job_id}"
+        return web.json_response({"job_id": job_id, "status": job["status"], "status_url": status_url},
+                                 status=202, headers={"Location": status_url})
+    except Exception as e:
+        logger.error(f"Error queueing YouTube summary: {e}")
+        await offload(refund, reservation)
+        return json_error(str(e), 500)
+
+
+async def get_summary_job(request):
+    """202 while queued or running; the /summarize-youtube payload once done; the job's error if it failed."""
+    job_id = request.match_info["job_id"]
+    try:
+        found = await offload(summary_jobs.result, job_id)
+    except Exception as e:
+        logger.error(f"Error fetching summary job {job_id}: {e}")
+        return json_error(str(e), 500)
+    if found is None:
+        return json_error('Unknown or expired job', 404)
+    payload, status = found
+    return web.json_response(payload, status=status)
+
+
+async def chat_youtube(request):
+    data = await read_json(request) or {}
+    video_id = data.get('video_id')
+    user_query = data.get('query')
+    user_id = data.get('user_id', 'anonymous')
+
+    if not video_id or not user_query:
+        logger.error("Missing video_id or query")
+        return json_error('Missing video_id or query', 400)
+    try:
+        plan_max_tokens(count_tokens(YOUTUBE_CHAT_PROMPT.format(transcript_text="", query=user_query)), YOUTUBE_CHAT_MAX_TOKENS)
+    except PromptTooLarge as e:
+        logger.error(f"Rejecting oversized query: {e}")
+        return json_error(str(e), 413)
+
+    reservation = None
+    try:
+        reservation = await offload(reserve, user_id, data.get("email", "unknown"))
+        if reservation is None:
+            return json_error("Chat limit reached. Upgrade to Pro for unlimited chats!", 403)
+
+        transcript = await offload(transcript_store.get, video_id)
+        if not transcript:
+            logger.error(f"No transcript available for video ID: {video_id}")
+            await offload(refund, reservation)
+            return json_error('No transcript available for this video', 400)
+
+        transcript_text = await offload(select_context, video_id, transcript["segments"], user_query)
+        prompt = fit_prompt(YOUTUBE_CHAT_PROMPT, "transcript_text", transcript_text, YOUTUBE_CHAT_MAX_TOKENS, query=user_query)
+        response = await call_openai(prompt, max_tokens=YOUTUBE_CHAT_MAX_TOKENS)
+
+        await offload(update_stats, user_id, "chat-youtube", user_query, response)
+
+        logger.info("Returning YouTube chat response")
+        return web.json_response({'response': response})
+    except Exception as e:
+        logger.error(f"Error chatting with YouTube video: {e}")
+        await offload(refund, reservation)
+        return json_error(str(e), 500)
+
+
+async def metrics(request):
+    return web.Response(body=render_metrics().encode("utf-8"), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+async def get_stats(request):
+    return web.json_response({"response_cache": response_cache.stats(), "transcripts": transcript_store.stats(),
+                              "openai_circuit": openai_client.breaker.state, "history_writer": history_writer.stats(),
+                              "singleflight": upstream_flight.stats(), "models": model_router.stats.stats(),
+                              "similar": similar_index.stats(), "summary_jobs": await offload(summary_jobs.stats)})
+
+
+async def get_history(request):
+    user_id = request.query.get('user_id')
+    if not user_id or user_id == 'anonymous':
+        return json_error('user_id required', 400)
+    try:
+        limit = int(request.query.get('limit', 20))
+    except ValueError:
+        return json_error('limit must be an integer', 400)
+    include_response = request.query.get('include_response', '').lower() in ('1', 'true')
+    try:
+        with stage("history_read"):
+            items, next_cursor = await offload(fetch_history, user_id, request.query.get('cursor'), limit,
+                                               request.query.get('endpoint'), include_response)
+        return web.json_response({"items": items, "next_cursor": next_cursor})
+    except ValueError as e:
+        return json_error(str(e), 400)
+    except Exception as e:
+        logger.error(f"Error fetching history: {e}")
+        return json_error(str(e), 500)
+
+
+async def get_user_status(request):
+    user_id = request.query.get('user_id', 'anonymous')
+    try:
+        with stage("user_lookup"):
+            user = await offload(users.find_one, {"_id": user_id})
+        if not user:
+            return web.json_response({"chatCount": 0, "isPro": False})
+        return web.json_response({"chatCount": user.get("chatCount", 0), "isPro": user.get("isPro", False)})
+    except Exception as e:
+        logger.error(f"Error fetching user status: {e}")
+        return json_error(str(e), 500)
+
+
+async def add_cors_headers(request, response):
+    origin = request.headers.get("Origin")
+    if origin in ALLOWED_ORIGINS:
+        response.headers["Access-Control-Allow-Origin"] = origin
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
+        response.headers["Access-Control-Expose-Headers"] = "Content-Type, Server-Timing, X-Served-Model, Location"
+        response.headers["Vary"] = "Origin"
+
+
+@web.middleware
+async def timing_middleware(request, handler):
+    """Time every request except /metrics; add Server-Timing and X-Served-Model unless the response is already streaming."""
+    clear_served_model()
+    bypass_lease(False)
+    if request.path == "/metrics":
+        return await handler(request)
+    resource = request.match_info.route.resource
+    timer = begin_request(resource.canonical if resource is not None else "unmatched")
+    try:
+        response = await handler(request)
+    except web.HTTPException as e:
+        finish_request(e.status, timer)
+        raise
+    except Exception:
+        finish_request(500, timer)
+        raise
+    server_timing = finish_request(response.status, timer)
+    if not response.prepared:
+        if server_timing:
+            response.headers["Server-Timing"] = server_timing
+        if served_model():
+            response.headers["X-Served-Model"] = served_model()
+    return response
+
+
+async def on_startup(app):
+    await openai_client.start()
+    await offload(response_cache.ensure_indexes)
+    await offload(ensure_history_indexes)
+    await offload(summary_jobs.ensure_indexes)
+    if upstream_lease is not None:
+        await offload(upstream_lease.ensure_indexes)
+    similar_index.start_rebuild()
+    logger.info("Async app started")
+
+
+async def on_cleanup(app):
+    await openai_client.close()
+    await offload(history_writer.close)
+    offload_executor.shutdown(wait=False)
+
+
+def create_app():
+    app = web.Application(middlewares=[timing_middleware])
+    app.router.add_get('/', home)
+    app.router.add_get('/test-mongo', test_mongo)
+    app.router.add_post('/explain', explain)
+    app.router.add_post('/explain/stream', explain)
+    app.router.add_post('/solve', solve)
+    app.router.add_post('/solve/stream', solve)
+    app.router.add_post('/solve-batch', solve_batch)
+    app.router.add_post('/summarize-youtube', summarize_youtube)
+    app.router.add_post('/summarize-youtube/jobs', submit_summary_job)
+    app.router.add_get('/summarize-youtube/jobs/{job_id}', get_summary_job)
+    app.router.add_post('/chat-youtube', chat_youtube)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/stats', get_stats)
+    app.router.add_get('/history', get_history)
+    app.router.add_get('/user-status', get_user_status)
+    app.router.add_route('OPTIONS', '/{tail:.*}', preflight)
+    app.on_response_prepare.append(add_cors_headers)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", 5001))
+    logger.info(f"Starting async server on port {port}")
+    web.run_app(app, host="0.0.0.0", port=port)
@@ -0,0 +1,8 @@
+"""
+Local benchmarks for VIKAL's API. Everything runs against stand-ins (see bench/standins.py), so no
+OpenAI, MongoDB or YouTube access is needed. Install bench/requirements.txt, then run from the repo root, e.g.:
+    python -m bench.e2e --server async --output bench_output.json
+    python -m bench.async_load
+    python -m bench.similar_lookup --entries 1000000
+    BENCH_MONGO_URL=mongodb://127.0.0.1:27017 python -m bench.history_plans   (needs a local mongod)
+"""
@@ -0,0 +1,84 @@
+# bench/async_load.py
+"""
+Throughput per process: sync Flask app (one gunicorn-style sync worker) vs the asyncio app.
+Both run against the same stand-ins with a fixed upstream latency; the load generator keeps
+--concurrency requests in flight against /explain (cache bypassed) and reports JSON results.
+    python -m bench.async_load --requests 200 --concurrency 50 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+
+from bench.e2e import start_server
+from bench.standins import start_fake_openai
+
+
+async def drive(port, total, concurrency):
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                payload = {"topic": f"topic {i}", "user_id": f"bench-{i}", "no_cache": True}
+                async with session.post(f"http://127.0.0.1:{port}/explain", json=payload) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def run_mode(kind, openai_url, total, concurrency):
+    process, port = start_server(kind, openai_url, instrumented=False)
+    try:
+        return asyncio.run(drive(port, total, concurrency))
+    finally:
+        process.terminate()
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake upstream latency in seconds")
+    parser.add_argument("--sync-requests", type=int, default=20, help="requests sent to the (slow) sync worker")
+    args = parser.parse_args()
+
+    openai_process, openai_url = start_fake_openai(latency=args.latency)
+    try:
+        sync_result = run_mode("flask-sync", openai_url, args.sync_requests, args.concurrency)
+        async_result = run_mode("async", openai_url, args.requests, args.concurrency)
+    finally:
+        openai_process.terminate()
+    print(json.dumps({
+        "upstream_latency_s": args.latency,
+        "concurrency": args.concurrency,
+        "sync_worker": sync_result,
+        "async_worker": async_result,
+        "speedup": round(async_result["throughput_rps"] / sync_result["throughput_rps"], 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
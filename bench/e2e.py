@@ -0,0 +1,253 @@
+# bench/e2e.py
+"""
+End-to-end latency/throughput benchmark for every route, against local stand-ins only.
+- The app under test (Flask or asyncio) runs in a child process with a fake OpenAI server, an in-memory
+  MongoDB and a stubbed YouTubeTranscriptApi (see bench/standins.py).
+- Each route is driven at --concurrency for --requests requests; the report has p50/p95/p99 latency,
+  throughput and per-stage time (quota, cache, transcript, retrieval, upstream, parse, history) as JSON,
+  so results can be diffed between releases.
+    python -m bench.e2e --server async --concurrency 32 --requests 200 --output bench_output.json
+"""
+
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+
+from bench.standins import free_port, install_standins, start_fake_openai, wait_for_port
+
+ROUTES = ["/explain", "/solve", "/summarize-youtube", "/chat-youtube", "/user-status"]
+
+# Functions looked up by name at call time inside app.py / async_app.py, grouped into stages
+STAGES = {
+    "reserve": "quota",
+    "call_openai": "upstream",
+    "parse_explain_response": "parse",
+    "parse_solve_response": "parse",
+    "parse_summary_response": "parse",
+    "select_context": "retrieval",
+    "update_stats": "history",
+}
+
+
+class StageRecorder:
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def drain(self):
+        with self._lock:
+            samples, self.samples = self.samples, {}
+        return {stage: summarize(values) for stage, values in samples.items()}
+
+
+def timed(recorder, stage, func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                recorder.record(stage, time.perf_counter() - started)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            recorder.record(stage, time.perf_counter() - started)
+    return wrapper
+
+
+def instrument(module, recorder):
+    """Wrap the app module's stage functions and store objects with timing probes."""
+    for name, stage in STAGES.items():
+        if hasattr(module, name):
+            setattr(module, name, timed(recorder, stage, getattr(module, name)))
+    module.response_cache.get = timed(recorder, "cache", module.response_cache.get)
+    module.transcript_store.get = timed(recorder, "transcript", module.transcript_store.get)
+
+
+def serve(kind, port, openai_url, transcript_segments, transcript_delay, instrumented=True):
+    """Child-process entry point: start the app under test on port."""
+    install_standins(openai_url, transcript_segments, transcript_delay)
+    recorder = StageRecorder()
+    if kind == "async":
+        from aiohttp import web
+        import async_app
+        if instrumented:
+            instrument(async_app, recorder)
+
+            async def stages(request):
+                return web.json_response(recorder.drain())
+            async_app.app.router.add_get("/__bench/stages", stages)
+        web.run_app(async_app.app, host="127.0.0.1", port=port, print=None, access_log=None)
+        return
+
+    from flask import jsonify
+    from werkzeug.serving import make_server
+    import app as flask_app
+    if instrumented:
+        instrument(flask_app, recorder)
+        flask_app.app.add_url_rule("/__bench/stages", "bench_stages", lambda: jsonify(recorder.drain()))
+    # flask-sync behaves like one gunicorn sync worker; flask-threaded like a gthread worker
+    make_server("127.0.0.1", port, flask_app.app, threaded=(kind == "flask-threaded")).serve_forever()
+
+
+def start_server(kind, openai_url, transcript_segments=600, transcript_delay=0.0, instrumented=True):
+    port = free_port()
+    process = multiprocessing.Process(
+        target=serve, args=(kind, port, openai_url, transcript_segments, transcript_delay, instrumented), daemon=True
+    )
+    process.start()
+    wait_for_port(port)
+    return process, port
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "total_ms": round(sum(values) * 1000, 2),
+    }
+
+
+def build_request(route, i, use_cache, videos):
+    user_id = f"bench-{route.strip('/')}-{i}"
+    video_id = f"vid{i % videos:08d}"
+    if route == "/explain":
+        return "POST", {"topic": f"topic {i}", "user_id": user_id, "no_cache": not use_cache}
+    if route == "/solve":
+        return "POST", {"problem": f"{i} + {i}", "subject": "math", "explanation_style": "step",
+                        "user_id": user_id, "no_cache": not use_cache}
+    if route == "/summarize-youtube":
+        return "POST", {"videoUrl": f"https://www.youtube.com/watch?v={video_id}", "user_id": user_id}
+    if route == "/chat-youtube":
+        return "POST", {"video_id": video_id, "query": f"what does the video say about osmosis, part {i}?", "user_id": user_id}
+    return "GET", {"user_id": user_id}
+
+
+async def drive_route(session, base_url, route, total, concurrency, use_cache, videos):
+    latencies, statuses = [], {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        method, body = build_request(route, i, use_cache, videos)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if method == "GET":
+                    request = session.get(base_url + route, params=body)
+                else:
+                    request = session.post(base_url + route, json=body)
+                async with request as response:
+                    await response.read()
+                    status = str(response.status)
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    result = summarize(latencies)
+    result.pop("total_ms")
+    result.update({
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "statuses": statuses,
+        "errors": sum(n for status, n in statuses.items() if status != "200"),
+    })
+    return result
+
+
+async def run_benchmark(port, routes, total, concurrency, use_cache, videos):
+    base_url = f"http://127.0.0.1:{port}"
+    report = {}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+        async with session.get(base_url + "/__bench/stages") as response:
+            await response.read()
+        for route in routes:
+            result = await drive_route(session, base_url, route, total, concurrency, use_cache, videos)
+            async with session.get(base_url + "/__bench/stages") as response:
+                result["stages"] = await response.json()
+            report[route] = result
+    return report
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["flask-threaded", "flask-sync", "async"], default="flask-threaded")
+    parser.add_argument("--routes", nargs="+", default=ROUTES)
+    parser.add_argument("--requests", type=int, default=100, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake upstream latency in seconds")
+    parser.add_argument("--transcript-segments", type=int, default=600)
+    parser.add_argument("--transcript-delay", type=float, default=0.3, help="fake transcript fetch latency in seconds")
+    parser.add_argument("--videos", type=int, default=10, help="distinct video IDs used by the YouTube routes")
+    parser.add_argument("--cache", action="store_true", help="let /explain and /solve use the response cache")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    # The threaded server runs a thread per in-flight request; size app.py's OpenAI pool for them
+    os.environ.setdefault("WEB_THREADS", str(args.concurrency))
+    openai_process, openai_url = start_fake_openai(latency=args.latency)
+    server_process, port = start_server(args.server, openai_url, args.transcript_segments, args.transcript_delay)
+    try:
+        routes = asyncio.run(run_benchmark(port, args.routes, args.requests, args.concurrency, args.cache, args.videos))
+    finally:
+        server_process.terminate()
+        openai_process.terminate()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "routes": routes,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# bench/history_plans.py
+"""
+Query-plan check for the chat_history read paths, against a real local mongod (mongomock has no planner).
+Seeds a scratch database, creates the indexes from history.ensure_indexes(), then explains:
+- the first /history page and a cursor page (fetch_history's query, sort and projection),
+- the same two pages filtered by endpoint,
+- an (endpoint, category) analytics filter.
+Each plan must scan the expected index with no COLLSCAN and no blocking SORT, examining about one page of
+documents. tests/test_history.py runs the same checks when BENCH_MONGO_URL points at a reachable mongod.
+    BENCH_MONGO_URL=mongodb://127.0.0.1:27017 python -m bench.history_plans --records 50000
+Exits non-zero if any plan fails the check.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+from pymongo import DESCENDING, MongoClient
+
+# history.py imports db, which reads MONGO_URL; point it at the same local server
+os.environ.setdefault("MONGO_URL", os.getenv("BENCH_MONGO_URL", "mongodb://127.0.0.1:27017"))
+
+from history import (SUMMARY_FIELDS, USER_ENDPOINT_TIMESTAMP_INDEX, USER_TIMESTAMP_INDEX,  # noqa: E402
+                     encode_cursor, ensure_indexes, history_query)
+
+ENDPOINTS = ["explain", "solve", "solve-batch", "summarize-youtube", "chat-youtube"]
+CATEGORIES = ["generic", "math", "physics", "chemistry", "biology"]
+
+
+def stages(plan):
+    """Flatten a winningPlan into a list of stage dicts."""
+    found = [plan]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            found.extend(stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        found.extend(stages(child))
+    return found
+
+
+def check(name, explained, max_docs, index):
+    plan = explained["queryPlanner"]["winningPlan"]
+    flat = stages(plan)
+    stage_names = [stage.get("stage") for stage in flat]
+    index_names = sorted({stage["indexName"] for stage in flat if stage.get("indexName")})
+    docs_examined = explained["executionStats"]["totalDocsExamined"]
+    ok = "COLLSCAN" not in stage_names and "SORT" not in stage_names and index in index_names and docs_examined <= max_docs
+    return {"check": name, "ok": ok, "stages": stage_names, "indexes": index_names,
+            "docs_examined": docs_examined, "keys_examined": explained["executionStats"]["totalKeysExamined"],
+            "returned": explained["executionStats"]["nReturned"]}
+
+
+def seed(collection, records, users):
+    collection.drop()
+    ensure_indexes(collection)
+    now = datetime.utcnow()
+    rng = random.Random(3)
+    batch = []
+    for i in range(records):
+        batch.append({
+            "user_id": f"user-{rng.randrange(users)}",
+            "endpoint": rng.choice(ENDPOINTS),
+            "question": f"question {i}",
+            "response": "x" * 500,
+            "category": rng.choice(CATEGORIES),
+            "style": "teacher",
+            # Coarse timestamps so many records share one, exercising the _id tie-break
+            "timestamp": now - timedelta(seconds=(records - i) // 3),
+        })
+        if len(batch) == 5000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+
+
+def explain_find(collection, query, projection, limit):
+    cursor = collection.find(query, projection).sort([("timestamp", DESCENDING), ("_id", DESCENDING)]).limit(limit)
+    return cursor.explain()
+
+
+def plan_checks(collection, records, users, page):
+    """Seed collection and explain each read path; returns one check() result per path."""
+    seed(collection, records, users)
+    user_id = "user-7"
+    limit = page + 1
+
+    def cursor_after_first_page(endpoint=None):
+        first_page = list(collection.find(history_query(user_id, endpoint=endpoint), {"timestamp": 1})
+                          .sort([("timestamp", DESCENDING), ("_id", DESCENDING)]).limit(page))
+        return encode_cursor(first_page[-1])
+
+    cursor = cursor_after_first_page()
+    endpoint_cursor = cursor_after_first_page("solve")
+    results = [
+        check("first page", explain_find(collection, history_query(user_id), SUMMARY_FIELDS, limit),
+              limit, USER_TIMESTAMP_INDEX),
+        # The $lte bound makes this one range scan starting at the cursor; records tied on the cursor's timestamp
+        # are filtered out by _id on the way, so allow up to another page of them
+        check("cursor page", explain_find(collection, history_query(user_id, cursor), SUMMARY_FIELDS, limit),
+              2 * limit, USER_TIMESTAMP_INDEX),
+        check("endpoint first page",
+              explain_find(collection, history_query(user_id, endpoint="solve"), SUMMARY_FIELDS, limit),
+              limit, USER_ENDPOINT_TIMESTAMP_INDEX),
+        check("endpoint cursor page",
+              explain_find(collection, history_query(user_id, endpoint_cursor, "solve"), SUMMARY_FIELDS, limit),
+              2 * limit, USER_ENDPOINT_TIMESTAMP_INDEX),
+    ]
+    analytics = collection.find({"endpoint": "solve", "category": "math"}, {"question": 1}).limit(100).explain()
+    results.append(check("endpoint+category", analytics, 100, "endpoint_category"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--database", default="vikal_bench")
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ["MONGO_URL"])
+    try:
+        results = plan_checks(client[args.database]["chat_history"], args.records, args.users, args.page)
+    finally:
+        client.drop_database(args.database)
+    print(json.dumps({"records": args.records, "users": args.users, "checks": results}, indent=2))
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
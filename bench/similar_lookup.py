@@ -0,0 +1,92 @@
+# bench/similar_lookup.py
+"""
+Near-duplicate index (similar.py) at scale: build time, memory and lookup latency over --entries synthetic
+questions spread across categories and styles.
+- Hit lookups are rephrasings of indexed questions (filler words, punctuation, word order kept); miss lookups
+  are questions on topics that were never indexed. Recall is the share of rephrasings that found an answer.
+- No MongoDB is touched: the index is built with no collection, so lookups measure match() alone.
+    python -m bench.similar_lookup --entries 1000000 --lookups 5000 --output similar_output.json
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import time
+
+# similar.py imports db, which only needs a URL here (MongoClient connects lazily)
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:27017")
+
+from bench.e2e import summarize  # noqa: E402
+from similar import SimilarIndex  # noqa: E402
+
+SYLLABLES = ["os", "mo", "sis", "ka", "ri", "to", "phy", "lo", "gen", "cell", "ion", "tra", "mi", "cro", "bio",
+             "chem", "ther", "dy", "na", "mic", "quan", "tum", "elec", "tron", "flu", "id", "ver", "tex", "pho", "ton"]
+PHRASINGS = ["what is {}", "explain {} pls", "define {}", "what's {}?", "can you explain {} please",
+             "tell me about {}", "{} meaning", "describe {} briefly"]
+CATEGORIES = ["generic", "biology", "chemistry", "physics", "math", "history", "jee", "neet"]
+STYLES = ["teacher", "smart", "step", "research"]
+
+
+def make_topic(rng):
+    words = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 3))]
+    return " ".join(words)
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=5000, help="lookups each for hits and misses")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    index = SimilarIndex(None, max_entries=args.entries)
+    rss_before = max_rss_mb()
+    indexed = []
+    started = time.perf_counter()
+    for i in range(args.entries):
+        topic, category, style = make_topic(rng), rng.choice(CATEGORIES), rng.choice(STYLES)
+        index.add(i, "explain", rng.choice(PHRASINGS).format(topic), category, style)
+        if len(indexed) < args.lookups and rng.random() < args.lookups * 2 / args.entries:
+            indexed.append((topic, category, style))
+    build_s = time.perf_counter() - started
+
+    def timed_lookups(queries):
+        latencies, found = [], 0
+        for question, category, style in queries:
+            t = time.perf_counter()
+            found += index.match("explain", question, category, style) is not None
+            latencies.append(time.perf_counter() - t)
+        return latencies, found
+
+    hit_queries = [(rng.choice(PHRASINGS).format(topic), category, style) for topic, category, style in indexed]
+    miss_queries = [(f"what is {make_topic(rng)} {make_topic(rng)}", rng.choice(CATEGORIES), rng.choice(STYLES))
+                    for _ in range(args.lookups)]
+    hit_latencies, hits = timed_lookups(hit_queries)
+    miss_latencies, false_hits = timed_lookups(miss_queries)
+
+    report = {
+        "entries": len(index),
+        "build_s": round(build_s, 1),
+        "build_per_entry_us": round(build_s / max(1, len(index)) * 1e6, 1),
+        "max_rss_growth_mb": round(max_rss_mb() - rss_before, 1),
+        "buckets": len(index.buckets),
+        "rephrased_lookups": dict(summarize(hit_latencies), recall=round(hits / max(1, len(hit_queries)), 3)),
+        "unseen_lookups": dict(summarize(miss_latencies), false_hit_rate=round(false_hits / max(1, len(miss_queries)), 4)),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# bench/standins.py
+"""
+Local stand-ins for the services app.py and async_app.py depend on.
+- Fake OpenAI-compatible chat completions server with configurable latency (runs in its own process).
+- In-memory MongoDB (mongomock) unless BENCH_MONGO_URL points at a real local mongod.
+- Stubbed YouTubeTranscriptApi serving synthetic transcripts of configurable length.
+install_standins() must run before app or async_app is imported.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+EXPLAIN_RESPONSE = """### Quick Dive
+A short, punchy overview of the topic.
+### Deep Dive
+The core ideas, a historical nugget and a real-life example.
+### Must-Knows
+- Concept one
+- Concept two
+### VIKAL Brain Booster
+A memorable analogy.
+### Real-World Wins
+- Use one
+- Use two
+### Flashcards
+Q: What is it? A: A thing.
+Q: Why does it matter? A: Because.
+### VIKAL’s Exam Cheat Codes
+- Watch for this trap
+- Remember this shortcut
+### Power-Ups
+Khan Academy: https://www.khanacademy.org
+"""
+
+SOLVE_RESPONSE = """### Solution
+1. Step one. 2. Step two. VIKAL’s Pro Tip: check units. \\boxed{42}
+### VIKAL’s Solve Smarter Hacks
+- Hack one
+- Hack two
+### Power-Ups
+Quick vid: https://example.com/vid
+"""
+
+SUMMARY_RESPONSE = """### Summary
+The video explains the topic.
+### Analogy
+It is like a kitchen.
+### Notes
+- 🔬 Point one
+- 🧪 Point two
+### Keywords
+- ATP - The cell's energy currency
+- Osmosis - Movement of water across a membrane
+"""
+
+CHAT_RESPONSE = "The video says the answer is 42, around [120.0s]."
+
+
+def canned_response(prompt):
+    if "### Solution" in prompt:
+        return SOLVE_RESPONSE
+    if "### Quick Dive" in prompt:
+        return EXPLAIN_RESPONSE
+    if "### Summary" in prompt:
+        return SUMMARY_RESPONSE
+    if "You are summarizing part" in prompt:
+        return "- [0.0s] A key point\nKeyword - Explanation"
+    return CHAT_RESPONSE
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def _serve_fake_openai(port, latency, token_delay):
+    from aiohttp import web
+
+    async def completions(request):
+        payload = await request.json()
+        content = canned_response(payload["messages"][0]["content"])
+        await asyncio.sleep(latency)
+        if not payload.get("stream"):
+            return web.json_response({
+                "model": payload.get("model"),
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(payload["messages"][0]["content"]) // 4, "completion_tokens": len(content) // 4}
+            })
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(0, len(content), 16):
+            chunk = {"choices": [{"delta": {"content": content[i:i + 16]}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            await asyncio.sleep(token_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def start_fake_openai(latency=0.5, token_delay=0.005, port=None):
+    """Start the fake OpenAI server in a child process; returns (process, api_url)."""
+    port = port or free_port()
+    process = multiprocessing.Process(target=_serve_fake_openai, args=(port, latency, token_delay), daemon=True)
+    process.start()
+    wait_for_port(port)
+    return process, f"http://127.0.0.1:{port}/v1/chat/completions"
+
+
+def synthetic_transcript(segments=600, seconds_per_segment=5.0):
+    words = ["cell", "energy", "membrane", "osmosis", "protein", "enzyme", "glucose", "oxygen", "nucleus", "atp"]
+    return [
+        {"start": i * seconds_per_segment, "duration": seconds_per_segment,
+         "text": " ".join(words[(i + j) % len(words)] for j in range(12))}
+        for i in range(segments)
+    ]
+
+
+def install_standins(openai_url=None, transcript_segments=600, transcript_delay=0.0):
+    """
+    Point the app at local stand-ins. Call before importing app or async_app.
+    - openai_url: fake OpenAI server URL (see start_fake_openai).
+    - transcript_segments: length of the synthetic transcript served for every video.
+    - transcript_delay: simulated YouTube fetch latency in seconds.
+    """
+    logging.disable(logging.INFO)
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+    if openai_url:
+        os.environ["OPENAI_API_URL"] = openai_url
+    mongo_url = os.getenv("BENCH_MONGO_URL")
+    if mongo_url:
+        os.environ["MONGO_URL"] = mongo_url
+    else:
+        import mongomock
+        import pymongo
+        os.environ["MONGO_URL"] = "mongodb://standin"
+        pymongo.MongoClient = mongomock.MongoClient
+
+    from youtube_transcript_api import YouTubeTranscriptApi
+    transcript = synthetic_transcript(transcript_segments)
+
+    def get_transcript(video_id, *args, **kwargs):
+        if transcript_delay:
+            time.sleep(transcript_delay)
+        return transcript
+
+    YouTubeTranscriptApi.get_transcript = staticmethod(get_transcript)
@@ -0,0 +1,133 @@
+# budget.py
+"""
+Token budgeting for every upstream call, done locally before any network round trip.
+- count_tokens(): tiktoken when installed, otherwise a conservative characters/words estimate.
+- Static template parts are counted once and cached; only the user's topic is counted per request.
+- plan_max_tokens() picks max_tokens from the style's target and the model's remaining context,
+  and raises PromptTooLarge when the input can't fit so the request is rejected up front.
+- fit_lines() samples transcript lines evenly to fit a token budget, keeping their order.
+"""
+
+import logging
+import math
+import os
+import re
+from functools import lru_cache
+
+from prompts import get_template
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+MODEL_CONTEXT = {
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT = 8192
+# Per-message framing overhead in the chat format, plus slack for estimate error
+PROMPT_OVERHEAD_TOKENS = int(os.getenv("PROMPT_OVERHEAD_TOKENS", 64))
+MIN_COMPLETION_TOKENS = int(os.getenv("MIN_COMPLETION_TOKENS", 64))
+
+
+class PromptTooLarge(ValueError):
+    """The prompt leaves too little of the model's context for a useful completion."""
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model="gpt-4"):
+    """Count prompt tokens locally. The fallback over-estimates slightly so budgets stay safe."""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(math.ceil(len(text) / 3.5), math.ceil(len(re.findall(r"\S+", text)) * 1.4))
+
+
+def context_window(model):
+    return MODEL_CONTEXT.get(model, DEFAULT_CONTEXT)
+
+
+@lru_cache(maxsize=64)
+def template_tokens(type_key, style, model="gpt-4"):
+    """
+    Pre-render a template once: returns (static tokens, {topic} occurrences, {category} occurrences).
+    """
+    template = get_template(type_key, style)
+    static = template.replace("{topic}", "").replace("{category}", "").replace("{{", "{").replace("}}", "}")
+    return count_tokens(static, model), template.count("{topic}"), template.count("{category}")
+
+
+def prompt_tokens(category, type_key, style, topic, model="gpt-4"):
+    """Token count of get_prompt(category, type_key, style, topic) without re-counting the template."""
+    # style comes straight from the request body and may not be a string; the explanation template ignores it
+    static, topic_uses, category_uses = template_tokens(type_key, str(style or "").lower(), model)
+    total = static + topic_uses * count_tokens(str(topic), model)
+    if type_key == "explanation":
+        total += category_uses * count_tokens(str(category), model)
+    return total
+
+
+def plan_max_tokens(used_tokens, target, model="gpt-4"):
+    """
+    Choose max_tokens for a prompt of used_tokens: the style's target, capped by what is left of the context.
+    - Raises PromptTooLarge when fewer than MIN_COMPLETION_TOKENS would remain.
+    """
+    remaining = context_window(model) - used_tokens - PROMPT_OVERHEAD_TOKENS
+    if remaining < min(target, MIN_COMPLETION_TOKENS):
+        raise PromptTooLarge(f"Input too long: about {used_tokens} tokens leaves no room for an answer from {model}")
+    if remaining < target:
+        logger.info(f"Capping max_tokens at {remaining} (target {target}) for a {used_tokens}-token prompt")
+    return min(target, remaining)
+
+
+def input_budget(model, completion_tokens, fixed_tokens=0):
+    """Tokens available for variable input (e.g. transcript text) once the completion and fixed prompt are reserved."""
+    return context_window(model) - completion_tokens - fixed_tokens - PROMPT_OVERHEAD_TOKENS
+
+
+def fit_prompt(template, field, text, completion_tokens, model="gpt-4", **fields):
+    """Format template with text in field, sampling text's lines so the prompt plus completion fit the context."""
+    fixed = count_tokens(template.format(**{field: ""}, **fields), model)
+    fitted = fit_lines(text, input_budget(model, completion_tokens, fixed), model)
+    return template.format(**{field: fitted}, **fields)
+
+
+def fit_lines(text, max_tokens, model="gpt-4"):
+    """
+    Return text unchanged if it fits in max_tokens, otherwise an evenly spaced, in-order sample of its lines.
+    - Timestamped transcript lines stay intact, so the model still sees where each point comes from.
+    """
+    if max_tokens <= 0:
+        raise PromptTooLarge("No token budget left for the transcript")
+    total = count_tokens(text, model)
+    if total <= max_tokens:
+        return text
+    lines = text.split("\n")
+    costs = [count_tokens(line, model) + 1 for line in lines]
+    keep_ratio = max_tokens / sum(costs)
+    picked, used, step_acc = [], 0, 0.0
+    for line, cost in zip(lines, costs):
+        step_acc += keep_ratio
+        if step_acc >= 1 and used + cost <= max_tokens:
+            picked.append(line)
+            used += cost
+            step_acc -= 1
+    logger.info(f"Sampled {len(picked)}/{len(lines)} transcript lines to fit {max_tokens} tokens")
+    return "\n".join(picked)
@@ -0,0 +1,170 @@
+# cache.py
+"""
+Response caching for VIKAL's /explain and /solve endpoints.
+- LRUCache: thread-safe in-process LRU with per-entry TTL.
+- ResponseCache: two-tier cache (in-process LRU backed by a shared MongoDB collection)
+  holding already-parsed responses, so a hit skips both the OpenAI call and the parse.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 6 * 60 * 60))
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache with a time-to-live per entry.
+    - get() returns None for missing or expired keys.
+    - set() accepts an optional ttl overriding the cache default.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace so trivially different inputs share a key."""
+    return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+
+def make_cache_key(question, category, style, template):
+    """
+    Build a stable cache key from the normalized request inputs.
+    - The unformatted prompt template (prompts.get_template) is included so template edits invalidate old entries.
+      The rendered prompt would carry the question exactly as typed and defeat the normalization.
+    """
+    raw = json.dumps([normalize_text(question), normalize_text(category), normalize_text(style), template])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for parsed LLM responses.
+    - Tier 1: in-process LRUCache (per worker).
+    - Tier 2: MongoDB collection shared across workers; documents expire via a TTL index on expiresAt.
+    MongoDB failures are logged and treated as misses so the request path never breaks on the cache.
+    """
+
+    def __init__(self, collection=None, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.collection = collection
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "sets": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def ensure_indexes(self):
+        if self.collection is None:
+            return
+        try:
+            self.collection.create_index("expiresAt", expireAfterSeconds=0)
+        except Exception as e:
+            logger.warning(f"Could not create response cache TTL index: {e}")
+
+    @timed("cache")
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({"_id": key, "expiresAt": {"$gt": datetime.utcnow()}}, {"value": 1})
+            except Exception as e:
+                logger.warning(f"Response cache lookup failed: {e}")
+                self._count("errors")
+                doc = None
+            if doc:
+                self._count("mongo_hits")
+                self.memory.set(key, doc["value"])
+                return doc["value"]
+        self._count("misses")
+        return None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.memory.set(key, value, ttl=ttl)
+        self._count("sets")
+        if self.collection is None:
+            return
+        try:
+            self.collection.replace_one(
+                {"_id": key},
+                {"_id": key, "value": value, "expiresAt": datetime.utcnow() + timedelta(seconds=ttl)},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Response cache write failed: {e}")
+            self._count("errors")
+
+    def expires_at(self, key):
+        """Expiry of the shared (MongoDB) entry for key, or None if there is none."""
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one({"_id": key}, {"expiresAt": 1})
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            self._count("errors")
+            return None
+        return doc.get("expiresAt") if doc else None
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        hits = stats["memory_hits"] + stats["mongo_hits"]
+        lookups = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["memory_size"] = len(self.memory)
+        return stats
@@ -0,0 +1,23 @@
+# db.py
+"""
+MongoDB connection shared by the Flask app, the asyncio app and background jobs.
+"""
+
+import logging
+import os
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+mongo_uri = os.getenv("MONGO_URL")
+if not mongo_uri:
+    logger.error("MONGO_URL not set")
+    raise ValueError("MONGO_URL environment variable is missing")
+client = MongoClient(mongo_uri)
+db = client["vikal"]
+chat_history = db["chat_history"]
+exam_dates = db["exam_dates"]
+users = db["users"]
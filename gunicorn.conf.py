@@ -0,0 +1,16 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings and hooks, loaded automatically from the working directory.
+- threads: WEB_THREADS request threads per worker (gthread when above 1); app.py sizes its OpenAI connection
+  pool from the same variable.
+- worker_exit: drain the chat_history write-behind buffer before a worker goes away.
+"""
+
+import os
+
+threads = int(os.getenv("WEB_THREADS", 1))
+
+
+def worker_exit(server, worker):
+    from history import history_writer
+    history_writer.close()
@@ -0,0 +1,260 @@
+# history.py
+"""
+chat_history writes for every successful API call.
+- update_stats() hands the record to a write-behind buffer instead of doing insert_one on the request path.
+- HistoryWriter flushes batches with insert_many(ordered=False) on a size or time threshold, retries failed
+  batches, and drains on worker shutdown (atexit and the gunicorn worker_exit hook).
+Set HISTORY_WRITE_BEHIND=0 to go back to synchronous inserts.
+Reads go through fetch_history(): keyset pagination on the (user_id, timestamp, _id) index, or on
+(user_id, endpoint, timestamp, _id) when filtered by endpoint, with a projection, never skip(). ensure_indexes()
+creates both, (endpoint, category) for analytics and, with HISTORY_ANONYMOUS_TTL set, a partial TTL index that
+expires anonymous users' records. bench/history_plans.py checks the query plans against a real mongod.
+"""
+
+import atexit
+import base64
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from db import chat_history
+from metrics import timed
+from routing import served_model
+from similar import SIMILAR_MATCHING, similar_index
+
+logger = logging.getLogger(__name__)
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "1") != "0"
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", 10000))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", 100))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", 1.0))
+HISTORY_MAX_RETRIES = int(os.getenv("HISTORY_MAX_RETRIES", 3))
+HISTORY_ANONYMOUS_TTL = int(os.getenv("HISTORY_ANONYMOUS_TTL", 0))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 20))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", 100))
+
+USER_TIMESTAMP_INDEX = "user_id_timestamp"
+USER_ENDPOINT_TIMESTAMP_INDEX = "user_id_endpoint_timestamp"
+SUMMARY_FIELDS = {"endpoint": 1, "question": 1, "category": 1, "style": 1, "model": 1, "timestamp": 1}
+
+
+class HistoryWriter:
+    """
+    Background batching writer for chat_history.
+    - submit() never blocks: when the queue is full the record is dropped and counted.
+    - The flusher thread starts lazily, so it's created in each gunicorn worker after the fork.
+    """
+
+    def __init__(self, collection, maxsize=HISTORY_QUEUE_SIZE, batch_size=HISTORY_BATCH_SIZE,
+                 flush_interval=HISTORY_FLUSH_INTERVAL, max_retries=HISTORY_MAX_RETRIES):
+        self.collection = collection
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"enqueued": 0, "written": 0, "dropped": 0, "retries": 0, "failed_batches": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, record):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(record)
+            self._count("enqueued")
+        except queue.Full:
+            logger.warning("chat_history write-behind queue full; dropping record")
+            self._count("dropped")
+
+    def _take_batch(self, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=max(0.0, remaining)) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take_batch(self.flush_interval)
+            if batch:
+                self._write(batch)
+        self._drain()
+
+    def _drain(self):
+        while True:
+            batch = self._take_batch(0)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                self._count("written", len(batch))
+                return
+            except BulkWriteError as e:
+                # Duplicate _ids come from a previous partially applied attempt; those records are stored
+                details = e.details or {}
+                errors = [err for err in details.get("writeErrors", []) if err.get("code") != 11000]
+                self._count("written", len(batch) - len(errors))
+                if not errors:
+                    return
+                batch = [batch[err["index"]] for err in errors]
+                logger.warning(f"chat_history batch had {len(errors)} failed records")
+            except Exception as e:
+                logger.warning(f"chat_history batch insert failed: {e}")
+            if attempt < self.max_retries:
+                self._count("retries")
+                time.sleep(min(2 ** attempt * 0.2, 5))
+        logger.error(f"Dropping {len(batch)} chat_history records after {self.max_retries} retries")
+        self._count("failed_batches")
+        self._count("dropped", len(batch))
+
+    def close(self, timeout=10):
+        """Stop the flusher and write everything still queued."""
+        thread = self._thread
+        self._stopping.set()
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        else:
+            self._drain()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self.queue.qsize()
+        return stats
+
+
+history_writer = HistoryWriter(chat_history)
+atexit.register(history_writer.close)
+
+
+@timed("history")
+def update_stats(user_id, endpoint_type, question=None, response=None, category=None, style=None, parsed=None):
+    """
+    Record one answered request. Pass parsed (the full parsed answer) for a fresh upstream answer to /explain or
+    /solve so near-duplicate questions can be served from it; the record's _id is assigned here so the
+    similarity index can point at it before the write-behind buffer flushes.
+    """
+    logger.info(f"Recording chat_history for user {user_id}: {endpoint_type}")
+    record = {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "endpoint": endpoint_type,
+        "question": question,
+        "response": response,
+        "category": category,
+        "style": style,
+        "model": served_model(),
+        "timestamp": datetime.utcnow()
+    }
+    if parsed is not None:
+        record["parsed"] = parsed
+    if HISTORY_WRITE_BEHIND:
+        history_writer.submit(record)
+    else:
+        chat_history.insert_one(record)
+    if parsed is not None and SIMILAR_MATCHING:
+        similar_index.add(record["_id"], endpoint_type, question, category, style, parsed)
+
+
+def ensure_indexes(collection=chat_history):
+    """Create chat_history's read indexes; safe to call on every startup."""
+    try:
+        collection.create_index([("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+                                name=USER_TIMESTAMP_INDEX)
+        collection.create_index([("user_id", ASCENDING), ("endpoint", ASCENDING), ("timestamp", DESCENDING),
+                                 ("_id", DESCENDING)], name=USER_ENDPOINT_TIMESTAMP_INDEX)
+        collection.create_index([("endpoint", ASCENDING), ("category", ASCENDING)], name="endpoint_category")
+    except Exception as e:
+        logger.warning(f"Could not create chat_history indexes: {e}")
+    if HISTORY_ANONYMOUS_TTL <= 0:
+        return
+    try:
+        collection.create_index("timestamp", name="anonymous_ttl", expireAfterSeconds=HISTORY_ANONYMOUS_TTL,
+                                partialFilterExpression={"user_id": "anonymous"})
+    except OperationFailure as e:
+        if e.code != 85:  # IndexOptionsConflict: the TTL changed since the index was created
+            logger.warning(f"Could not create chat_history anonymous TTL index: {e}")
+            return
+        collection.database.command("collMod", collection.name,
+                                    index={"name": "anonymous_ttl", "expireAfterSeconds": HISTORY_ANONYMOUS_TTL})
+    except Exception as e:
+        logger.warning(f"Could not create chat_history anonymous TTL index: {e}")
+
+
+def encode_cursor(doc):
+    raw = f"{doc['timestamp'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, _id) from an opaque cursor, or raise ValueError."""
+    try:
+        timestamp, entry_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(timestamp), ObjectId(entry_id)
+    except (ValueError, InvalidId, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def history_query(user_id, cursor=None, endpoint=None):
+    query = {"user_id": user_id}
+    if endpoint:
+        query["endpoint"] = endpoint
+    if cursor:
+        timestamp, entry_id = decode_cursor(cursor)
+        # The $or alone may be planned as a user_id prefix scan filtering every newer record; the top-level
+        # bound keeps each candidate plan a range scan that starts at the cursor
+        query["timestamp"] = {"$lte": timestamp}
+        query["$or"] = [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": entry_id}}]
+    return query
+
+
+def fetch_history(user_id, cursor=None, limit=HISTORY_PAGE_SIZE, endpoint=None, include_response=False, collection=chat_history):
+    """
+    One page of a user's history, newest first: (items, next_cursor).
+    - Keyset pagination: the cursor encodes the last (timestamp, _id) seen, so each page is an index range scan.
+    - response/parsed bodies are only returned with include_response.
+    """
+    limit = max(1, min(int(limit), HISTORY_PAGE_MAX))
+    projection = dict(SUMMARY_FIELDS, response=1, parsed=1) if include_response else SUMMARY_FIELDS
+    docs = list(collection.find(history_query(user_id, cursor, endpoint), projection)
+                .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+                .limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    items = []
+    for doc in docs[:limit]:
+        doc["id"] = str(doc.pop("_id"))
+        doc["timestamp"] = doc["timestamp"].isoformat() + "Z"
+        items.append(doc)
+    return items, next_cursor
@@ -0,0 +1,185 @@
+# jobs.py
+"""
+MongoDB-backed job queue for /summarize-youtube, so the transcript download and generation run in worker.py
+instead of inside an HTTP request.
+- One job per video_id does the work; every submission joins it as a request with its own id (the job id the
+  client polls). A queued or running job is found through a unique sparse activeVideoId index, so concurrent
+  submissions can't create two; a finished job is reused for SUMMARY_JOB_RESULT_TTL seconds.
+- Workers claim() a job under a lease (leaseOwner, leaseExpiresAt) and renew() it while working; a job whose
+  worker died is claimed again once the lease has expired.
+- A failed attempt is retried with exponential backoff up to SUMMARY_JOB_MAX_ATTEMPTS; a final failure refunds
+  every request's reserved chat. Completion records chat_history for each request.
+- The raw completion is stored, and result() parses it with the request's own video URL, so the payload is the
+  same notes/flashcards/resources the synchronous route returns.
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from history import update_stats
+from metrics import timed
+from parsers import parse_summary_response
+from quota import refund
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_JOB_LEASE = float(os.getenv("SUMMARY_JOB_LEASE", 120))
+SUMMARY_JOB_MAX_ATTEMPTS = int(os.getenv("SUMMARY_JOB_MAX_ATTEMPTS", 3))
+SUMMARY_JOB_RETRY_BACKOFF = float(os.getenv("SUMMARY_JOB_RETRY_BACKOFF", 10))
+SUMMARY_JOB_RESULT_TTL = int(os.getenv("SUMMARY_JOB_RESULT_TTL", 24 * 3600))
+
+ACTIVE_STATUSES = ["queued", "running"]
+JOB_STATUSES = ACTIVE_STATUSES + ["done", "failed"]
+
+
+class SummaryJobs:
+    """
+    Queue of summary jobs in one collection.
+    - submit() and result() are called by the web apps; claim(), renew(), complete() and fail() by worker.py.
+    - Finished jobs expire through a TTL index on expiresAt, which queued and running jobs don't have.
+    """
+
+    def __init__(self, collection, lease_ttl=SUMMARY_JOB_LEASE, max_attempts=SUMMARY_JOB_MAX_ATTEMPTS,
+                 retry_backoff=SUMMARY_JOB_RETRY_BACKOFF, result_ttl=SUMMARY_JOB_RESULT_TTL):
+        self.collection = collection
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.result_ttl = result_ttl
+
+    def ensure_indexes(self):
+        try:
+            self.collection.create_index("activeVideoId", unique=True, sparse=True)
+            self.collection.create_index("requests.id")
+            self.collection.create_index([("status", ASCENDING), ("availableAt", ASCENDING)])
+            self.collection.create_index([("video_id", ASCENDING), ("status", ASCENDING)])
+            self.collection.create_index("expiresAt", expireAfterSeconds=0)
+        except Exception as e:
+            logger.warning(f"Could not create summary job indexes: {e}")
+
+    @timed("jobs")
+    def submit(self, video_id, video_url, user_id, reservation):
+        """Queue a summary of video_id, or join the queued, running or recently finished job for it. Returns (job_id, job)."""
+        now = datetime.utcnow()
+        summary_request = {"id": str(ObjectId()), "user_id": user_id, "video_url": video_url,
+                           "reservation": reservation, "submittedAt": now}
+        for _ in range(3):
+            job = self.collection.find_one_and_update(
+                {"video_id": video_id, "$or": [{"status": {"$in": ACTIVE_STATUSES}},
+                                               {"status": "done", "expiresAt": {"$gt": now}}]},
+                {"$push": {"requests": summary_request}},
+                projection={"requests": 0, "response": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if job is not None:
+                logger.info(f"Summary request {summary_request['id']} joined {job['status']} job {job['_id']} for {video_id}")
+                if job["status"] == "done":
+                    self._record(job["_id"], [summary_request])
+                return summary_request["id"], job
+            job = {"_id": ObjectId(), "video_id": video_id, "activeVideoId": video_id, "status": "queued",
+                   "attempts": 0, "availableAt": now, "createdAt": now, "updatedAt": now, "requests": [summary_request]}
+            try:
+                self.collection.insert_one(job)
+                logger.info(f"Queued summary job {job['_id']} for {video_id}")
+                return summary_request["id"], job
+            except DuplicateKeyError:
+                # Another submission queued this video first; join it
+                continue
+        raise RuntimeError(f"Could not queue a summary job for {video_id}")
+
+    @timed("jobs")
+    def result(self, job_id):
+        """(payload, HTTP status) for a submitted job id, or None if it's unknown or expired."""
+        job = self.collection.find_one(
+            {"requests.id": job_id},
+            {"status": 1, "attempts": 1, "response": 1, "error": 1, "errorStatus": 1,
+             "requests": {"$elemMatch": {"id": job_id}}}
+        )
+        if job is None:
+            return None
+        if job["status"] == "done":
+            summary = parse_summary_response(job["response"], job["requests"][0]["video_url"])
+            return dict(summary, job_id=job_id, status="done"), 200
+        if job["status"] == "failed":
+            return {"error": job.get("error"), "job_id": job_id, "status": "failed"}, job.get("errorStatus", 500)
+        return {"job_id": job_id, "status": job["status"], "attempts": job.get("attempts", 0)}, 202
+
+    def claim(self, owner):
+        """Lease the next due job (or one whose lease has expired) to owner; returns the job or None."""
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {"$or": [{"status": "queued", "availableAt": {"$lte": now}},
+                     {"status": "running", "leaseExpiresAt": {"$lt": now}}]},
+            {"$set": {"status": "running", "leaseOwner": owner, "leaseExpiresAt": now + timedelta(seconds=self.lease_ttl),
+                      "updatedAt": now},
+             "$inc": {"attempts": 1}},
+            projection={"requests": 0},
+            sort=[("availableAt", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def renew(self, job, owner):
+        """Extend owner's lease on job; False if the lease was lost to another worker."""
+        result = self.collection.update_one(
+            {"_id": job["_id"], "leaseOwner": owner, "status": "running"},
+            {"$set": {"leaseExpiresAt": datetime.utcnow() + timedelta(seconds=self.lease_ttl)}}
+        )
+        return result.matched_count == 1
+
+    def complete(self, job, owner, response):
+        """Store the raw completion and record chat_history for every request; False if the lease was lost."""
+        now = datetime.utcnow()
+        done = self.collection.find_one_and_update(
+            {"_id": job["_id"], "leaseOwner": owner, "status": "running"},
+            {"$set": {"status": "done", "response": response, "updatedAt": now,
+                      "expiresAt": now + timedelta(seconds=self.result_ttl)},
+             "$unset": {"activeVideoId": "", "leaseOwner": "", "leaseExpiresAt": "", "error": ""}},
+            projection={"requests": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if done is None:
+            logger.warning(f"Lost the lease on summary job {job['_id']} before completing it")
+            return False
+        self._record(job["_id"], done["requests"], response)
+        logger.info(f"Completed summary job {job['_id']} for {len(done['requests'])} requests")
+        return True
+
+    def fail(self, job, owner, error, status=500, retry=True):
+        """Requeue job with backoff, or mark it failed (and refund every request) when out of attempts or retry=False."""
+        now = datetime.utcnow()
+        attempts = job.get("attempts", 1)
+        lease = {"_id": job["_id"], "leaseOwner": owner, "status": "running"}
+        if retry and attempts < self.max_attempts:
+            delay = self.retry_backoff * 2 ** (attempts - 1)
+            self.collection.update_one(lease, {
+                "$set": {"status": "queued", "availableAt": now + timedelta(seconds=delay), "error": str(error), "updatedAt": now},
+                "$unset": {"leaseOwner": "", "leaseExpiresAt": ""}
+            })
+            logger.warning(f"Summary job {job['_id']} attempt {attempts} failed ({error}); retrying in {delay:.0f}s")
+            return
+        failed = self.collection.find_one_and_update(lease, {
+            "$set": {"status": "failed", "error": str(error), "errorStatus": status, "updatedAt": now,
+                     "expiresAt": now + timedelta(seconds=self.result_ttl)},
+            "$unset": {"activeVideoId": "", "leaseOwner": "", "leaseExpiresAt": ""}
+        }, projection={"requests": 1}, return_document=ReturnDocument.AFTER)
+        if failed is None:
+            logger.warning(f"Lost the lease on summary job {job['_id']} before failing it")
+            return
+        logger.error(f"Summary job {job['_id']} failed after {attempts} attempts: {error}")
+        for summary_request in failed["requests"]:
+            refund(summary_request.get("reservation"))
+
+    def _record(self, job_id, summary_requests, response=None):
+        if response is None:
+            response = self.collection.find_one({"_id": job_id}, {"response": 1})["response"]
+        for summary_request in summary_requests:
+            summary = parse_summary_response(response, summary_request["video_url"])
+            update_stats(summary_request["user_id"], "summarize-youtube", summary_request["video_url"], summary["notes"])
+
+    def stats(self):
+        return {status: self.collection.count_documents({"status": status}) for status in JOB_STATUSES}
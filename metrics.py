@@ -0,0 +1,233 @@
+# metrics.py
+"""
+Per-stage latency instrumentation, exposed in Prometheus text format on /metrics.
+- Every request gets a RequestTimer in a context variable; stages (quota, cache, transcript, upstream,
+  parse, history, user_lookup) are timed with @timed(stage) or `with stage(name)` wherever they run.
+- Histograms and counters are labeled by endpoint, style and outcome, and the request's own stage
+  times are returned in a Server-Timing header.
+- Worker threads don't inherit context variables; wrap work handed to a pool with bind_context().
+Recording is a perf_counter pair, a bisect and a short lock, so the hot-path cost is a few microseconds.
+Each gunicorn worker keeps its own registry, so /metrics reports the worker that served the scrape.
+"""
+
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, dict(series, buckets=list(series["buckets"]))) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["buckets"]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series['count']}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram("vikal_request_duration_seconds", "Request latency by endpoint, style and outcome.",
+                            ["endpoint", "style", "outcome"])
+REQUESTS = Counter("vikal_requests_total", "Requests by endpoint, style and outcome.", ["endpoint", "style", "outcome"])
+STAGE_LATENCY = Histogram("vikal_stage_duration_seconds", "Latency of each request stage by endpoint and outcome.",
+                          ["endpoint", "stage", "outcome"])
+STAGE_ERRORS = Counter("vikal_stage_errors_total", "Stage calls that raised, by endpoint and stage.", ["endpoint", "stage"])
+REGISTRY = [REQUEST_LATENCY, REQUESTS, STAGE_LATENCY, STAGE_ERRORS]
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestTimer:
+    """Stage totals for one request; shared with the worker threads it hands work to."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.style = ""
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self, total):
+        with self._lock:
+            stages = list(self.stages.items())
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current = contextvars.ContextVar("request_timer", default=None)
+
+
+def begin_request(endpoint):
+    timer = RequestTimer(endpoint)
+    _current.set(timer)
+    return timer
+
+
+def set_style(style):
+    timer = _current.get()
+    if timer is not None and style:
+        timer.style = str(style).lower()
+
+
+def current_labels():
+    """(endpoint, style) of the request being handled, or (None, "") outside a request."""
+    timer = _current.get()
+    return (timer.endpoint, timer.style) if timer is not None else (None, "")
+
+
+def outcome_for(status):
+    if status == 403:
+        return "quota_exceeded"
+    if status == 413:
+        return "too_large"
+    if status >= 500:
+        return "error"
+    if status >= 400:
+        return "bad_request"
+    return "ok"
+
+
+def finish_request(status, timer=None):
+    """Record the request and return its Server-Timing header value."""
+    timer = timer or _current.get()
+    if timer is None:
+        return None
+    total = time.perf_counter() - timer.started
+    outcome = outcome_for(status)
+    REQUEST_LATENCY.observe(total, timer.endpoint, timer.style, outcome)
+    REQUESTS.inc(timer.endpoint, timer.style, outcome)
+    return timer.server_timing(total)
+
+
+def record_stage(stage_name, seconds, ok=True):
+    timer = _current.get()
+    endpoint = timer.endpoint if timer is not None else "background"
+    STAGE_LATENCY.observe(seconds, endpoint, stage_name, "ok" if ok else "error")
+    if not ok:
+        STAGE_ERRORS.inc(endpoint, stage_name)
+    if timer is not None:
+        timer.add(stage_name, seconds)
+
+
+@contextmanager
+def stage(stage_name):
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        record_stage(stage_name, time.perf_counter() - started, ok)
+
+
+def timed(stage_name):
+    """Decorator form of stage(); works on plain functions and coroutine functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                ok = False
+                try:
+                    result = await func(*args, **kwargs)
+                    ok = True
+                    return result
+                finally:
+                    record_stage(stage_name, time.perf_counter() - started, ok)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            ok = False
+            try:
+                result = func(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                record_stage(stage_name, time.perf_counter() - started, ok)
+        return wrapper
+    return decorator
+
+
+def bind_context(func):
+    """Return func bound to the caller's context, so stages it records in a pool thread count for this request."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
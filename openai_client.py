@@ -0,0 +1,205 @@
+# openai_client.py
+"""
+Pooled, resilient HTTP client for the OpenAI chat completions API.
+- One shared requests.Session with keep-alive connection pooling sized to worker concurrency.
+- Connect/read timeouts on every call so a stalled upstream can't hang a worker.
+- Exponential backoff with full jitter on 429 and 5xx, honoring Retry-After.
+- A circuit breaker that fails fast while the upstream is unhealthy.
+The API URL is configurable (OPENAI_API_URL) so the client can be pointed at a local fake server.
+"""
+
+import email.utils
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", 16))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", 60))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 3))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", 0.5))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", 8))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without touching the network while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+    - Opens after failure_threshold consecutive upstream failures.
+    - After reset_timeout seconds one trial call is let through (half-open); success closes it again.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                logger.warning(f"Circuit breaker opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """End a half-open trial that was abandoned (e.g. cancelled) without an upstream verdict."""
+        with self._lock:
+            self.trial_in_flight = False
+
+
+def parse_retry_after(value):
+    """Return the Retry-After delay in seconds (delta-seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt, base=OPENAI_BACKOFF_BASE, cap=OPENAI_BACKOFF_MAX):
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def build_session(pool_size=OPENAI_POOL_SIZE):
+    """Session whose pool keeps pool_size connections to the API host; size it to the threads calling upstream."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class OpenAIClient:
+    """
+    Thin chat-completions client shared by every request in the process.
+    - post() returns the successful requests.Response (streamed when stream=True) or raises
+      requests.RequestException / CircuitOpenError.
+    """
+
+    def __init__(self, api_key, api_url=OPENAI_API_URL, session=None, breaker=None,
+                 connect_timeout=OPENAI_CONNECT_TIMEOUT, read_timeout=OPENAI_READ_TIMEOUT,
+                 max_retries=OPENAI_MAX_RETRIES):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.session = session or build_session()
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+
+    def headers(self):
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    def post(self, payload, stream=False):
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("OpenAI circuit breaker is open; failing fast")
+            retry_after = None
+            try:
+                response = self.session.post(self.api_url, json=payload, headers=self.headers(),
+                                             timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"OpenAI request failed ({e}); retrying")
+            except Exception:
+                # Anything else (TooManyRedirects, ContentDecodingError, ...) still counts against the breaker,
+                # which also ends a half-open trial instead of leaving it in flight forever
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    # Other 4xx are caller errors, not upstream health problems
+                    self.breaker.record_success()
+                    response.raise_for_status()
+                    return response
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    response.raise_for_status()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                logger.warning(f"OpenAI returned {response.status_code}; retrying")
+                response.close()
+            delay = backoff_delay(attempt)
+            if retry_after is not None:
+                delay = min(max(delay, retry_after), OPENAI_BACKOFF_MAX)
+            time.sleep(delay)
+            attempt += 1
+
+    def chat_completion(self, prompt, max_tokens=700, model="gpt-4"):
+        payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "max_tokens": max_tokens}
+        response = self.post(payload)
+        return response.json()["choices"][0]["message"]["content"]
+
+    def stream_chat_completion(self, prompt, max_tokens=700, model="gpt-4"):
+        """Yield content deltas as they arrive from a stream=True completion."""
+        payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "max_tokens": max_tokens, "stream": True}
+        response = self.post(payload, stream=True)
+        try:
+            for raw in response.iter_lines():
+                line = raw.decode("utf-8")
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+        finally:
+            response.close()
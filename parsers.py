@@ -0,0 +1,79 @@
+# parsers.py
+"""
+Parsers that turn VIKAL's ###-sectioned completions into the JSON payloads returned by the API.
+- parse_explain_response: /explain
+- parse_solve_response: /solve
+- parse_summary_response: /summarize-youtube
+"""
+
+import re
+
+from metrics import timed
+
+@timed("parse")
+def parse_explain_response(response):
+    parts = re.split(r'###\s', response)
+    parts = [part.strip() for part in parts if part.strip()]
+    notes, points_to_remember, flashcards, resources = "", [], [], []
+    for part in parts:
+        if part.startswith("Quick Dive"):
+            notes += part.replace("Quick Dive", "").strip() + "\n\n"
+        elif part.startswith("Deep Dive"):
+            notes += "**Deep Dive**\n" + part.replace("Deep Dive", "").strip() + "\n\n"
+        elif part.startswith("Must-Knows"):
+            notes += "**Must-Knows**\n" + part.replace("Must-Knows", "").strip() + "\n\n"
+        elif part.startswith("VIKAL Brain Booster"):
+            notes += "**VIKAL Brain Booster**\n" + part.replace("VIKAL Brain Booster", "").strip() + "\n\n"
+        elif part.startswith("Real-World Wins"):
+            notes += "**Real-World Wins**\n" + part.replace("Real-World Wins", "").strip() + "\n\n"
+        elif part.startswith("VIKAL’s Exam Cheat Codes"):
+            points_to_remember = part.replace("VIKAL’s Exam Cheat Codes", "").strip().split("\n")
+            points_to_remember = [p.strip() for p in points_to_remember if p.strip()]
+        elif part.startswith("Flashcards"):
+            flashcards_raw = part.replace("Flashcards", "").strip().split("\n")
+            for f in flashcards_raw:
+                if "Q:" in f and "A:" in f:
+                    q, a = f.split("A:", 1)
+                    flashcards.append({"question": q.replace("Q:", "").strip(), "answer": a.strip()})
+        elif part.startswith("Power-Ups"):
+            resources = part.replace("Power-Ups", "").strip().split("\n")[:3]
+            resources = [{"title": r.split(": ")[0].strip(), "url": r.split(": ")[1].strip() if ": " in r else r.strip()} for r in resources if r.strip()]
+    return {"notes": notes, "points_to_remember": points_to_remember, "flashcards": flashcards, "resources": resources}
+
+@timed("parse")
+def parse_solve_response(response):
+    parts = re.split(r'###\s', response)
+    parts = [part.strip() for part in parts if part.strip()]
+    notes, points_to_remember, resources = "", [], []
+    for part in parts:
+        if part.startswith("Solution"):
+            notes = part.replace("Solution", "").strip()
+        elif part.startswith("VIKAL’s Solve Smarter Hacks"):
+            points_to_remember = part.replace("VIKAL’s Solve Smarter Hacks", "").strip().split("\n")
+            points_to_remember = [p.strip() for p in points_to_remember if p.strip()]
+        elif part.startswith("Power-Ups"):
+            resources = part.replace("Power-Ups", "").strip().split("\n")[:5]
+            resources = [{"title": r.split(": ")[0].strip(), "url": r.split(": ")[1].strip() if ": " in r else r.strip()} for r in resources if r.strip()]
+    return {"notes": notes, "points_to_remember": points_to_remember, "flashcards": [], "resources": resources}
+
+@timed("parse")
+def parse_summary_response(response, video_url):
+    parts = re.split(r'###\s', response)
+    summary_part = next((part for part in parts if part.startswith("Summary")), "")
+    analogy_part = next((part for part in parts if part.startswith("Analogy")), "")
+    notes_part = next((part for part in parts if part.startswith("Notes")), "")
+    keywords_part = next((part for part in parts if part.startswith("Keywords")), "")
+
+    summary = summary_part.replace("Summary", "").strip() if summary_part else ""
+    analogy = analogy_part.replace("Analogy", "").strip() if analogy_part else ""
+    notes = notes_part.replace("Notes", "").strip().split("\n")[:10] if notes_part else []
+    keywords = keywords_part.replace("Keywords", "").strip().split("\n") if keywords_part else []
+
+    combined_notes = f"{summary}\n\n**Analogy:** {analogy}\n\n**Key Points:**\n" + "\n".join(notes)
+    flashcards = [f"{kw.split(' - ')[0]} - {kw.split(' - ')[1]}" for kw in keywords[:5] if " - " in kw]
+    resources = [
+        {"title": "YouTube Video", "url": video_url},
+        {"title": "Wikipedia", "url": "https://en.wikipedia.org/wiki/YouTube"},
+        {"title": "Khan Academy", "url": "https://www.khanacademy.org"}
+    ]
+    return {"notes": combined_notes, "flashcards": flashcards, "resources": resources}
@@ -0,0 +1,276 @@
+# prewarm.py
+"""
+Off-peak prewarming of the response cache with the topics students ask most, ahead of exam-date spikes.
+- plan(): counts /explain and /solve requests in chat_history over the last PREWARM_WINDOW_DAYS per
+  (endpoint, category, style, question), with /solve-batch counted as /solve and case/whitespace variants
+  merged. Counts are weighted by how close the category's next exam in exam_dates is, and the top
+  PREWARM_TOP_PER_GROUP topics of each (endpoint, category, style) are kept, most valuable first.
+- Prewarmer.run(): generates and parses the answer for each planned topic, routed to the model a live request
+  would get, and writes it to the shared response_cache collection under every variant's cache key with a
+  PREWARM_TTL expiry. cached_answer() reads that collection before call_openai, so the web apps need no changes.
+- Calls are paced to PREWARM_CALLS_PER_MINUTE, capped per run by PREWARM_MAX_CALLS and PREWARM_MAX_TOKENS
+  (prompt plus completion budget) and only made inside PREWARM_HOURS (UTC, "start-end"). Topics whose cached
+  answer still has PREWARM_MIN_REMAINING seconds to live are skipped.
+exam_dates documents look like {"exam": "jee", "date": <datetime>, "subjects": ["physics", ...]}; subjects
+are optional and get the exam's weight too.
+Runs as its own process so it never competes with web workers for threads or OpenAI connections:
+    python prewarm.py --dry-run     # print the plan only
+    python prewarm.py               # one run, if inside PREWARM_HOURS (--force ignores the hours)
+    python prewarm.py --loop        # one run per off-peak window (the Procfile "prewarm" process)
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from budget import PromptTooLarge, plan_max_tokens, prompt_tokens
+from cache import ResponseCache, make_cache_key, normalize_text
+from db import chat_history, db, exam_dates
+from metrics import begin_request, set_style
+from openai_client import OpenAIClient
+from parsers import parse_explain_response, parse_solve_response
+from prompts import EXPLAIN_MAX_TOKENS, SOLVE_MAX_TOKENS, TYPE_KEYS, get_prompt, get_template
+from routing import ModelRouter, served_model
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+PREWARM_WINDOW_DAYS = float(os.getenv("PREWARM_WINDOW_DAYS", 7))
+PREWARM_TOP_PER_GROUP = int(os.getenv("PREWARM_TOP_PER_GROUP", 10))
+PREWARM_MIN_COUNT = int(os.getenv("PREWARM_MIN_COUNT", 3))
+PREWARM_SCAN_LIMIT = int(os.getenv("PREWARM_SCAN_LIMIT", 50000))
+PREWARM_MAX_VARIANTS = int(os.getenv("PREWARM_MAX_VARIANTS", 5))
+PREWARM_EXAM_HORIZON_DAYS = float(os.getenv("PREWARM_EXAM_HORIZON_DAYS", 30))
+PREWARM_EXAM_BOOST = float(os.getenv("PREWARM_EXAM_BOOST", 4))
+PREWARM_HOURS = os.getenv("PREWARM_HOURS", "20-2")
+PREWARM_CALLS_PER_MINUTE = float(os.getenv("PREWARM_CALLS_PER_MINUTE", 20))
+PREWARM_MAX_CALLS = int(os.getenv("PREWARM_MAX_CALLS", 300))
+PREWARM_MAX_TOKENS = int(os.getenv("PREWARM_MAX_TOKENS", 300000))
+PREWARM_TTL = int(os.getenv("PREWARM_TTL", 2 * 24 * 3600))
+PREWARM_MIN_REMAINING = int(os.getenv("PREWARM_MIN_REMAINING", 12 * 3600))
+
+PREWARM_ENDPOINTS = {"explain": "explain", "solve": "solve", "solve-batch": "solve"}
+PARSERS = {"explain": parse_explain_response, "solve": parse_solve_response}
+
+
+def parse_hours(spec):
+    """'20-2' -> (20, 2): from 20:00 up to 02:00 UTC, wrapping past midnight. '0-24' is always on."""
+    start, end = (int(part) for part in spec.split("-"))
+    if not (0 <= start <= 23 and 0 <= end <= 24):
+        raise ValueError(f"Invalid PREWARM_HOURS {spec!r}")
+    return start, end
+
+
+def in_window(now, hours):
+    start, end = hours
+    if start < end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+def seconds_until(now, hours, inside=True):
+    """Seconds until the window opens (inside=True) or closes (inside=False); 0 if that's already the case."""
+    if in_window(now, hours) == inside:
+        return 0.0
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    for step in range(1, 25):
+        boundary = hour + timedelta(hours=step)
+        if in_window(boundary, hours) == inside:
+            return (boundary - now).total_seconds()
+    # The window is always open (or never); nothing to wait for
+    return 0.0
+
+
+def exam_weights(now, collection=exam_dates, horizon_days=PREWARM_EXAM_HORIZON_DAYS, boost=PREWARM_EXAM_BOOST):
+    """Normalized category -> weight: 1 + boost for an exam today, falling linearly to 1 at the horizon."""
+    horizon = timedelta(days=horizon_days)
+    weights = {}
+    for doc in collection.find({"date": {"$gte": now, "$lte": now + horizon}}, {"exam": 1, "date": 1, "subjects": 1}):
+        closeness = 1 - (doc["date"] - now) / horizon
+        weight = 1 + boost * closeness
+        for category in [doc.get("exam")] + list(doc.get("subjects") or []):
+            if category:
+                key = normalize_text(category)
+                weights[key] = max(weights.get(key, 1.0), weight)
+    return weights
+
+
+def aggregate(since, collection=chat_history, limit=PREWARM_SCAN_LIMIT):
+    """Request counts per exact (endpoint, category, style, question) since the given time, largest first."""
+    pipeline = [
+        {"$match": {"endpoint": {"$in": list(PREWARM_ENDPOINTS)}, "timestamp": {"$gte": since}}},
+        {"$group": {
+            "_id": {"endpoint": "$endpoint", "category": "$category", "style": "$style", "question": "$question"},
+            "count": {"$sum": 1},
+        }},
+        {"$sort": {"count": -1}},
+        {"$limit": limit},
+    ]
+    return list(collection.aggregate(pipeline, allowDiskUse=True))
+
+
+def plan(now=None, history=chat_history, exams=exam_dates, window_days=PREWARM_WINDOW_DAYS,
+         top_per_group=PREWARM_TOP_PER_GROUP, min_count=PREWARM_MIN_COUNT):
+    """
+    Ranked list of topics to prewarm. Each topic holds the request-weighted variants (question, category,
+    style) as users typed them; the most common one is used for the prompt.
+    """
+    now = now or datetime.utcnow()
+    weights = exam_weights(now, exams)
+    topics = {}
+    for row in aggregate(now - timedelta(days=window_days), history):
+        fields = row["_id"]
+        endpoint = PREWARM_ENDPOINTS.get(fields.get("endpoint"))
+        question, category, style = fields.get("question"), fields.get("category"), fields.get("style") or "teacher"
+        if not endpoint or not question or not category:
+            continue
+        key = (endpoint, normalize_text(category), normalize_text(style), normalize_text(question))
+        topic = topics.setdefault(key, {"endpoint": endpoint, "category": key[1], "style": key[2], "count": 0, "variants": {}})
+        topic["count"] += row["count"]
+        variant = (question, category, style)
+        topic["variants"][variant] = topic["variants"].get(variant, 0) + row["count"]
+
+    groups = {}
+    for topic in topics.values():
+        if topic["count"] < min_count:
+            continue
+        topic["weight"] = round(weights.get(topic["category"], 1.0), 2)
+        topic["score"] = round(topic["count"] * topic["weight"], 2)
+        topic["variants"] = [variant for variant, _ in sorted(topic["variants"].items(), key=lambda item: -item[1])][:PREWARM_MAX_VARIANTS]
+        groups.setdefault((topic["endpoint"], topic["category"], topic["style"]), []).append(topic)
+    ranked = []
+    for group in groups.values():
+        ranked.extend(sorted(group, key=lambda topic: -topic["score"])[:top_per_group])
+    return sorted(ranked, key=lambda topic: -topic["score"])
+
+
+def build_prompt(endpoint, question, category, style):
+    """(prompt, prompt tokens, max_tokens) exactly as the live /explain or /solve route would build them."""
+    type_key = TYPE_KEYS[endpoint]
+    target = EXPLAIN_MAX_TOKENS if endpoint == "explain" else SOLVE_MAX_TOKENS.get(style.lower(), 150)
+    used = prompt_tokens(category, type_key, style, question)
+    return get_prompt(category, type_key, style, question), used, plan_max_tokens(used, target)
+
+
+class Prewarmer:
+    """
+    Generates planned answers into the response cache under a rate and token budget.
+    - invoke(prompt, max_tokens, model) performs one completion, as for ModelRouter.call().
+    """
+
+    def __init__(self, cache, invoke, router=None, hours=PREWARM_HOURS, calls_per_minute=PREWARM_CALLS_PER_MINUTE,
+                 max_calls=PREWARM_MAX_CALLS, max_tokens=PREWARM_MAX_TOKENS, ttl=PREWARM_TTL,
+                 min_remaining=PREWARM_MIN_REMAINING):
+        self.cache = cache
+        self.invoke = invoke
+        self.router = router or ModelRouter()
+        self.hours = parse_hours(hours)
+        self.interval = 60 / calls_per_minute if calls_per_minute > 0 else 0
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+        self.min_remaining = min_remaining
+
+    def is_warm(self, keys):
+        fresh_until = datetime.utcnow() + timedelta(seconds=self.min_remaining)
+        for key in keys:
+            expires_at = self.cache.expires_at(key)
+            if expires_at is None or expires_at < fresh_until:
+                return False
+        return True
+
+    def run(self, topics, force=False):
+        report = {"planned": len(topics), "warmed": 0, "already_warm": 0, "too_large": 0, "failed": 0,
+                  "calls": 0, "tokens": 0, "models": {}, "stopped": None}
+        last_call = 0.0
+        for topic in topics:
+            if not force and not in_window(datetime.utcnow(), self.hours):
+                report["stopped"] = "outside PREWARM_HOURS"
+                break
+            if report["calls"] >= self.max_calls:
+                report["stopped"] = "call budget"
+                break
+            endpoint, style = topic["endpoint"], topic["variants"][0][2]
+            try:
+                prompt, used, max_tokens = build_prompt(endpoint, *topic["variants"][0])
+                keys = [make_cache_key(question, category, variant_style, get_template(TYPE_KEYS[endpoint], variant_style))
+                        for question, category, variant_style in topic["variants"]]
+            except PromptTooLarge:
+                report["too_large"] += 1
+                continue
+            if self.is_warm(keys):
+                report["already_warm"] += 1
+                continue
+            if report["tokens"] + used + max_tokens > self.max_tokens:
+                report["stopped"] = "token budget"
+                break
+
+            wait = last_call + self.interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            last_call = time.monotonic()
+            report["calls"] += 1
+            report["tokens"] += used + max_tokens
+            # Label the call like a live request so the router picks the same model (and stages are attributed)
+            begin_request(f"/{endpoint}")
+            set_style(style)
+            try:
+                parsed_response = PARSERS[endpoint](self.router.call(prompt, max_tokens, self.invoke))
+            except Exception as e:
+                logger.error(f"Prewarming {endpoint} {topic['variants'][0][0][:60]!r} failed: {e}")
+                report["failed"] += 1
+                continue
+            for key in keys:
+                self.cache.set(key, parsed_response, ttl=self.ttl)
+            model = served_model()
+            report["models"][model] = report["models"].get(model, 0) + 1
+            report["warmed"] += 1
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without calling OpenAI")
+    parser.add_argument("--force", action="store_true", help="run now even outside PREWARM_HOURS")
+    parser.add_argument("--loop", action="store_true", help="keep running, once per off-peak window")
+    parser.add_argument("--limit", type=int, help="prewarm at most this many topics per run")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.dry_run:
+        topics = plan()[:args.limit]
+        print(json.dumps([dict(topic, variants=[list(variant) for variant in topic["variants"]]) for topic in topics], indent=2))
+        return
+
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    if not OPENAI_API_KEY:
+        logger.error("OPENAI_API_KEY not set")
+        raise ValueError("OPENAI_API_KEY environment variable is required")
+    openai_client = OpenAIClient(OPENAI_API_KEY)
+    response_cache = ResponseCache(db["response_cache"])
+    response_cache.ensure_indexes()
+    prewarmer = Prewarmer(response_cache, lambda prompt, max_tokens, model: openai_client.chat_completion(prompt, max_tokens, model))
+
+    while True:
+        if args.loop:
+            wait = seconds_until(datetime.utcnow(), prewarmer.hours)
+            if wait:
+                logger.info(f"Next prewarm run in {wait / 3600:.1f}h")
+                time.sleep(wait)
+        topics = plan()[:args.limit]
+        logger.info(f"Prewarming up to {len(topics)} topics")
+        report = prewarmer.run(topics, force=args.force)
+        logger.info(f"Prewarm run finished: {json.dumps(report)}")
+        if not args.loop:
+            break
+        # One run per window: wait for this one to close before planning the next
+        time.sleep(max(60.0, seconds_until(datetime.utcnow(), prewarmer.hours, inside=False)))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 """
 VIKAL’s next-level prompt templates—crafted to make learning epic.
 - Generic: Bold, engaging explanations and solutions for /explain and /solve endpoints.
+- YouTube: Summary template for /summarize-youtube (plus the map/reduce prompts used for long videos) and the /chat-youtube prompt.
 """
 
 PROMPTS = {
@@ -108,6 +109,54 @@ Make it rigorous, rich, and VIKAL-bold!
     }
 }
 
+# Target completion budgets (per style for /solve); budget.plan_max_tokens caps them by the remaining context
+SOLVE_MAX_TOKENS = {"smart": 75, "step": 150, "teacher": 150, "research": 225}
+EXPLAIN_MAX_TOKENS = 700
+YOUTUBE_CHAT_MAX_TOKENS = 500
+
+YOUTUBE_SUMMARY_PROMPT = """
+Your output should use the following template:
+### Summary
+### Analogy
+### Notes
+- [Emoji] Bulletpoint
+### Keywords
+- Explanation
+You have been tasked with creating a concise summary of a YouTube video using its transcription.
+Make a summary of the transcript.
+Additionally make a short complex analogy to give context and/or analogy from day-to-day life from the transcript.
+Create 10 bullet points (each with an appropriate emoji) that summarize the key points or important moments from the video's transcription.
+In addition to the bullet points, extract the most important keywords and any complex words not known to the average reader as well as any acronyms mentioned. For each keyword and complex word, provide an explanation and definition based on its occurrence in the transcription.
+Please ensure that the summary, bullet points, and explanations fit within the 330-word limit, while still offering a comprehensive and clear understanding of the video's content. Use the text above: Video Title {video_id} {transcript_text}.
+"""
+
+YOUTUBE_SEGMENT_PROMPT = """
+You are summarizing part {index} of {total} of a YouTube video transcript (Video Title {video_id}).
+Write 5-8 concise bullet points covering the key points of this part, keeping their [start]s timestamps.
+Then list any important keywords, complex words or acronyms as "Keyword - Explanation".
+Transcript part:
+{transcript_text}
+"""
+
+YOUTUBE_CHAT_PROMPT = "Based on these excerpts from a YouTube video transcript: {transcript_text}, answer the following question: {query}"
+
+YOUTUBE_REDUCE_NOTE = "(The transcript below is a set of timestamped notes covering the whole video, part by part.)\n"
+
+# Prompt type behind each cached endpoint
+TYPE_KEYS = {"explain": "explanation", "solve": "solution", "solve-batch": "solution"}
+
+def get_template(type_key, style):
+    """
+    Return the unformatted template get_prompt renders for type_key and style.
+    - For /explain: generic.explanation.
+    - For /solve: generic.solution for the style, falling back to teacher.
+    """
+    if type_key == "explanation":
+        return PROMPTS["generic"]["explanation"]
+    # Default to generic for all categories for now; expand with 'exams' later if needed
+    section = "generic"
+    return PROMPTS.get(section, {}).get(type_key, {}).get(style.lower(), PROMPTS["generic"]["solution"]["teacher"])
+
 def get_prompt(category, type_key, style, topic, transcript=None):
     """
     Fetch the appropriate prompt based on category, type_key, style, and topic.
@@ -115,7 +164,5 @@ def get_prompt(category, type_key, style, topic, transcript=None):
     - For /solve: Uses generic.solution with the specified style.
     """
     if type_key == "explanation":
-        return PROMPTS["generic"]["explanation"].format(topic=topic, category=category)
-    # Default to generic for all categories for now; expand with 'exams' later if needed
-    section = "generic"
-    return PROMPTS.get(section, {}).get(type_key, {}).get(style.lower(), PROMPTS["generic"]["solution"]["teacher"]).format(topic=topic)
+        return get_template(type_key, style).format(topic=topic, category=category)
+    return get_template(type_key, style).format(topic=topic)
@@ -0,0 +1,85 @@
+# quota.py
+"""
+Free-tier chat quota for every metered endpoint.
+- reserve(): one find_one_and_update that creates the user if needed, checks the limit and charges one
+  chat atomically, so concurrent requests from a free user can't slip past FREE_CHAT_LIMIT.
+- refund(): gives the chat back when the upstream call fails after a reservation.
+- Pro users are remembered in a short-lived in-process cache and skip MongoDB entirely.
+"""
+
+import logging
+import os
+from datetime import datetime
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from cache import LRUCache
+from db import users
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+FREE_CHAT_LIMIT = int(os.getenv("FREE_CHAT_LIMIT", 3))
+PRO_CACHE_TTL = int(os.getenv("PRO_CACHE_TTL", 60))
+PRO_CACHE_SIZE = int(os.getenv("PRO_CACHE_SIZE", 10000))
+
+_pro_users = LRUCache(maxsize=PRO_CACHE_SIZE, ttl=PRO_CACHE_TTL)
+
+
+def _reserve_update(email):
+    """Aggregation-pipeline update: fill defaults for new users and charge one chat unless Pro."""
+    is_pro = {"$eq": [{"$ifNull": ["$isPro", False]}, True]}
+    chat_count = {"$ifNull": ["$chatCount", 0]}
+    return [{"$set": {
+        "email": {"$ifNull": ["$email", email]},
+        "isPro": {"$ifNull": ["$isPro", False]},
+        "createdAt": {"$ifNull": ["$createdAt", datetime.utcnow()]},
+        "chatCount": {"$cond": [is_pro, chat_count, {"$add": [chat_count, 1]}]}
+    }}]
+
+
+@timed("quota")
+def reserve(user_id, email="unknown"):
+    """
+    Reserve one chat for user_id.
+    - Returns a reservation {"user_id", "isPro", "charged", "chatCount"} or None when the free limit is reached.
+    - A free user over the limit doesn't match the filter, so the upsert collides on _id (DuplicateKeyError).
+      A collision can also mean a concurrent request just created the user, so it is retried once.
+    """
+    if _pro_users.get(user_id):
+        return {"user_id": user_id, "isPro": True, "charged": False, "chatCount": None}
+
+    query = {"_id": user_id, "$or": [
+        {"isPro": True},
+        {"chatCount": {"$lt": FREE_CHAT_LIMIT}},
+        {"chatCount": {"$exists": False}}
+    ]}
+    for attempt in range(2):
+        try:
+            user = users.find_one_and_update(query, _reserve_update(email), upsert=True,
+                                             return_document=ReturnDocument.AFTER)
+            break
+        except DuplicateKeyError:
+            if attempt:
+                logger.warning(f"User {user_id} hit chat limit")
+                return None
+
+    if user.get("isPro"):
+        _pro_users.set(user_id, True)
+        return {"user_id": user_id, "isPro": True, "charged": False, "chatCount": user.get("chatCount", 0)}
+    logger.info(f"Reserved chat {user['chatCount']}/{FREE_CHAT_LIMIT} for user {user_id}")
+    return {"user_id": user_id, "isPro": False, "charged": True, "chatCount": user["chatCount"]}
+
+
+@timed("quota")
+def refund(reservation):
+    """Return a reserved chat after a failed request. Safe to call with None or a Pro reservation."""
+    if not reservation or not reservation["charged"]:
+        return
+    try:
+        users.update_one({"_id": reservation["user_id"], "chatCount": {"$gt": 0}}, {"$inc": {"chatCount": -1}})
+        reservation["charged"] = False
+        logger.info(f"Refunded chat for user {reservation['user_id']}")
+    except Exception as e:
+        logger.error(f"Failed to refund chat for user {reservation['user_id']}: {e}")
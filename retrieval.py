@@ -0,0 +1,110 @@
+# retrieval.py
+"""
+Transcript retrieval for /chat-youtube.
+- Splits a transcript into time-windowed chunks and ranks them against a question with BM25.
+- One ChunkIndex is built per video and reused across follow-up questions, so only the
+  top-k relevant chunks (with their [start]s timestamps) are sent to the model.
+"""
+
+import logging
+import math
+import os
+import re
+from collections import Counter
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+CHAT_CHUNK_SECONDS = float(os.getenv("CHAT_CHUNK_SECONDS", 60))
+CHAT_TOP_K = int(os.getenv("CHAT_TOP_K", 6))
+CHUNK_INDEX_CACHE_SIZE = int(os.getenv("CHUNK_INDEX_CACHE_SIZE", 128))
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "do", "does", "for", "from", "how", "i", "in",
+    "is", "it", "of", "on", "or", "so", "that", "the", "this", "to", "was", "what", "when", "where", "which",
+    "who", "why", "with", "you", "about", "can", "did", "he", "she", "they", "we", "video", "say", "says"
+}
+
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS]
+
+
+def chunk_segments(segments, window_seconds=CHAT_CHUNK_SECONDS):
+    """
+    Group transcript segments into consecutive chunks spanning roughly window_seconds each.
+    - Each chunk keeps its segments' [start]s timestamps in its text.
+    """
+    chunks, current, chunk_start = [], [], None
+    for item in segments:
+        if chunk_start is None:
+            chunk_start = item["start"]
+        if current and item["start"] - chunk_start >= window_seconds:
+            chunks.append({"start": chunk_start, "text": "\n".join(current)})
+            current, chunk_start = [], item["start"]
+        current.append(f"[{item['start']:.1f}s] {item['text']}")
+    if current:
+        chunks.append({"start": chunk_start, "text": "\n".join(current)})
+    return chunks
+
+
+class ChunkIndex:
+    """BM25 index over the chunks of a single transcript."""
+
+    def __init__(self, segments, window_seconds=CHAT_CHUNK_SECONDS, k1=1.5, b=0.75):
+        self.chunks = chunk_segments(segments, window_seconds)
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize(chunk["text"])) for chunk in self.chunks]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        doc_freqs = Counter()
+        for tf in self.term_freqs:
+            doc_freqs.update(tf.keys())
+        n = len(self.chunks)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    def scores(self, query):
+        terms = [t for t in set(tokenize(query)) if t in self.idf]
+        scores = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length) if self.avg_length else self.k1
+            scores.append(sum(self.idf[t] * tf[t] * (self.k1 + 1) / (tf[t] + norm) for t in terms if t in tf))
+        return scores
+
+    def top_chunks(self, query, k=CHAT_TOP_K):
+        """
+        Return the k most relevant chunks in chronological order.
+        - Short transcripts (k chunks or fewer) are returned whole.
+        - If nothing matches the query, evenly spaced chunks are returned as a fallback.
+        """
+        if len(self.chunks) <= k:
+            return list(self.chunks)
+        scores = self.scores(query)
+        if not any(scores):
+            step = len(self.chunks) / k
+            picked = sorted({int(i * step) for i in range(k)})
+        else:
+            ranked = sorted(range(len(self.chunks)), key=lambda i: scores[i], reverse=True)
+            picked = sorted(i for i in ranked[:k] if scores[i] > 0)
+        return [self.chunks[i] for i in picked]
+
+
+_indexes = LRUCache(maxsize=CHUNK_INDEX_CACHE_SIZE, ttl=24 * 60 * 60)
+
+
+def get_chunk_index(video_id, segments):
+    """Return the cached ChunkIndex for a video, building it on first use."""
+    index = _indexes.get(video_id)
+    if index is None:
+        logger.info(f"Building chunk index for video ID: {video_id}")
+        index = ChunkIndex(segments)
+        _indexes.set(video_id, index)
+    return index
+
+
+def select_context(video_id, segments, query, k=CHAT_TOP_K):
+    """Render the top-k chunks for a question as timestamped transcript text."""
+    chunks = get_chunk_index(video_id, segments).top_chunks(query, k)
+    return "\n...\n".join(chunk["text"] for chunk in chunks)
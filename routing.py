@@ -0,0 +1,297 @@
+# routing.py
+"""
+Latency-aware model routing for every upstream completion.
+- A policy (MODEL_ROUTING_POLICY, JSON) maps endpoint, style and prompt size to a model; the first matching
+  rule wins. Endpoint and style come from the current request, so call sites don't pass anything.
+- Each rule may name a faster fallback model and a deadline: if the primary hasn't answered by then, the same
+  prompt is sent to the fallback and whichever finishes first is returned. A primary that fails outright is
+  retried once on the fallback.
+- Rolling per-model latency and error rates are kept; while a primary's recent error rate or median latency is
+  over its limits, requests go straight to the fallback, except for one probe call every ROUTING_PROBE_INTERVAL
+  seconds. A probe that answers within the deadline puts the primary back in rotation.
+- The model that served the current request is available from served_model() for headers and chat_history.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+
+from budget import count_tokens
+from metrics import REGISTRY, Histogram, bind_context, current_labels
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "gpt-4")
+FAST_MODEL = os.getenv("FAST_MODEL", "gpt-4o-mini")
+ROUTING_DEADLINE = float(os.getenv("ROUTING_DEADLINE", 20))
+ROUTING_WINDOW = int(os.getenv("ROUTING_WINDOW", 100))
+ROUTING_MIN_SAMPLES = int(os.getenv("ROUTING_MIN_SAMPLES", 20))
+ROUTING_MAX_ERROR_RATE = float(os.getenv("ROUTING_MAX_ERROR_RATE", 0.5))
+ROUTING_PROBE_INTERVAL = float(os.getenv("ROUTING_PROBE_INTERVAL", 30))
+ROUTING_HEDGE_WORKERS = int(os.getenv("ROUTING_HEDGE_WORKERS", 32))
+ROUTING_FALLBACK_WORKERS = int(os.getenv("ROUTING_FALLBACK_WORKERS", ROUTING_HEDGE_WORKERS))
+
+DEFAULT_POLICY = [
+    # Short answers: the 75-token "smart" style and chat follow-ups over a few transcript excerpts
+    {"endpoints": ["solve", "solve-batch"], "styles": ["smart"], "model": FAST_MODEL},
+    {"endpoints": ["chat-youtube"], "max_prompt_tokens": 2000, "model": FAST_MODEL},
+    {"model": DEFAULT_MODEL, "fallback": FAST_MODEL, "deadline": ROUTING_DEADLINE},
+]
+
+MODEL_LATENCY = Histogram("vikal_model_duration_seconds", "Upstream completion latency by model and outcome.",
+                          ["model", "outcome"])
+REGISTRY.append(MODEL_LATENCY)
+
+_served = contextvars.ContextVar("served_model", default=None)
+
+
+def served_model():
+    """The model that produced the most recent completion for the current request, if any."""
+    return _served.get()
+
+
+def clear_served_model():
+    _served.set(None)
+
+
+def load_policy():
+    raw = os.getenv("MODEL_ROUTING_POLICY")
+    if not raw:
+        return DEFAULT_POLICY
+    try:
+        policy = json.loads(raw)
+        if not isinstance(policy, list) or not all(isinstance(rule, dict) and rule.get("model") for rule in policy):
+            raise ValueError("expected a list of rules, each with a model")
+        return policy
+    except ValueError as e:
+        logger.error(f"Invalid MODEL_ROUTING_POLICY, using the default policy: {e}")
+        return DEFAULT_POLICY
+
+
+def endpoint_name(endpoint):
+    """'/solve/stream' -> 'solve'."""
+    name = (endpoint or "").strip("/")
+    return name[:-len("/stream")] if name.endswith("/stream") else name
+
+
+class ModelStats:
+    """
+    Rolling window of (latency, ok) per model.
+    - A model that fails healthy() is tripped: healthy() then lets one probe call through every probe_interval
+      seconds. A call started after the trip that succeeds within the deadline clears the model's window.
+    """
+
+    def __init__(self, window=ROUTING_WINDOW, probe_interval=ROUTING_PROBE_INTERVAL):
+        self.window = window
+        self.probe_interval = probe_interval
+        self._samples = {}
+        self._tripped = {}  # model -> [tripped_at, next_probe_at, deadline]
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds, ok):
+        now = time.monotonic()
+        recovered = False
+        with self._lock:
+            samples = self._samples.setdefault(model, deque(maxlen=self.window))
+            samples.append((seconds, ok))
+            tripped = self._tripped.get(model)
+            if tripped and ok and now - seconds >= tripped[0] and (not tripped[2] or seconds < tripped[2]):
+                del self._tripped[model]
+                samples.clear()
+                recovered = True
+        if recovered:
+            logger.info(f"{model} answered a probe in {seconds:.2f}s; routing to it again")
+        MODEL_LATENCY.observe(seconds, model, "ok" if ok else "error")
+
+    def summary(self, model):
+        with self._lock:
+            samples = list(self._samples.get(model, ()))
+        if not samples:
+            return {"count": 0, "p50_ms": 0.0, "p95_ms": 0.0, "error_rate": 0.0}
+        latencies = sorted(seconds for seconds, ok in samples if ok) or [0.0]
+        return {
+            "count": len(samples),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+            "error_rate": round(sum(1 for _, ok in samples if not ok) / len(samples), 3),
+        }
+
+    def healthy(self, model, deadline=None):
+        """False while model's recent errors or latency are over the limits, except once per probe_interval."""
+        summary = self.summary(model)
+        if summary["count"] < ROUTING_MIN_SAMPLES:
+            return True
+        if summary["error_rate"] < ROUTING_MAX_ERROR_RATE and (not deadline or summary["p50_ms"] < deadline * 1000):
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tripped = self._tripped.get(model)
+            if tripped is None:
+                self._tripped[model] = [now, now + self.probe_interval, deadline]
+                return False
+            if now < tripped[1]:
+                return False
+            tripped[1] = now + self.probe_interval
+        logger.info(f"Probing {model} after recent errors or latency")
+        return True
+
+    def stats(self):
+        with self._lock:
+            models = list(self._samples)
+        return {model: self.summary(model) for model in models}
+
+
+class ModelRouter:
+    """
+    Picks a model per call and runs it with deadline-triggered fallback.
+    - invoke(prompt, max_tokens, model) performs one completion (normally through the single-flight group).
+    - Passing model= pins the call to that model and skips routing.
+    - Primaries and hedges run on separate pools: when the primary model stalls, its calls fill the primary
+      pool, and hedges must not queue behind them.
+    """
+
+    def __init__(self, policy=None, stats=None, hedge_workers=ROUTING_HEDGE_WORKERS, fallback_workers=ROUTING_FALLBACK_WORKERS):
+        self.policy = policy if policy is not None else load_policy()
+        self.stats = stats or ModelStats()
+        self.hedge_workers = hedge_workers
+        self.fallback_workers = fallback_workers
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def route(self, prompt, model=None):
+        """Return (model, fallback, deadline) for prompt in the current request."""
+        if model:
+            return model, None, None
+        endpoint, style = current_labels()
+        endpoint = endpoint_name(endpoint)
+        prompt_tokens = None
+        for rule in self.policy:
+            if rule.get("endpoints") and endpoint not in rule["endpoints"]:
+                continue
+            if rule.get("styles") and style not in rule["styles"]:
+                continue
+            if rule.get("max_prompt_tokens") is not None:
+                if prompt_tokens is None:
+                    prompt_tokens = count_tokens(prompt)
+                if prompt_tokens > rule["max_prompt_tokens"]:
+                    continue
+            primary, fallback, deadline = rule["model"], rule.get("fallback"), rule.get("deadline")
+            if fallback and not self.stats.healthy(primary, deadline):
+                logger.info(f"Routing around {primary} (recent errors or latency); using {fallback}")
+                return fallback, None, None
+            return primary, fallback, deadline
+        return DEFAULT_MODEL, None, None
+
+    def select(self, prompt, model=None):
+        """Pick a model for a call made outside call()/acall() (streaming) and mark it as served."""
+        model = self.route(prompt, model)[0]
+        _served.set(model)
+        return model
+
+    def _pool(self, kind="primary"):
+        executor = self._executors.get(kind)
+        if executor is None:
+            with self._lock:
+                executor = self._executors.get(kind)
+                if executor is None:
+                    workers = self.hedge_workers if kind == "primary" else self.fallback_workers
+                    executor = self._executors[kind] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"hedge-{kind}")
+        return executor
+
+    def _timed_call(self, invoke, prompt, max_tokens, model):
+        started = time.perf_counter()
+        try:
+            result = invoke(prompt, max_tokens, model)
+        except Exception:
+            self.stats.record(model, time.perf_counter() - started, False)
+            raise
+        self.stats.record(model, time.perf_counter() - started, True)
+        return result
+
+    def call(self, prompt, max_tokens, invoke, model=None):
+        primary, fallback, deadline = self.route(prompt, model)
+        if not fallback:
+            result = self._timed_call(invoke, prompt, max_tokens, primary)
+            _served.set(primary)
+            return result
+
+        first = self._pool("primary").submit(bind_context(self._timed_call), invoke, prompt, max_tokens, primary)
+        try:
+            result = first.result(timeout=deadline)
+            _served.set(primary)
+            return result
+        except FutureTimeout:
+            logger.warning(f"{primary} missed its {deadline}s deadline; hedging with {fallback}")
+        except Exception as e:
+            logger.warning(f"{primary} failed ({e}); retrying on {fallback}")
+            result = self._timed_call(invoke, prompt, max_tokens, fallback)
+            _served.set(fallback)
+            return result
+
+        if first.cancel():
+            # The primary pool is saturated and the call never started: nothing to race, so go straight to the fallback
+            result = self._timed_call(invoke, prompt, max_tokens, fallback)
+            _served.set(fallback)
+            return result
+        hedge = self._pool("fallback").submit(bind_context(self._timed_call), invoke, prompt, max_tokens, fallback)
+        models = {first: primary, hedge: fallback}
+        done, _ = wait([first, hedge], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None:
+            # Fall through to the other call; if it fails too, its exception is raised
+            winner = hedge if winner is first else first
+        result = winner.result()
+        _served.set(models[winner])
+        return result
+
+    async def acall(self, prompt, max_tokens, ainvoke, model=None):
+        """asyncio counterpart of call(); ainvoke is a coroutine function with the same arguments."""
+        primary, fallback, deadline = self.route(prompt, model)
+
+        async def timed_call(target):
+            started = time.perf_counter()
+            try:
+                result = await ainvoke(prompt, max_tokens, target)
+            except Exception:
+                self.stats.record(target, time.perf_counter() - started, False)
+                raise
+            self.stats.record(target, time.perf_counter() - started, True)
+            return result
+
+        if not fallback:
+            result = await timed_call(primary)
+            _served.set(primary)
+            return result
+
+        first = asyncio.ensure_future(timed_call(primary))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(first), deadline)
+            _served.set(primary)
+            return result
+        except asyncio.TimeoutError:
+            logger.warning(f"{primary} missed its {deadline}s deadline; hedging with {fallback}")
+        except Exception as e:
+            logger.warning(f"{primary} failed ({e!r}); retrying on {fallback}")
+            result = await timed_call(fallback)
+            _served.set(fallback)
+            return result
+
+        hedge = asyncio.ensure_future(timed_call(fallback))
+        models = {first: primary, hedge: fallback}
+        # The loser keeps running (it may be shared with coalesced callers); its outcome is only recorded
+        for task in (first, hedge):
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        done, _ = await asyncio.wait({first, hedge}, return_when=asyncio.FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None:
+            winner = hedge if winner is first else first
+            await asyncio.wait({winner})
+        result = winner.result()
+        _served.set(models[winner])
+        return result
@@ -0,0 +1,281 @@
+# similar.py
+"""
+Near-duplicate question matching over chat_history, so a rephrased /explain or /solve question gets a stored
+answer instead of an upstream call ("what is osmosis" vs "explain osmosis pls").
+- Questions are normalized (lowercase, filler words dropped) and shingled into character n-grams; a MinHash
+  signature of SIMILAR_PERMUTATIONS 16-bit values is banded into an LSH index. No external model is used.
+- LSH hits are only candidates. A candidate must share endpoint, category and style and contain exactly the
+  same numbers; its exact shingle Jaccard similarity against the stored normalized question must reach
+  SIMILAR_THRESHOLD, and its non-filler words must be the same: for /solve identical (a changed unit or
+  operator is a different problem), for /explain up to plural endings (a prefix like "dis-" or "de-" turns
+  "advantages of nuclear energy" into another question, however similar the text).
+- The index holds signatures, normalized questions and chat_history _ids; the parsed answer is read back by
+  _id (recent answers are kept in a small LRU).
+- update_stats() adds each newly answered question; rebuild() reloads the newest SIMILAR_INDEX_MAX records from
+  MongoDB in a background thread at startup. Each worker holds its own index: about 1.2 KB per entry
+  (bench/similar_lookup.py measures build time, memory and lookup latency at a million entries).
+Set SIMILAR_MATCHING=0 to turn it off.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+
+from cache import LRUCache, normalize_text
+from db import chat_history
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+SIMILAR_MATCHING = os.getenv("SIMILAR_MATCHING", "1") != "0"
+SIMILAR_THRESHOLD = float(os.getenv("SIMILAR_THRESHOLD", 0.85))
+SIMILAR_INDEX_MAX = int(os.getenv("SIMILAR_INDEX_MAX", 200000))
+SIMILAR_SHINGLE_SIZE = int(os.getenv("SIMILAR_SHINGLE_SIZE", 3))
+SIMILAR_BUCKET_MAX = int(os.getenv("SIMILAR_BUCKET_MAX", 64))
+SIMILAR_ESTIMATE_SLACK = float(os.getenv("SIMILAR_ESTIMATE_SLACK", 0.15))
+SIMILAR_PERMUTATIONS = 64
+SIMILAR_BANDS = 8
+SIMILAR_ROWS = SIMILAR_PERMUTATIONS // SIMILAR_BANDS
+SIMILAR_ENDPOINTS = {"explain": "explain", "solve": "solve", "solve-batch": "solve"}
+# Endpoints whose matches must have exactly the same words; the others may differ in plural endings
+EXACT_WORD_ENDPOINTS = {"solve"}
+
+FILLER_WORDS = {
+    "a", "an", "the", "is", "are", "was", "what", "whats", "what's", "explain", "define", "describe", "tell", "me",
+    "about", "please", "pls", "plz", "can", "you", "could", "would", "how", "does", "do", "of", "to", "i", "want",
+    "know", "give", "meaning", "mean", "means", "concept", "solve", "find", "this", "that", "for", "in", "briefly",
+}
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?|[^\sa-z0-9]")
+# Sentence punctuation (but not a decimal point or math symbols)
+_PUNCTUATION = re.compile(r"[?!,;]|\.(?!\d)")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_question(question):
+    """Lowercased question without filler words; falls back to the full text if nothing else is left."""
+    words = _WORD.findall(_PUNCTUATION.sub(" ", normalize_text(question)))
+    kept = [word for word in words if word not in FILLER_WORDS]
+    return " ".join(kept or words)
+
+
+def word_set(text, exact=False):
+    """Words of a normalized question; unless exact, with a plural "s" dropped ("cells" -> "cell")."""
+    words = text.split()
+    if exact:
+        return set(words)
+    return {word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word for word in words}
+
+
+def shingles(text, size=SIMILAR_SHINGLE_SIZE):
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+_SALTS = [bytes([i]) * 16 for i in range(SIMILAR_PERMUTATIONS // 32)]
+
+
+def _feature_hashes(feature):
+    data = feature.encode("utf-8")
+    values = ()
+    for salt in _SALTS:
+        values += struct.unpack("<32H", hashlib.blake2b(data, digest_size=64, salt=salt).digest())
+    return values
+
+
+def minhash(features):
+    """MinHash signature: per feature, salted 64-byte blake2b digests read as 16-bit hash values; keep column minima."""
+    return array("H", map(min, zip(*(_feature_hashes(feature) for feature in features))))
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def numbers_key(question):
+    return hash(tuple(_NUMBER.findall(str(question or ""))))
+
+
+def scope_key(endpoint, category, style):
+    return (SIMILAR_ENDPOINTS.get(endpoint, endpoint), normalize_text(category), normalize_text(style))
+
+
+class SimilarIndex:
+    """
+    MinHash/LSH index of past questions.
+    - Entries live in flat arrays (signature, numbers hash) and a list of normalized questions addressed by
+      position, so a million questions take a few hundred MB rather than a Python object per shingle.
+    - Buckets map a (scope, band, band values) hash to a position or a list of positions.
+    """
+
+    def __init__(self, collection=None, threshold=SIMILAR_THRESHOLD, max_entries=SIMILAR_INDEX_MAX, answer_cache_size=10000):
+        self.collection = collection
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.answers = LRUCache(maxsize=answer_cache_size, ttl=24 * 3600)
+        self._lock = threading.RLock()
+        self._stats = {"lookups": 0, "hits": 0, "candidates": 0, "added": 0, "errors": 0}
+        self._pending = None
+        self.ready = False
+        self._reset()
+
+    def _reset(self):
+        self.ids = []
+        self.texts = []
+        self.signatures = array("H")
+        self.numbers = array("q")
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _band_keys(self, scope, signature):
+        return [hash((scope, band, signature[band * SIMILAR_ROWS:(band + 1) * SIMILAR_ROWS].tobytes()))
+                for band in range(SIMILAR_BANDS)]
+
+    def add(self, entry_id, endpoint, question, category, style, parsed=None):
+        """Index one answered question; parsed (if given) is kept in the answer LRU."""
+        if endpoint not in SIMILAR_ENDPOINTS or not question:
+            return
+        text = normalize_question(question)
+        signature = minhash(shingles(text))
+        band_keys = self._band_keys(scope_key(endpoint, category, style), signature)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((entry_id, endpoint, question, category, style))
+            if len(self.ids) >= self.max_entries:
+                return
+            position = len(self.ids)
+            self.ids.append(entry_id)
+            self.texts.append(text)
+            self.signatures.extend(signature)
+            self.numbers.append(numbers_key(question))
+            for key in band_keys:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    self.buckets[key] = position
+                elif isinstance(bucket, list):
+                    # A full bucket already holds plenty of near-identical questions
+                    if len(bucket) < SIMILAR_BUCKET_MAX:
+                        bucket.append(position)
+                else:
+                    self.buckets[key] = [bucket, position]
+            self._stats["added"] += 1
+        if parsed is not None:
+            self.answers.set(entry_id, parsed)
+
+    def match(self, endpoint, question, category, style):
+        """Return (entry_id, similarity) of the best stored match at or above the threshold, or None."""
+        if endpoint not in SIMILAR_ENDPOINTS or not question:
+            return None
+        text = normalize_question(question)
+        features = shingles(text)
+        signature = minhash(features)
+        numbers = numbers_key(question)
+        scope = scope_key(endpoint, category, style)
+        exact = scope[0] in EXACT_WORD_ENDPOINTS
+        words = word_set(text, exact)
+        candidates = set()
+        best, best_score = None, 0.0
+        with self._lock:
+            for key in self._band_keys(scope, signature):
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    continue
+                if isinstance(bucket, list):
+                    candidates.update(bucket)
+                else:
+                    candidates.add(bucket)
+            for position in candidates:
+                if self.numbers[position] != numbers:
+                    continue
+                stored = self.signatures[position * SIMILAR_PERMUTATIONS:(position + 1) * SIMILAR_PERMUTATIONS]
+                estimate = sum(1 for a, b in zip(signature, stored) if a == b) / SIMILAR_PERMUTATIONS
+                # The estimate only screens candidates; the exact similarity decides
+                if estimate < self.threshold - SIMILAR_ESTIMATE_SLACK:
+                    continue
+                stored_text = self.texts[position]
+                if word_set(stored_text, exact) != words:
+                    continue
+                score = jaccard(features, shingles(stored_text))
+                if score > best_score:
+                    best, best_score = position, score
+            self._stats["candidates"] += len(candidates)
+            entry_id = self.ids[best] if best is not None else None
+        if entry_id is None or best_score < self.threshold:
+            return None
+        return entry_id, best_score
+
+    @timed("similar")
+    def lookup(self, endpoint, question, category, style):
+        """Return the stored parsed answer for a near-duplicate question, or None."""
+        with self._lock:
+            self._stats["lookups"] += 1
+        try:
+            found = self.match(endpoint, question, category, style)
+            if found is None:
+                return None
+            entry_id, score = found
+            parsed = self.answers.get(entry_id)
+            if parsed is None and self.collection is not None:
+                doc = self.collection.find_one({"_id": entry_id}, {"parsed": 1})
+                parsed = doc.get("parsed") if doc else None
+                if parsed is not None:
+                    self.answers.set(entry_id, parsed)
+        except Exception as e:
+            logger.warning(f"Similar-question lookup failed: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+            return None
+        if parsed is not None:
+            logger.info(f"Near-duplicate hit for {endpoint} (similarity {score:.2f})")
+            with self._lock:
+                self._stats["hits"] += 1
+        return parsed
+
+    def rebuild(self):
+        """Reload the index from the newest chat_history records that carry a parsed answer."""
+        if self.collection is None:
+            return
+        started = time.perf_counter()
+        with self._lock:
+            self._pending = []
+        fresh = SimilarIndex(None, self.threshold, self.max_entries)
+        cursor = self.collection.find(
+            {"endpoint": {"$in": list(SIMILAR_ENDPOINTS)}, "parsed": {"$exists": True}},
+            {"endpoint": 1, "question": 1, "category": 1, "style": 1}
+        ).sort("_id", -1).limit(self.max_entries)
+        for doc in cursor:
+            fresh.add(doc["_id"], doc.get("endpoint"), doc.get("question"), doc.get("category"), doc.get("style"))
+        with self._lock:
+            # Replay what update_stats added while the rebuild was reading, then swap
+            for args in self._pending or ():
+                fresh.add(*args)
+            self.ids, self.texts, self.signatures = fresh.ids, fresh.texts, fresh.signatures
+            self.numbers, self.buckets = fresh.numbers, fresh.buckets
+            self._pending = None
+            self.ready = True
+        logger.info(f"Similar-question index rebuilt with {len(self)} entries in {time.perf_counter() - started:.1f}s")
+
+    def start_rebuild(self):
+        if not SIMILAR_MATCHING or self.collection is None:
+            return
+        threading.Thread(target=self._safe_rebuild, name="similar-rebuild", daemon=True).start()
+
+    def _safe_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error(f"Similar-question index rebuild failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self.ids), ready=self.ready)
+
+
+similar_index = SimilarIndex(chat_history)
@@ -0,0 +1,264 @@
+# singleflight.py
+"""
+Request coalescing for identical in-flight upstream calls.
+- Calls are keyed on (model, prompt, max_tokens); concurrent duplicates wait on the one in-flight call
+  and share its result (or its exception).
+- In-process coalescing is always on. With SINGLEFLIGHT_MONGO=1 the in-process leader also takes a lease
+  document in MongoDB, so identical calls from other gunicorn workers wait for its published result
+  instead of making their own. A leader's result stays published for SINGLEFLIGHT_RESULT_TTL seconds, so
+  requests that bypass the response cache call bypass_lease() and only coalesce with in-process calls.
+- AsyncSingleFlight is the asyncio counterpart used by async_app.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_MONGO = os.getenv("SINGLEFLIGHT_MONGO", "0") == "1"
+SINGLEFLIGHT_LEASE_TTL = float(os.getenv("SINGLEFLIGHT_LEASE_TTL", 90))
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv("SINGLEFLIGHT_RESULT_TTL", 30))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", 0.1))
+
+
+_bypass_lease = contextvars.ContextVar("singleflight_bypass_lease", default=False)
+
+
+def bypass_lease(bypass=True):
+    """Skip the cross-worker lease, and the results it publishes, for upstream calls made by the current request."""
+    _bypass_lease.set(bypass)
+
+
+def flight_key(model, prompt, max_tokens):
+    return hashlib.sha256(json.dumps([model, prompt, max_tokens]).encode("utf-8")).hexdigest()
+
+
+class MongoLease:
+    """
+    Cross-worker lease on a flight key.
+    - acquire() returns ("leader", None), ("done", result) or ("wait", None).
+    - A lease whose holder died is taken over once expiresAt has passed.
+    """
+
+    def __init__(self, collection, lease_ttl=SINGLEFLIGHT_LEASE_TTL, result_ttl=SINGLEFLIGHT_RESULT_TTL):
+        self.collection = collection
+        self.lease_ttl = lease_ttl
+        self.result_ttl = result_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def ensure_indexes(self):
+        try:
+            self.collection.create_index("expiresAt", expireAfterSeconds=0)
+        except Exception as e:
+            logger.warning(f"Could not create singleflight lease TTL index: {e}")
+
+    def acquire(self, key):
+        for _ in range(3):
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=self.lease_ttl)
+            try:
+                self.collection.insert_one({"_id": key, "owner": self.owner, "status": "running", "expiresAt": expires_at})
+                return "leader", None
+            except DuplicateKeyError:
+                pass
+            doc = self.collection.find_one({"_id": key})
+            if doc is None:
+                continue
+            if doc["expiresAt"] >= now:
+                return ("done", doc.get("result")) if doc.get("status") == "done" else ("wait", None)
+            # A stale result or a lease whose holder died: take it over
+            taken = self.collection.find_one_and_update(
+                {"_id": key, "expiresAt": {"$lt": now}},
+                {"$set": {"owner": self.owner, "status": "running", "expiresAt": expires_at}, "$unset": {"result": ""}}
+            )
+            if taken is not None:
+                logger.info(f"Took over expired singleflight lease {key[:12]}")
+                return "leader", None
+        return "wait", None
+
+    def check(self, key):
+        """Return ("done", result), ("wait", None) or ("gone", None) for a lease held elsewhere."""
+        doc = self.collection.find_one({"_id": key})
+        if doc is None:
+            return "gone", None
+        if doc.get("status") == "done":
+            return "done", doc.get("result")
+        if doc["expiresAt"] < datetime.utcnow():
+            return "gone", None
+        return "wait", None
+
+    def publish(self, key, result):
+        self.collection.update_one(
+            {"_id": key, "owner": self.owner},
+            {"$set": {"status": "done", "result": result,
+                      "expiresAt": datetime.utcnow() + timedelta(seconds=self.result_ttl)}}
+        )
+
+    def release(self, key):
+        self.collection.delete_one({"_id": key, "owner": self.owner, "status": "running"})
+
+
+class SingleFlight:
+    """Thread-based single-flight group for the Flask app."""
+
+    def __init__(self, lease=None, poll_interval=SINGLEFLIGHT_POLL_INTERVAL):
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0, "remote_hits": 0, "lease_errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = {"event": threading.Event(), "result": None, "error": None}
+                self._inflight[key] = flight
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight["event"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["result"]
+
+        try:
+            flight["result"] = self._run(key, fn)
+            return flight["result"]
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight["event"].set()
+
+    def _run(self, key, fn):
+        if self.lease is None or _bypass_lease.get():
+            return fn()
+        try:
+            role, result = self.lease.acquire(key)
+            while role == "wait":
+                time.sleep(self.poll_interval)
+                role, result = self.lease.check(key)
+                if role == "gone":
+                    role, result = self.lease.acquire(key)
+        except Exception as e:
+            logger.warning(f"Singleflight lease unavailable, calling upstream directly: {e}")
+            self._count("lease_errors")
+            return fn()
+        if role == "done":
+            self._count("remote_hits")
+            return result
+
+        try:
+            result = fn()
+        except Exception:
+            self._safe(self.lease.release, key)
+            raise
+        self._safe(self.lease.publish, key, result)
+        return result
+
+    def _safe(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            logger.warning(f"Singleflight lease update failed: {e}")
+            self._count("lease_errors")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["in_flight"] = len(self._inflight)
+        return stats
+
+
+class AsyncSingleFlight:
+    """
+    asyncio single-flight group for async_app.
+    - Lease operations are blocking pymongo calls, so they go through the supplied offload coroutine.
+    """
+
+    def __init__(self, lease=None, offload=None, poll_interval=SINGLEFLIGHT_POLL_INTERVAL):
+        self.lease = lease
+        self.offload = offload
+        self.poll_interval = poll_interval
+        self._inflight = {}
+        self._stats = {"leaders": 0, "coalesced": 0, "remote_hits": 0, "lease_errors": 0}
+
+    async def do(self, key, coro_fn):
+        future = self._inflight.get(key)
+        if future is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._stats["leaders"] += 1
+        try:
+            result = await self._run(key, coro_fn)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _run(self, key, coro_fn):
+        if self.lease is None or _bypass_lease.get():
+            return await coro_fn()
+        try:
+            role, result = await self.offload(self.lease.acquire, key)
+            while role == "wait":
+                await asyncio.sleep(self.poll_interval)
+                role, result = await self.offload(self.lease.check, key)
+                if role == "gone":
+                    role, result = await self.offload(self.lease.acquire, key)
+        except Exception as e:
+            logger.warning(f"Singleflight lease unavailable, calling upstream directly: {e}")
+            self._stats["lease_errors"] += 1
+            return await coro_fn()
+        if role == "done":
+            self._stats["remote_hits"] += 1
+            return result
+
+        try:
+            result = await coro_fn()
+        except Exception:
+            await self._safe(self.lease.release, key)
+            raise
+        await self._safe(self.lease.publish, key, result)
+        return result
+
+    async def _safe(self, func, *args):
+        try:
+            await self.offload(func, *args)
+        except Exception as e:
+            logger.warning(f"Singleflight lease update failed: {e}")
+            self._stats["lease_errors"] += 1
+
+    def stats(self):
+        return dict(self._stats, in_flight=len(self._inflight))
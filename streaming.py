@@ -0,0 +1,58 @@
+# streaming.py
+"""
+Server-Sent Events helpers for the streaming /explain and /solve variants.
+- SectionStreamParser consumes completion tokens and reports each ### section as soon as the
+  next section header arrives, parsed by the same parse_* function as the non-streaming endpoints.
+- The final structure is always the parse_* result over the whole completion, so it matches today's output.
+"""
+
+import json
+import re
+
+SECTION_HEADER = re.compile(r"###\s")
+
+
+def sse_event(event, data):
+    """Format one SSE frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class SectionStreamParser:
+    """
+    Incremental ### section parser.
+    - feed(text) returns the sections completed by this chunk.
+    - close() returns the last section plus the final parsed structure.
+    Each section is {"section": <header line>, "data": parse_func("### " + section)}.
+    """
+
+    def __init__(self, parse_func):
+        self.parse_func = parse_func
+        self.buffer = ""
+        self.section_start = None
+
+    def feed(self, text):
+        self.buffer += text
+        completed = []
+        # Look back a few characters so a header split across chunks is still found
+        search_from = max(0, len(self.buffer) - len(text) - 3)
+        if self.section_start is not None:
+            search_from = max(search_from, self.section_start + 1)
+        for match in SECTION_HEADER.finditer(self.buffer, search_from):
+            if self.section_start is not None:
+                completed.append(self._section(self.buffer[self.section_start:match.start()]))
+            self.section_start = match.start()
+        return [section for section in completed if section]
+
+    def close(self):
+        sections = []
+        if self.section_start is not None:
+            last = self._section(self.buffer[self.section_start:])
+            if last:
+                sections.append(last)
+        return sections, self.parse_func(self.buffer)
+
+    def _section(self, text):
+        body = SECTION_HEADER.sub("", text, count=1).strip()
+        if not body:
+            return None
+        return {"section": body.split("\n", 1)[0].strip(), "data": self.parse_func("### " + body)}
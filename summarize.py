@@ -0,0 +1,133 @@
+# summarize.py
+"""
+YouTube transcript summarization for /summarize-youtube.
+- Short transcripts: one call with the YOUTUBE_SUMMARY_PROMPT template.
+- Long transcripts (over SUMMARY_MAP_REDUCE_CHARS): map-reduce. The transcript is split into
+  token-budgeted segments that are summarized concurrently on a bounded thread pool, then a single
+  reduce call renders the usual ### Summary / Analogy / Notes / Keywords template.
+Every prompt is budgeted against the model context (budget.py): map max_tokens shrink so the partial notes
+fit the reduce prompt, and a transcript that would overflow the single-call prompt goes through map-reduce.
+The upstream call is passed in (normally app.call_openai) so the split/merge logic runs against any stub;
+asummarize_transcript is the same flow for the asyncio app with an awaitable call.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from budget import MIN_COMPLETION_TOKENS, count_tokens, fit_lines, input_budget
+from metrics import bind_context
+from prompts import YOUTUBE_SUMMARY_PROMPT, YOUTUBE_SEGMENT_PROMPT, YOUTUBE_REDUCE_NOTE
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MAP_REDUCE_CHARS = int(os.getenv("SUMMARY_MAP_REDUCE_CHARS", 24000))
+SUMMARY_SEGMENT_TOKENS = int(os.getenv("SUMMARY_SEGMENT_TOKENS", 2500))
+SUMMARY_MAP_WORKERS = int(os.getenv("SUMMARY_MAP_WORKERS", 4))
+SUMMARY_MAP_MAX_TOKENS = int(os.getenv("SUMMARY_MAP_MAX_TOKENS", 350))
+SUMMARY_MAX_TOKENS = 700
+SUMMARY_MODEL = "gpt-4"
+
+
+def estimate_tokens(text):
+    """Token count used for splitting (see budget.count_tokens)."""
+    return count_tokens(text, SUMMARY_MODEL)
+
+
+def split_transcript(text, max_tokens=SUMMARY_SEGMENT_TOKENS):
+    """
+    Split timestamped transcript text into segments of at most max_tokens each.
+    - Splits happen on line boundaries so every [start]s timestamp stays with its text.
+    - A single line longer than the budget becomes its own segment.
+    """
+    segments, current, current_tokens = [], [], 0
+    for line in text.split("\n"):
+        line_tokens = estimate_tokens(line) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            segments.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        segments.append("\n".join(current))
+    return segments
+
+
+def summarize_segments(video_id, segments, call, workers=SUMMARY_MAP_WORKERS, max_tokens=SUMMARY_MAP_MAX_TOKENS):
+    """Map step: summarize each segment concurrently, returning partial notes in transcript order."""
+    total = len(segments)
+
+    def summarize_one(item):
+        index, segment = item
+        prompt = YOUTUBE_SEGMENT_PROMPT.format(index=index + 1, total=total, video_id=video_id, transcript_text=segment)
+        return call(prompt, max_tokens=max_tokens)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, total))) as pool:
+        return list(pool.map(bind_context(summarize_one), enumerate(segments)))
+
+
+def single_pass_prompt(video_id, transcript_text, threshold=SUMMARY_MAP_REDUCE_CHARS):
+    """The one-call summary prompt, or None when the transcript is over threshold or wouldn't fit the context."""
+    if len(transcript_text) > threshold:
+        return None
+    prompt = YOUTUBE_SUMMARY_PROMPT.format(video_id=video_id, transcript_text=transcript_text)
+    if count_tokens(prompt, SUMMARY_MODEL) > input_budget(SUMMARY_MODEL, SUMMARY_MAX_TOKENS):
+        logger.info(f"Summary prompt for video ID {video_id} exceeds the {SUMMARY_MODEL} context; using map-reduce")
+        return None
+    return prompt
+
+
+def reduce_budget(video_id):
+    """Tokens the merged partial notes may take up in the reduce prompt."""
+    fixed = count_tokens(YOUTUBE_SUMMARY_PROMPT.format(video_id=video_id, transcript_text=YOUTUBE_REDUCE_NOTE), SUMMARY_MODEL)
+    return input_budget(SUMMARY_MODEL, SUMMARY_MAX_TOKENS, fixed)
+
+
+def map_max_tokens(video_id, segment_count):
+    """Completion budget per map call, shrunk for long videos so all partial notes fit the reduce prompt."""
+    per_segment = reduce_budget(video_id) // max(1, segment_count) - 8
+    return max(MIN_COMPLETION_TOKENS, min(SUMMARY_MAP_MAX_TOKENS, per_segment))
+
+
+def reduce_prompt(video_id, partial_notes):
+    merged = "\n\n".join(f"Part {i + 1}:\n{notes.strip()}" for i, notes in enumerate(partial_notes))
+    merged = fit_lines(merged, reduce_budget(video_id), SUMMARY_MODEL)
+    return YOUTUBE_SUMMARY_PROMPT.format(video_id=video_id, transcript_text=YOUTUBE_REDUCE_NOTE + merged)
+
+
+def summarize_transcript(video_id, transcript_text, call, threshold=SUMMARY_MAP_REDUCE_CHARS):
+    """
+    Return the raw templated summary for a transcript, switching to map-reduce above threshold characters
+    or when the single-call prompt wouldn't fit the model context.
+    - call(prompt, max_tokens=...) performs the upstream completion.
+    """
+    prompt = single_pass_prompt(video_id, transcript_text, threshold)
+    if prompt is not None:
+        return call(prompt, max_tokens=SUMMARY_MAX_TOKENS)
+
+    segments = split_transcript(transcript_text)
+    logger.info(f"Map-reduce summary for video ID {video_id}: {len(transcript_text)} chars in {len(segments)} segments")
+    partial_notes = summarize_segments(video_id, segments, call, max_tokens=map_max_tokens(video_id, len(segments)))
+    return call(reduce_prompt(video_id, partial_notes), max_tokens=SUMMARY_MAX_TOKENS)
+
+
+async def asummarize_transcript(video_id, transcript_text, acall, threshold=SUMMARY_MAP_REDUCE_CHARS, workers=SUMMARY_MAP_WORKERS):
+    """Async variant of summarize_transcript; map calls run concurrently under a semaphore of workers."""
+    prompt = single_pass_prompt(video_id, transcript_text, threshold)
+    if prompt is not None:
+        return await acall(prompt, max_tokens=SUMMARY_MAX_TOKENS)
+
+    segments = split_transcript(transcript_text)
+    logger.info(f"Map-reduce summary for video ID {video_id}: {len(transcript_text)} chars in {len(segments)} segments")
+    semaphore = asyncio.Semaphore(max(1, workers))
+    total = len(segments)
+    max_tokens = map_max_tokens(video_id, total)
+
+    async def summarize_one(index, segment):
+        prompt = YOUTUBE_SEGMENT_PROMPT.format(index=index + 1, total=total, video_id=video_id, transcript_text=segment)
+        async with semaphore:
+            return await acall(prompt, max_tokens=max_tokens)
+
+    partial_notes = await asyncio.gather(*(summarize_one(i, segment) for i, segment in enumerate(segments)))
+    return await acall(reduce_prompt(video_id, partial_notes), max_tokens=SUMMARY_MAX_TOKENS)
@@ -0,0 +1,14 @@
+# tests/conftest.py
+"""
+Shared setup: the repo root on sys.path, a MONGO_URL for modules that import db (MongoClient connects
+lazily, so nothing is contacted) and a dummy OPENAI_API_KEY for the app modules. Tests that touch MongoDB use
+mongomock collections directly; upstream calls go to a local fake server.
+    pip install -r tests/requirements.txt && python -m pytest -q
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:27017")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
@@ -0,0 +1,9 @@
+from budget import prompt_tokens
+
+
+def test_non_string_style_is_counted_like_any_unknown_style():
+    # /explain passes explanation_style through untouched; a number or null must not raise
+    expected = prompt_tokens("generic", "explanation", "teacher", "osmosis")
+    assert prompt_tokens("generic", "explanation", 5, "osmosis") == expected
+    assert prompt_tokens("generic", "explanation", None, "osmosis") == expected
+    assert prompt_tokens("generic", "solution", 5, "2x + 3 = 7") == prompt_tokens("generic", "solution", "teacher", "2x + 3 = 7")
@@ -0,0 +1,17 @@
+from cache import make_cache_key
+from prompts import get_template
+
+
+def key(topic, category="generic", style="teacher", type_key="explanation"):
+    return make_cache_key(topic, category, style, get_template(type_key, style))
+
+
+def test_trivially_different_topics_share_a_key():
+    assert key("photosynthesis") == key("Photosynthesis") == key("photosynthesis ") == key("  PHOTOSYNTHESIS")
+
+
+def test_category_style_and_template_are_part_of_the_key():
+    assert key("photosynthesis") != key("photosynthesis", category="biology")
+    assert key("2x + 3 = 7", style="teacher", type_key="solution") != key("2x + 3 = 7", style="smart", type_key="solution")
+    assert key("2x + 3 = 7", type_key="solution") != key("2x + 3 = 7", type_key="explanation")
+    assert make_cache_key("photosynthesis", "generic", "teacher", "old template {topic}") != key("photosynthesis")
@@ -0,0 +1,84 @@
+import os
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from history import (USER_ENDPOINT_TIMESTAMP_INDEX, USER_TIMESTAMP_INDEX, encode_cursor, ensure_indexes,
+                     fetch_history, history_query)
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().db.chat_history
+    ensure_indexes(collection)
+    return collection
+
+
+def seed(collection, user_id="user-1", records=30):
+    now = datetime.utcnow()
+    collection.insert_many([
+        {"user_id": user_id, "endpoint": "solve" if i % 3 == 0 else "explain", "question": f"question {i}",
+         "response": "answer", "category": "math", "style": "teacher",
+         # Pairs share a timestamp, so paging has to break ties on _id
+         "timestamp": now - timedelta(seconds=(records - i) // 2)}
+        for i in range(records)
+    ])
+
+
+def test_indexes_cover_the_endpoint_filter(collection):
+    keys = {name: index["key"] for name, index in collection.index_information().items()}
+    assert keys[USER_TIMESTAMP_INDEX] == [("user_id", 1), ("timestamp", -1), ("_id", -1)]
+    assert keys[USER_ENDPOINT_TIMESTAMP_INDEX] == [("user_id", 1), ("endpoint", 1), ("timestamp", -1), ("_id", -1)]
+
+
+def test_endpoint_pages_walk_every_record_once(collection):
+    seed(collection)
+    seen, cursor = [], None
+    while True:
+        items, cursor = fetch_history("user-1", cursor, limit=4, endpoint="solve", collection=collection)
+        seen.extend(items)
+        if cursor is None:
+            break
+    assert [item["question"] for item in seen] == [f"question {i}" for i in range(27, -1, -3)]
+    assert all(item["endpoint"] == "solve" and "response" not in item for item in seen)
+
+
+def test_pages_walk_every_record_once_across_timestamp_ties(collection):
+    seed(collection)
+    seed(collection, user_id="user-2")
+    seen, cursor = [], None
+    while True:
+        items, cursor = fetch_history("user-1", cursor, limit=3, collection=collection)
+        seen.extend(items)
+        if cursor is None:
+            break
+    assert [item["question"] for item in seen] == [f"question {i}" for i in range(29, -1, -1)]
+
+
+def test_cursor_query_is_bounded_by_the_cursor_timestamp(collection):
+    seed(collection)
+    doc = collection.find_one({"question": "question 10"})
+    query = history_query("user-1", encode_cursor(doc))
+    assert query["timestamp"] == {"$lte": doc["timestamp"]}
+    assert {"timestamp": doc["timestamp"], "_id": {"$lt": doc["_id"]}} in query["$or"]
+
+
+def test_query_plans_on_a_real_mongod():
+    url = os.getenv("BENCH_MONGO_URL")
+    if not url:
+        pytest.skip("set BENCH_MONGO_URL to a scratch mongod to check query plans (mongomock has no planner)")
+    from bench.history_plans import plan_checks
+
+    client = MongoClient(url, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"no mongod at BENCH_MONGO_URL: {e}")
+    try:
+        results = plan_checks(client["vikal_test_plans"]["chat_history"], records=20000, users=100, page=20)
+    finally:
+        client.drop_database("vikal_test_plans")
+    assert [result for result in results if not result["ok"]] == []
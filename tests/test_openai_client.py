@@ -0,0 +1,190 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+import pytest
+import requests
+
+from openai_client import CircuitBreaker, CircuitOpenError, OpenAIClient
+
+
+class FakeOpenAI:
+    """
+    Local chat-completions server answering each POST with the next scripted reply: "ok", a status code,
+    "chunked-garbage" or "stall" (answers after a second). POSTs to /loop redirect to themselves forever.
+    """
+
+    def __init__(self):
+        self.replies = []
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path == "/loop":
+                    self.send_response(307)
+                    self.send_header("Location", "/loop")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                fake.requests += 1
+                reply = fake.replies.pop(0) if fake.replies else "ok"
+                if reply == "chunked-garbage":
+                    self.wfile.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n")
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                if reply == "stall":
+                    time.sleep(1)
+                    reply = "ok"
+                status = 200 if reply == "ok" else reply
+                body = json.dumps({"choices": [{"message": {"content": "answer"}}]}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        # A cancelled client closes its socket under a stalled reply; that's expected here
+        self.server.handle_error = lambda request, client_address: None
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.url = f"{self.base}/v1/chat/completions"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake():
+    server = FakeOpenAI()
+    yield server
+    server.close()
+
+
+def make_client(fake, reset_timeout=0.2):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=reset_timeout)
+    return OpenAIClient("key", api_url=fake.url, breaker=breaker, max_retries=0)
+
+
+def test_breaker_opens_half_opens_and_closes(fake):
+    client = make_client(fake)
+    assert client.chat_completion("hi") == "answer"
+    assert client.breaker.state == "closed"
+
+    fake.replies = [500, 503]
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            client.chat_completion("hi")
+    assert client.breaker.state == "open"
+
+    sent = fake.requests
+    with pytest.raises(CircuitOpenError):
+        client.chat_completion("hi")
+    assert fake.requests == sent
+
+    time.sleep(0.25)
+    assert client.breaker.state == "half_open"
+    assert client.chat_completion("hi") == "answer"
+    assert client.breaker.state == "closed"
+    assert client.breaker.failures == 0
+
+
+def test_failed_half_open_trial_reopens(fake):
+    client = make_client(fake)
+    fake.replies = [500, 500]
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            client.chat_completion("hi")
+    time.sleep(0.25)
+    fake.replies = [502]
+    with pytest.raises(requests.HTTPError):
+        client.chat_completion("hi")
+    assert client.breaker.state == "open"
+    assert not client.breaker.trial_in_flight
+
+
+def test_non_connection_error_in_half_open_trial_does_not_wedge_the_breaker(fake):
+    client = make_client(fake)
+    fake.replies = [500, 500]
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            client.chat_completion("hi")
+    time.sleep(0.25)
+
+    fake.replies = ["chunked-garbage"]
+    with pytest.raises(requests.RequestException):
+        client.chat_completion("hi")
+    assert not client.breaker.trial_in_flight
+    assert client.breaker.state == "open"
+
+    time.sleep(0.25)
+    assert client.chat_completion("hi") == "answer"
+    assert client.breaker.state == "closed"
+
+
+async def open_async_breaker(fake):
+    """An AsyncOpenAIClient whose breaker has just gone half-open."""
+    from async_app import AsyncOpenAIClient
+
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    client = AsyncOpenAIClient("key", api_url=fake.url, breaker=breaker, max_retries=0)
+    await client.start()
+    fake.replies = [500, 500]
+    for _ in range(2):
+        with pytest.raises(aiohttp.ClientResponseError):
+            await client.chat_completion("hi")
+    await asyncio.sleep(0.25)
+    assert breaker.state == "half_open"
+    return client
+
+
+def test_async_non_connection_error_in_half_open_trial_does_not_wedge_the_breaker(fake):
+    async def main():
+        client = await open_async_breaker(fake)
+        try:
+            client.api_url = f"{fake.base}/loop"
+            with pytest.raises(aiohttp.TooManyRedirects):
+                await client.chat_completion("hi")
+            assert not client.breaker.trial_in_flight
+            assert client.breaker.state == "open"
+
+            client.api_url = fake.url
+            await asyncio.sleep(0.25)
+            assert await client.chat_completion("hi") == "answer"
+            assert client.breaker.state == "closed"
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+
+
+def test_async_cancelled_half_open_trial_is_released(fake):
+    async def main():
+        client = await open_async_breaker(fake)
+        try:
+            fake.replies = ["stall"]
+            trial = asyncio.ensure_future(client.chat_completion("hi"))
+            await asyncio.sleep(0.2)
+            assert client.breaker.trial_in_flight
+            trial.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await trial
+            # Cancelling isn't an upstream failure: the breaker stays half-open and lets the next trial through
+            assert not client.breaker.trial_in_flight
+            assert client.breaker.state == "half_open"
+            assert await client.chat_completion("hi") == "answer"
+            assert client.breaker.state == "closed"
+        finally:
+            await client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+import threading
+import time
+
+from routing import ModelRouter, ModelStats, clear_served_model, served_model
+
+POLICY = [{"model": "primary", "fallback": "fast", "deadline": 0.05}]
+
+
+class Upstream:
+    """invoke() stand-in: the primary model stalls until released, the fallback answers at once."""
+
+    def __init__(self, fail_primary=False):
+        self.release = threading.Event()
+        self.fail_primary = fail_primary
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, max_tokens, model):
+        with self._lock:
+            self.calls.append(model)
+        if model == "primary":
+            if self.fail_primary:
+                raise RuntimeError("primary down")
+            self.release.wait(5)
+        return f"{model} answer"
+
+
+def test_fast_primary_is_served():
+    router, upstream = ModelRouter(POLICY, hedge_workers=2, fallback_workers=2), Upstream()
+    upstream.release.set()
+    clear_served_model()
+    assert router.call("prompt", 100, upstream) == "primary answer"
+    assert served_model() == "primary"
+
+
+def test_stalled_primary_is_hedged_after_the_deadline():
+    router, upstream = ModelRouter(POLICY, hedge_workers=2, fallback_workers=2), Upstream()
+    started = time.perf_counter()
+    assert router.call("prompt", 100, upstream) == "fast answer"
+    assert served_model() == "fast"
+    assert time.perf_counter() - started < 1
+    upstream.release.set()
+
+
+def test_failed_primary_is_retried_on_the_fallback():
+    router, upstream = ModelRouter(POLICY, hedge_workers=2, fallback_workers=2), Upstream(fail_primary=True)
+    assert router.call("prompt", 100, upstream) == "fast answer"
+    assert upstream.calls == ["primary", "fast"]
+
+
+def test_hedge_fires_when_stalled_primaries_fill_the_pool():
+    router, upstream = ModelRouter(POLICY, hedge_workers=2, fallback_workers=2), Upstream()
+    results = []
+    stalled = [threading.Thread(target=lambda: results.append(router.call("prompt", 100, upstream))) for _ in range(4)]
+    for thread in stalled:
+        thread.start()
+    time.sleep(0.2)
+    # Both primary threads are stuck; another call still gets its fallback within about one deadline
+    started = time.perf_counter()
+    assert router.call("prompt", 100, upstream) == "fast answer"
+    assert time.perf_counter() - started < 0.5
+    upstream.release.set()
+    for thread in stalled:
+        thread.join(5)
+    assert len(results) == 4
+
+
+def test_unhealthy_primary_is_probed_and_recovers():
+    router = ModelRouter(POLICY, stats=ModelStats(probe_interval=0.2), hedge_workers=2, fallback_workers=2)
+    upstream = Upstream(fail_primary=True)
+    for _ in range(25):
+        assert router.call("prompt", 100, upstream) == "fast answer"
+    assert not router.stats.healthy("primary", 0.05)
+    # The outage is over, but until the probe interval passes everything goes straight to the fallback
+    upstream.fail_primary = False
+    upstream.release.set()
+    upstream.calls.clear()
+    for _ in range(10):
+        assert router.call("prompt", 100, upstream) == "fast answer"
+    assert upstream.calls == ["fast"] * 10
+    time.sleep(0.25)
+    upstream.calls.clear()
+    for _ in range(10):
+        router.call("prompt", 100, upstream)
+    assert upstream.calls == ["primary"] * 10
+    assert served_model() == "primary"
+
+
+def test_failed_probe_keeps_the_primary_out():
+    router = ModelRouter(POLICY, stats=ModelStats(probe_interval=0.2), hedge_workers=2, fallback_workers=2)
+    upstream = Upstream(fail_primary=True)
+    for _ in range(25):
+        router.call("prompt", 100, upstream)
+    time.sleep(0.25)
+    upstream.calls.clear()
+    for _ in range(5):
+        assert router.call("prompt", 100, upstream) == "fast answer"
+    # One probe (primary, then its retry on the fallback), then the fallback alone until the next interval
+    assert upstream.calls == ["primary", "fast"] + ["fast"] * 4
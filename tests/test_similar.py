@@ -0,0 +1,78 @@
+from similar import SimilarIndex, jaccard, normalize_question, shingles
+
+
+def make_index(*entries):
+    index = SimilarIndex(None, threshold=0.85)
+    for entry_id, (endpoint, question) in enumerate(entries):
+        index.add(entry_id, endpoint, question, "physics", "teacher")
+    return index
+
+
+def test_rephrased_explain_question_matches():
+    index = make_index(("explain", "What is osmosis?"))
+    entry_id, score = index.match("explain", "explain osmosis pls", "physics", "teacher")
+    assert entry_id == 0 and score == 1.0
+
+
+def test_scope_must_match():
+    index = make_index(("explain", "What is osmosis?"))
+    assert index.match("explain", "what is osmosis", "biology", "teacher") is None
+    assert index.match("explain", "what is osmosis", "physics", "smart") is None
+    assert index.match("solve", "what is osmosis", "physics", "teacher") is None
+
+
+def test_solve_with_changed_unit_does_not_match():
+    kmh = "If a train travels 120 km in 2 hours, what is its average speed in km/h?"
+    ms = "If a train travels 120 km in 2 hours, what is its average speed in m/s?"
+    # Near-identical text, and the same numbers: only the exact word check tells them apart
+    assert jaccard(shingles(normalize_question(kmh)), shingles(normalize_question(ms))) > 0.85
+    index = make_index(("solve", kmh))
+    assert index.match("solve", ms, "physics", "teacher") is None
+    assert index.match("solve-batch", ms, "physics", "teacher") is None
+
+
+def test_solve_with_changed_operator_or_numbers_does_not_match():
+    index = make_index(("solve", "Solve 2x + 3 = 7"))
+    assert index.match("solve", "Solve 2x - 3 = 7", "physics", "teacher") is None
+    assert index.match("solve", "Solve 2x + 3 = 8", "physics", "teacher") is None
+
+
+def test_solve_matches_when_only_filler_words_differ():
+    index = make_index(("solve", "Solve 2x + 3 = 7"))
+    entry_id, _ = index.match("solve", "can you please solve 2x + 3 = 7?", "physics", "teacher")
+    assert entry_id == 0
+
+
+def test_explain_with_changed_prefix_does_not_match():
+    for stored, asked in [("advantages of nuclear energy", "disadvantages of nuclear energy"),
+                          ("inflation and its effects on economy", "deflation and its effects on economy")]:
+        # Character shingles barely notice the prefix; the word check does
+        assert jaccard(shingles(normalize_question(stored)), shingles(normalize_question(asked))) > 0.85
+        index = make_index(("explain", stored))
+        assert index.match("explain", asked, "physics", "teacher") is None
+
+
+def test_explain_matches_across_plural_endings():
+    index = make_index(("explain", "explain the structure of plant cells"))
+    entry_id, _ = index.match("explain", "structure of a plant cell", "physics", "teacher")
+    assert entry_id == 0
+
+
+def test_score_is_the_exact_similarity_not_the_estimate():
+    stored, asked = "what is osmosis in plant cells", "explain osmosis in plant cell"
+    exact = jaccard(shingles(normalize_question(stored)), shingles(normalize_question(asked)))
+    index = make_index(("explain", stored))
+    assert index.match("explain", asked, "physics", "teacher") == (0, exact)
+
+
+def test_near_threshold_pair_is_decided_exactly():
+    # Exact similarity 0.73; the 64-value MinHash estimate for this pair is 0.83
+    stored, asked = "photosynthesis in c4 plants", "photosynthesis in cam plants"
+    assert jaccard(shingles(normalize_question(stored)), shingles(normalize_question(asked))) < 0.85
+    index = make_index(("explain", stored))
+    assert index.match("explain", asked, "physics", "teacher") is None
+
+
+def test_unrelated_question_misses():
+    index = make_index(("explain", "What is osmosis?"), ("explain", "Explain mitosis"))
+    assert index.match("explain", "what is the krebs cycle", "physics", "teacher") is None
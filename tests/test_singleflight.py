@@ -0,0 +1,170 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+import pytest
+
+from singleflight import AsyncSingleFlight, MongoLease, SingleFlight, bypass_lease, flight_key
+
+CALLERS = 20
+
+
+class SlowUpstream:
+    """Counts calls; each one blocks until released so every caller is in flight at once."""
+
+    def __init__(self, result="answer", error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def run_concurrently(flight, upstream, key="k"):
+    with ThreadPoolExecutor(max_workers=CALLERS) as pool:
+        futures = [pool.submit(flight.do, key, upstream) for _ in range(CALLERS)]
+        deadline = time.monotonic() + 5
+        while flight.stats()["coalesced"] < CALLERS - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        upstream.release.set()
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except Exception as e:
+                outcomes.append(e)
+    return outcomes
+
+
+def test_flight_key_depends_on_model_prompt_and_max_tokens():
+    key = flight_key("gpt-4", "prompt", 700)
+    assert key == flight_key("gpt-4", "prompt", 700)
+    assert len({key, flight_key("gpt-4o-mini", "prompt", 700), flight_key("gpt-4", "prompt!", 700),
+                flight_key("gpt-4", "prompt", 150)}) == 4
+
+
+def test_concurrent_identical_calls_make_one_upstream_call():
+    flight, upstream = SingleFlight(), SlowUpstream()
+    assert run_concurrently(flight, upstream) == ["answer"] * CALLERS
+    assert upstream.calls == 1
+    assert flight.stats() == {"leaders": 1, "coalesced": CALLERS - 1, "remote_hits": 0, "lease_errors": 0, "in_flight": 0}
+
+
+def test_leader_error_propagates_to_followers():
+    flight, upstream = SingleFlight(), SlowUpstream(error=RuntimeError("upstream down"))
+    outcomes = run_concurrently(flight, upstream)
+    assert upstream.calls == 1
+    assert all(isinstance(outcome, RuntimeError) and str(outcome) == "upstream down" for outcome in outcomes)
+
+
+def test_finished_flight_is_not_reused():
+    flight, calls = SingleFlight(), []
+    for _ in range(3):
+        flight.do("k", lambda: calls.append(1) or len(calls))
+    assert len(calls) == 3
+
+
+def test_async_concurrent_identical_calls_make_one_upstream_call():
+    async def main():
+        flight, calls, gate = AsyncSingleFlight(), [], asyncio.Event()
+
+        async def upstream():
+            calls.append(1)
+            await gate.wait()
+            return "answer"
+
+        tasks = [asyncio.ensure_future(flight.do("k", upstream)) for _ in range(CALLERS)]
+        await asyncio.sleep(0.01)
+        gate.set()
+        assert await asyncio.gather(*tasks) == ["answer"] * CALLERS
+        assert len(calls) == 1
+        assert flight.stats()["coalesced"] == CALLERS - 1
+
+    asyncio.run(main())
+
+
+def test_async_leader_error_propagates_to_followers():
+    async def main():
+        flight, calls, gate = AsyncSingleFlight(), [], asyncio.Event()
+
+        async def upstream():
+            calls.append(1)
+            await gate.wait()
+            raise RuntimeError("upstream down")
+
+        tasks = [asyncio.ensure_future(flight.do("k", upstream)) for _ in range(CALLERS)]
+        await asyncio.sleep(0.01)
+        gate.set()
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        assert len(calls) == 1
+        assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def leases():
+    return mongomock.MongoClient().db.upstream_leases
+
+
+def test_mongo_lease_leader_wait_done(leases):
+    first, second = MongoLease(leases), MongoLease(leases)
+    second.owner = "other-worker"
+    assert first.acquire("k") == ("leader", None)
+    assert second.acquire("k") == ("wait", None)
+    assert second.check("k") == ("wait", None)
+    first.publish("k", "answer")
+    assert second.check("k") == ("done", "answer")
+    assert second.acquire("k") == ("done", "answer")
+
+
+def test_mongo_lease_release_and_takeover(leases):
+    first, second = MongoLease(leases, lease_ttl=0.05), MongoLease(leases)
+    second.owner = "other-worker"
+    assert first.acquire("k") == ("leader", None)
+    first.release("k")
+    assert second.check("k") == ("gone", None)
+
+    assert first.acquire("k") == ("leader", None)
+    time.sleep(0.1)
+    # The holder died without releasing: its lease is taken over once expired
+    assert second.check("k") == ("gone", None)
+    assert second.acquire("k") == ("leader", None)
+    assert leases.find_one({"_id": "k"})["owner"] == "other-worker"
+
+
+def test_workers_share_one_upstream_call_through_the_lease(leases):
+    calls = []
+    worker_a, worker_b = SingleFlight(MongoLease(leases), poll_interval=0.01), SingleFlight(MongoLease(leases), poll_interval=0.01)
+    worker_b.lease.owner = "other-worker"
+    assert worker_a.do("k", lambda: calls.append(1) or "answer") == "answer"
+    assert worker_b.do("k", lambda: calls.append(1) or "fresh") == "answer"
+    assert len(calls) == 1
+    assert worker_b.stats()["remote_hits"] == 1
+
+
+def test_bypass_lease_skips_published_results(leases):
+    calls = []
+    worker_a, worker_b = SingleFlight(MongoLease(leases)), SingleFlight(MongoLease(leases))
+    worker_b.lease.owner = "other-worker"
+    worker_a.do("k", lambda: calls.append(1) or "answer")
+
+    def no_cache_request():
+        bypass_lease()
+        return worker_b.do("k", lambda: calls.append(1) or "fresh")
+
+    # A request's context, so the bypass doesn't leak into other tests
+    assert contextvars.copy_context().run(no_cache_request) == "fresh"
+    assert len(calls) == 2
+    assert worker_b.stats()["remote_hits"] == 0
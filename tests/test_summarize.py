@@ -0,0 +1,103 @@
+import threading
+
+from budget import MIN_COMPLETION_TOKENS, count_tokens, input_budget
+from prompts import YOUTUBE_REDUCE_NOTE
+from summarize import (SUMMARY_MAP_MAX_TOKENS, SUMMARY_MAX_TOKENS, SUMMARY_MODEL, estimate_tokens, map_max_tokens,
+                       reduce_budget, reduce_prompt, split_transcript, summarize_transcript)
+
+
+def transcript(lines, words=12):
+    return "\n".join(f"[{i * 5.0}s] " + " ".join(f"word{i}_{j}" for j in range(words)) for i in range(lines))
+
+
+class StubCall:
+    """Stands in for call_openai: records every (prompt, max_tokens) and answers map and reduce calls."""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, max_tokens=700):
+        with self._lock:
+            self.calls.append((prompt, max_tokens))
+        if YOUTUBE_REDUCE_NOTE in prompt:
+            return "### Summary\nmerged"
+        if prompt.lstrip().startswith("You are summarizing part"):
+            return f"- [0.0s] note {len(self.calls)}"
+        return "### Summary\nsingle"
+
+    def reduces(self):
+        return [call for call in self.calls if YOUTUBE_REDUCE_NOTE in call[0]]
+
+    def maps(self):
+        return [call for call in self.calls if call[0].lstrip().startswith("You are summarizing part")]
+
+
+def test_split_respects_budget_on_line_boundaries():
+    text = transcript(200)
+    segments = split_transcript(text, max_tokens=300)
+    assert len(segments) > 1
+    for segment in segments:
+        assert sum(estimate_tokens(line) + 1 for line in segment.split("\n")) <= 300
+        assert all(line.startswith("[") for line in segment.split("\n"))
+
+
+def test_split_has_no_overlap_or_gaps():
+    text = transcript(200)
+    segments = split_transcript(text, max_tokens=300)
+    assert "\n".join(segments) == text
+    lines = [line for segment in segments for line in segment.split("\n")]
+    assert len(lines) == len(set(lines)) == 200
+
+
+def test_split_keeps_an_oversized_line_whole():
+    long_line = "[0.0s] " + "word " * 500
+    segments = split_transcript("[1.0s] short\n" + long_line + "\n[2.0s] short", max_tokens=50)
+    assert segments == ["[1.0s] short", long_line, "[2.0s] short"]
+
+
+def test_short_transcript_is_one_segment():
+    assert split_transcript("[0.0s] hello", max_tokens=300) == ["[0.0s] hello"]
+
+
+def test_map_max_tokens_caps_and_shrinks():
+    assert map_max_tokens("vid", 1) == SUMMARY_MAP_MAX_TOKENS
+    many = map_max_tokens("vid", 200)
+    assert MIN_COMPLETION_TOKENS <= many < SUMMARY_MAP_MAX_TOKENS
+    assert map_max_tokens("vid", 10000) == MIN_COMPLETION_TOKENS
+    # Partial notes at their full budget still fit the reduce prompt
+    segments = 40
+    assert map_max_tokens("vid", segments) * segments <= reduce_budget("vid")
+
+
+def test_reduce_prompt_orders_parts_and_fits_context():
+    prompt = reduce_prompt("vid", ["first", "second", "third"])
+    assert YOUTUBE_REDUCE_NOTE in prompt
+    assert prompt.index("Part 1:\nfirst") < prompt.index("Part 2:\nsecond") < prompt.index("Part 3:\nthird")
+
+    huge = [transcript(60) for _ in range(20)]
+    prompt = reduce_prompt("vid", huge)
+    assert count_tokens(prompt, SUMMARY_MODEL) <= input_budget(SUMMARY_MODEL, SUMMARY_MAX_TOKENS)
+
+
+def test_short_transcript_is_one_call():
+    call = StubCall()
+    assert summarize_transcript("vid", transcript(5), call) == "### Summary\nsingle"
+    assert len(call.calls) == 1
+    assert call.calls[0][1] == SUMMARY_MAX_TOKENS
+
+
+def test_long_transcript_maps_each_segment_then_reduces_once():
+    text = transcript(400)
+    expected_segments = len(split_transcript(text))
+    call = StubCall()
+    assert summarize_transcript("vid", text, call, threshold=1000) == "### Summary\nmerged"
+    assert expected_segments > 1
+    assert len(call.maps()) == expected_segments
+    assert len(call.reduces()) == 1
+    assert len(call.calls) == expected_segments + 1
+    assert all(max_tokens == map_max_tokens("vid", expected_segments) for _, max_tokens in call.maps())
+    reduce_text, reduce_max_tokens = call.reduces()[0]
+    assert reduce_max_tokens == SUMMARY_MAX_TOKENS
+    for index in range(expected_segments):
+        assert f"Part {index + 1}:" in reduce_text
@@ -0,0 +1,146 @@
+# transcripts.py
+"""
+Shared YouTube transcript store for /summarize-youtube and /chat-youtube.
+- Tier 1: in-process LRUCache of formatted transcripts.
+- Tier 2: MongoDB collection holding the zlib-compressed transcript text and segments keyed by video_id.
+- Concurrent fetches for the same video are coalesced into a single YouTubeTranscriptApi call.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+from datetime import datetime
+
+from youtube_transcript_api import YouTubeTranscriptApi
+
+from cache import LRUCache
+from metrics import stage, timed
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", 128))
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", 24 * 60 * 60))
+
+
+def extract_video_id(video_url):
+    """Return the 11-character video ID from a YouTube URL, or None."""
+    match = re.search(r'(?:v=|\/)([0-9A-Za-z_-]{11})', video_url)
+    return match.group(1) if match else None
+
+
+def format_transcript(segments):
+    """Render transcript segments as the timestamped text the prompts expect."""
+    return "\n".join([f"[{item['start']:.1f}s] {item['text']}" for item in segments])
+
+
+def compress_transcript(transcript):
+    return zlib.compress(json.dumps(transcript).encode("utf-8"))
+
+
+def decompress_transcript(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class TranscriptStore:
+    """
+    Fetch-once transcript lookup.
+    - get(video_id) returns {"video_id", "text", "segments"} or None when the video has no transcript.
+    - Errors from YouTubeTranscriptApi propagate to the caller exactly as before.
+    """
+
+    def __init__(self, collection=None, maxsize=TRANSCRIPT_CACHE_SIZE, ttl=TRANSCRIPT_CACHE_TTL, fetch=None):
+        self.collection = collection
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.fetch = fetch or YouTubeTranscriptApi.get_transcript
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "mongo_hits": 0, "fetches": 0, "coalesced": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    @timed("transcript")
+    def get(self, video_id):
+        transcript = self.memory.get(video_id)
+        if transcript is not None:
+            self._count("memory_hits")
+            return transcript
+
+        with self._lock:
+            flight = self._inflight.get(video_id)
+            leader = flight is None
+            if leader:
+                flight = {"event": threading.Event(), "result": None, "error": None}
+                self._inflight[video_id] = flight
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight["event"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["result"]
+
+        try:
+            flight["result"] = self._load(video_id)
+            return flight["result"]
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(video_id, None)
+            flight["event"].set()
+
+    def _load(self, video_id):
+        transcript = self._load_from_mongo(video_id)
+        if transcript is not None:
+            self._count("mongo_hits")
+            self.memory.set(video_id, transcript)
+            return transcript
+
+        logger.info(f"Fetching transcript for video ID: {video_id}")
+        self._count("fetches")
+        with stage("transcript_fetch"):
+            segments = self.fetch(video_id)
+        if not segments:
+            return None
+        segments = [{"start": item["start"], "duration": item.get("duration", 0), "text": item["text"]} for item in segments]
+        transcript = {"video_id": video_id, "text": format_transcript(segments), "segments": segments}
+        self.memory.set(video_id, transcript)
+        self._save_to_mongo(video_id, transcript)
+        return transcript
+
+    def _load_from_mongo(self, video_id):
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one({"_id": video_id}, {"data": 1})
+        except Exception as e:
+            logger.warning(f"Transcript store lookup failed: {e}")
+            self._count("errors")
+            return None
+        return decompress_transcript(doc["data"]) if doc else None
+
+    def _save_to_mongo(self, video_id, transcript):
+        if self.collection is None:
+            return
+        try:
+            self.collection.replace_one(
+                {"_id": video_id},
+                {"_id": video_id, "data": compress_transcript(transcript), "createdAt": datetime.utcnow()},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Transcript store write failed: {e}")
+            self._count("errors")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["memory_size"] = len(self.memory)
+        return stats
@@ -0,0 +1,138 @@
+# worker.py
+"""
+Summary job worker: processes /summarize-youtube/jobs submissions from the summary_jobs queue (jobs.py).
+- SUMMARY_WORKERS threads each claim a job under a lease, renew the lease while working, fetch the transcript,
+  generate the summary (map-reduce for long videos) and complete the job, or hand it back for a retry.
+- A video without a transcript fails at once with the synchronous route's 400 error; other errors are retried.
+- Runs as the Procfile "worker" process, next to web. SIGTERM or SIGINT stops claiming new jobs and lets the
+  running ones finish; a job cut off mid-way is picked up again when its lease expires.
+    python worker.py
+"""
+
+import logging
+import os
+import signal
+import socket
+import threading
+
+from dotenv import load_dotenv
+
+from db import db
+from jobs import SummaryJobs
+from metrics import begin_request, timed
+from openai_client import OpenAIClient, build_session
+from routing import ROUTING_FALLBACK_WORKERS, ROUTING_HEDGE_WORKERS, ModelRouter
+from summarize import SUMMARY_MAP_WORKERS, summarize_transcript
+from transcripts import TranscriptStore
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", 4))
+SUMMARY_JOB_POLL_INTERVAL = float(os.getenv("SUMMARY_JOB_POLL_INTERVAL", 1.0))
+
+
+class SummaryWorker:
+    """
+    Pool of threads draining the summary job queue.
+    - call(prompt, max_tokens=...) performs one upstream completion, as for summarize_transcript().
+    """
+
+    def __init__(self, jobs, transcript_store, call, workers=SUMMARY_WORKERS, poll_interval=SUMMARY_JOB_POLL_INTERVAL):
+        self.jobs = jobs
+        self.transcript_store = transcript_store
+        self.call = call
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        self._threads = []
+
+    def process(self, job, owner):
+        video_id = job["video_id"]
+        if job["attempts"] > self.jobs.max_attempts:
+            self.jobs.fail(job, owner, "Summary job was abandoned by its worker too many times", retry=False)
+            return
+        begin_request("/summarize-youtube")
+        finished = threading.Event()
+
+        def heartbeat():
+            while not finished.wait(self.jobs.lease_ttl / 3):
+                if not self.jobs.renew(job, owner):
+                    logger.warning(f"Summary job {job['_id']} lease was taken over")
+                    return
+
+        threading.Thread(target=heartbeat, name=f"lease-{job['_id']}", daemon=True).start()
+        try:
+            transcript = self.transcript_store.get(video_id)
+            if not transcript:
+                logger.error(f"No transcript available for video ID: {video_id}")
+                self.jobs.fail(job, owner, "No transcript available for this video", status=400, retry=False)
+                return
+            response = summarize_transcript(video_id, transcript["text"], self.call)
+            self.jobs.complete(job, owner, response)
+        except Exception as e:
+            logger.error(f"Error summarizing YouTube video {video_id}: {e}")
+            self.jobs.fail(job, owner, e)
+        finally:
+            finished.set()
+
+    def run(self, owner):
+        while not self.stopping.is_set():
+            try:
+                job = self.jobs.claim(owner)
+            except Exception as e:
+                logger.error(f"Could not claim a summary job: {e}")
+                job = None
+            if job is None:
+                self.stopping.wait(self.poll_interval)
+                continue
+            try:
+                self.process(job, owner)
+            except Exception as e:
+                # Bookkeeping failed (e.g. MongoDB down); the lease expires and the job is claimed again
+                logger.error(f"Summary job {job['_id']} left unfinished: {e}")
+
+    def start(self):
+        host = f"{socket.gethostname()}:{os.getpid()}"
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.run, args=(f"{host}:{index}",), name=f"summary-worker-{index}")
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} summary workers")
+
+    def stop(self, *_):
+        logger.info("Stopping summary workers after their current jobs")
+        self.stopping.set()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    if not OPENAI_API_KEY:
+        logger.error("OPENAI_API_KEY not set")
+        raise ValueError("OPENAI_API_KEY environment variable is required")
+    # Each worker thread fans out to SUMMARY_MAP_WORKERS map calls, some of them through the router's
+    # primary and fallback pools
+    pool_size = int(os.getenv("OPENAI_POOL_SIZE", 0)) or SUMMARY_WORKERS * SUMMARY_MAP_WORKERS + ROUTING_HEDGE_WORKERS + ROUTING_FALLBACK_WORKERS
+    openai_client = OpenAIClient(OPENAI_API_KEY, session=build_session(pool_size))
+    model_router = ModelRouter()
+
+    @timed("upstream")
+    def call_openai(prompt, max_tokens=700, model=None):
+        return model_router.call(prompt, max_tokens, openai_client.chat_completion, model)
+
+    summary_jobs = SummaryJobs(db["summary_jobs"])
+    summary_jobs.ensure_indexes()
+    worker = SummaryWorker(summary_jobs, TranscriptStore(db["transcripts"]), call_openai)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.start()
+    worker.join()
+
+
+if __name__ == "__main__":
+    main()